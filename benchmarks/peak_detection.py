@@ -0,0 +1,41 @@
+"""
+Time the peak detection on a 1M point pattern with 200 Gaussian peaks on a linear background.
+
+    python -m benchmarks.peak_detection
+"""
+import time
+
+import numpy as np
+from lmfit.lineshapes import gaussian
+
+from peak_prophet_server.pattern import Pattern
+from peak_prophet_server.peak_detection import detect_peaks
+
+
+def create_pattern(n_points=1_000_000, n_peaks=200, noise=1.0, seed=1):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(10, 110, n_points)
+    y = 50 + 0.2 * x + rng.normal(0, noise, n_points)
+    centers = np.sort(rng.uniform(12, 108, n_peaks))
+    for center in centers:
+        y += gaussian(x, rng.uniform(5, 50), center, 0.05)
+    return Pattern(x, y), centers
+
+
+def main(repeat=5):
+    pattern, centers = create_pattern()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        background, peaks = detect_peaks(pattern)
+        times.append(time.perf_counter() - start)
+
+    found = np.array([peak['parameters'][1]['value'] for peak in peaks])
+    distance = np.abs(found[:, None] - centers[None, :]).min(axis=1)
+    print(f'{len(pattern)} points, {len(centers)} peaks (some overlapping)')
+    print(f'detection time: best {min(times) * 1e3:.0f} ms, median {np.median(times) * 1e3:.0f} ms')
+    print(f'detected peaks: {len(peaks)}, more than 0.05 from a true center: {np.sum(distance > 0.05)}')
+
+
+if __name__ == '__main__':
+    main()
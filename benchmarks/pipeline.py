@@ -0,0 +1,277 @@
+"""
+Time the phases of a fit request on synthetic patterns for a grid of point counts, peak counts, peak types and
+background types, and save the results as JSON to compare them between commits.
+
+    python -m benchmarks.pipeline --quick
+    python -m benchmarks.pipeline --points 10000 100000 --peaks 10 100 --output results.json
+    python -m benchmarks.pipeline --compare base.json results.json
+
+Timed phases (in seconds, the best of --repeat runs):
+
+- parse: reading and checking the request (decode_request)
+- read_data_cold, read_data: read_data with an empty and a filled model cache
+- fit: FitManager.fit, the solver including the uncertainties, with nfev and the time per evaluation
+- iter_cb: one call of FitManager.iter_cb, the overhead per function evaluation
+- progress: FitManager.create_progress, creating a progress message from a snapshot
+- peaks_output: create_peaks_output
+- fit_request, multiresolution: with --multiresolution, FitManager.process_request of the request at full
+  resolution only and with "multiresolution": true, with their nfev
+
+Fitting many peaks is slow, fits with more than --max-fit-peaks peaks are skipped and their fit results are null.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import lmfit
+import numpy as np
+from lmfit.lineshapes import gaussian, lorentzian, pvoigt
+
+from peak_prophet_server.data_reader import (
+    convert_gaussian_fwhm_to_sigma,
+    convert_lorentzian_fwhm_to_sigma,
+    read_data,
+    base_parameter_names,
+    model_cache,
+)
+from peak_prophet_server.fitting import FitManager, create_peaks_output
+from peak_prophet_server.result_cache import result_cache
+from peak_prophet_server.schema import decode_request
+
+POINTS = (1_000, 10_000, 100_000, 1_000_000)
+PEAKS = (1, 10, 100, 500)
+PEAK_TYPES = ('gaussian', 'lorentzian', 'pseudovoigt')
+BACKGROUNDS = ('linear', 'quadratic', 'polynomial')
+QUICK = {'points': (1_000, 100_000), 'peaks': (1, 10), 'peak_types': ('gaussian', 'pseudovoigt'),
+         'backgrounds': ('linear',)}
+# minimum number of points per peak, cases with fewer points cannot resolve the peaks and are skipped
+MIN_POINTS_PER_PEAK = 20
+MAX_FIT_PEAKS = 50
+POLYNOMIAL_DEGREE = 4
+TIMED = ('parse', 'read_data_cold', 'read_data', 'fit', 'evaluation', 'iter_cb', 'progress', 'peaks_output',
+         'fit_request', 'multiresolution')
+# a phase is reported as regression if it is slower than the base by this factor
+REGRESSION_FACTOR = 1.2
+
+
+def create_request(n_points, n_peaks, peak_type='gaussian', background='linear', seed=1):
+    """
+    Request with evenly spaced peaks on x = 0..100 and initial values off by up to 10 %.
+    :rtype: str
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 100, n_points)
+    spacing = 100 / n_peaks
+    fwhm = min(1.0, spacing / 5)
+    match background:
+        case 'linear':
+            coefficients = {'intercept': 10.0, 'slope': 0.05}
+            y = 10 + 0.05 * x
+        case 'quadratic':
+            coefficients = {'c': 10.0, 'b': 0.05, 'a': -2e-4}
+            y = 10 + 0.05 * x - 2e-4 * x ** 2
+        case _:
+            coefficients = {f'c{i}': 10.0 if i == 0 else 0.1 ** (i + 1) for i in range(POLYNOMIAL_DEGREE + 1)}
+            y = np.polynomial.polynomial.polyval(x, list(coefficients.values()))
+    y = y + rng.normal(0, 0.1, n_points)
+
+    peaks = []
+    for i in range(n_peaks):
+        amplitude = rng.uniform(5, 20)
+        center = spacing * (i + 0.5)
+        match peak_type:
+            case 'gaussian':
+                y += gaussian(x, amplitude, center, convert_gaussian_fwhm_to_sigma(fwhm))
+            case 'lorentzian':
+                y += lorentzian(x, amplitude, center, convert_lorentzian_fwhm_to_sigma(fwhm))
+            case _:
+                y += pvoigt(x, amplitude, center, convert_lorentzian_fwhm_to_sigma(fwhm), 0.5)
+        values = {'amplitude': amplitude * rng.uniform(0.9, 1.1), 'center': center + rng.uniform(-0.1, 0.1) * fwhm,
+                  'fwhm': fwhm * rng.uniform(0.9, 1.1)}
+        if peak_type == 'pseudovoigt':
+            values['fraction'] = 0.4
+        peaks.append({'type': peak_type,
+                      'parameters': [{'name': name, 'value': value, 'vary': True, 'min': None, 'max': None}
+                                     for name, value in values.items()]})
+
+    background_dict = {'type': background,
+                       'parameters': [{'name': name, 'value': 0.0, 'vary': True, 'min': None, 'max': None}
+                                      for name in coefficients]}
+    if background == 'polynomial':
+        background_dict['degree'] = POLYNOMIAL_DEGREE
+    return json.dumps({'pattern': {'x': x.tolist(), 'y': y.tolist()}, 'peaks': peaks, 'background': background_dict})
+
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_case(n_points, n_peaks, peak_type, background, engine='flat', repeat=3, max_fit_peaks=MAX_FIT_PEAKS,
+             multiresolution=False):
+    """
+    Time the phases of one case.
+    :param multiresolution: also time the whole request with and without the multiresolution fit
+    :rtype: dict
+    """
+    request = create_request(n_points, n_peaks, peak_type, background)
+    flat = engine == 'flat'
+    result = {'points': n_points, 'peaks': n_peaks, 'peak_type': peak_type, 'background': background,
+              'engine': engine}
+
+    result['parse'] = best_time(lambda: decode_request(request), repeat)
+    data_dict = decode_request(request)
+    model_cache.clear()
+    start = time.perf_counter()
+    pattern, model, params = read_data(data_dict, flat)
+    result['read_data_cold'] = time.perf_counter() - start
+    result['read_data'] = best_time(lambda: read_data(data_dict, flat), repeat)
+
+    fit_manager = FitManager('BENCHMARK')
+    fit_manager.data_dict = data_dict
+    fit_manager.pattern = pattern
+    fit_manager.params = params
+    fit_manager.progress_names = base_parameter_names(params)
+
+    if n_peaks <= max_fit_peaks:
+        start = time.perf_counter()
+        fit_manager.fit(pattern, model, params)
+        result['fit'] = time.perf_counter() - start
+        result['nfev'] = fit_manager.result.nfev
+        result['evaluation'] = result['fit'] / max(fit_manager.result.nfev, 1)
+        result['success'] = bool(fit_manager.result.success)
+        output_params = fit_manager.result.params
+    else:
+        result.update({'fit': None, 'nfev': None, 'evaluation': None, 'success': None})
+        output_params = params
+
+    resid = np.ascontiguousarray(pattern.y - pattern.y.mean())
+    calls = max(10, min(1000, 10_000_000 // n_points))
+    result['iter_cb'] = best_time(lambda: [fit_manager.iter_cb(params, i, resid) for i in range(calls)],
+                                  repeat) / calls
+    snapshot = fit_manager._snapshot
+    result['progress'] = best_time(lambda: fit_manager.create_progress(*snapshot), repeat)
+    result['peaks_output'] = best_time(lambda: create_peaks_output(data_dict['peaks'], output_params), repeat)
+
+    if multiresolution and n_peaks <= max_fit_peaks:
+        for phase, option in (('fit_request', False), ('multiresolution', True)):
+            phase_request = json.dumps({**json.loads(request), 'engine': engine, 'multiresolution': option})
+            result_cache.clear()
+            start = time.perf_counter()
+            response = asyncio.run(FitManager('BENCHMARK').process_request(phase_request))
+            result[phase] = time.perf_counter() - start
+            result[f'{phase}_nfev'] = response['nfev']
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'date': datetime.now(timezone.utc).isoformat(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'lmfit': lmfit.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+
+def case_key(result):
+    return result['points'], result['peaks'], result['peak_type'], result['background'], result['engine']
+
+
+def compare(base, new, factor=REGRESSION_FACTOR):
+    """
+    Print the ratio of the new to the base times of the cases in both results.
+    :return: number of regressions, phases slower than the base by more than factor
+    :rtype: int
+    """
+    base_results = {case_key(result): result for result in base['results']}
+    regressions = 0
+    print(f"base {base['environment']['commit']}, new {new['environment']['commit']}")
+    for result in new['results']:
+        base_result = base_results.get(case_key(result))
+        if base_result is None:
+            continue
+        ratios = []
+        for phase in TIMED:
+            if result.get(phase) is None or not base_result.get(phase):
+                continue
+            ratio = result[phase] / base_result[phase]
+            regression = ratio > factor
+            regressions += regression
+            ratios.append(f"{phase} {ratio:.2f}{' !' if regression else ''}")
+        print(f"{format_case(result)}: {', '.join(ratios)}")
+    return regressions
+
+
+def format_case(result):
+    return (f"{result['points']:>8} points {result['peaks']:>4} {result['peak_type']:<11} "
+            f"{result['background']:<10} {result['engine']}")
+
+
+def format_result(result):
+    phases = ', '.join(f'{phase} {result[phase] * 1e3:.3g} ms' for phase in TIMED if result.get(phase) is not None)
+    nfev = f", nfev {result['nfev']}" if result.get('nfev') is not None else ''
+    if result.get('multiresolution') is not None:
+        nfev += (f", request nfev {result['fit_request_nfev']}, multiresolution nfev {result['multiresolution_nfev']}"
+                 f" ({result['fit_request'] / result['multiresolution']:.2f}x)")
+    return f'{format_case(result)}: {phases}{nfev}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, nargs='+', default=POINTS)
+    parser.add_argument('--peaks', type=int, nargs='+', default=PEAKS)
+    parser.add_argument('--peak-types', nargs='+', default=PEAK_TYPES, choices=PEAK_TYPES)
+    parser.add_argument('--backgrounds', nargs='+', default=BACKGROUNDS, choices=BACKGROUNDS)
+    parser.add_argument('--engine', default='flat', choices=('flat', 'lmfit'))
+    parser.add_argument('--quick', action='store_true', help='small grid for a fast check')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-fit-peaks', type=int, default=MAX_FIT_PEAKS)
+    parser.add_argument('--multiresolution', action='store_true',
+                        help='compare whole requests with and without the multiresolution fit')
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two result files')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        regressions = compare(base, new)
+        print(f'{regressions} regressions (slower by more than {REGRESSION_FACTOR}x)')
+        return 1 if regressions else 0
+
+    grid = QUICK if args.quick else {'points': args.points, 'peaks': args.peaks, 'peak_types': args.peak_types,
+                                     'backgrounds': args.backgrounds}
+    results = []
+    for n_points in grid['points']:
+        for n_peaks in grid['peaks']:
+            if n_points < MIN_POINTS_PER_PEAK * n_peaks:
+                continue
+            for peak_type in grid['peak_types']:
+                for background in grid['backgrounds']:
+                    result = run_case(n_points, n_peaks, peak_type, background, args.engine, args.repeat,
+                                      args.max_fit_peaks, args.multiresolution)
+                    print(format_result(result), flush=True)
+                    results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Compare the solver backends (the "solver" option of a fit request) on representative peak fitting problems and
+save the results as JSON.
+
+    python -m benchmarks.solvers
+    python -m benchmarks.solvers --points 100000 --peaks 20 --engine lmfit --output solvers.json
+
+Problems, all with start values off by up to 10 % unless noted:
+
+- separated: Gaussian peaks far apart from each other
+- overlapping: pairs of pseudo-Voigt peaks half a fwhm apart
+- bounded: like separated, with bounds on all peak parameters, which leastsq transforms away and
+  least_squares handles itself
+- far_start: like separated, with the centers half a fwhm and the widths 50 % off
+
+For every solver the best fit time of --repeat runs, the function evaluations, the chi2 relative to the
+smallest chi2 of the problem and whether the fit succeeded are printed.
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+from lmfit.lineshapes import pvoigt
+
+from benchmarks.pipeline import create_request, environment
+from peak_prophet_server.data_reader import convert_lorentzian_fwhm_to_sigma, read_data, base_parameter_names
+from peak_prophet_server.fitting import FitManager
+from peak_prophet_server.schema import decode_request
+from peak_prophet_server.solvers import solver_options
+
+PROBLEMS = ('separated', 'overlapping', 'bounded', 'far_start')
+SOLVERS = {
+    'leastsq': {'method': 'leastsq'},
+    'leastsq_unscaled': {'method': 'leastsq', 'x_scale': 1.0},
+    'least_squares': {'method': 'least_squares'},
+    'least_squares_unscaled': {'method': 'least_squares', 'x_scale': 1.0},
+    'leastsq_loose': {'method': 'leastsq', 'ftol': 1e-5, 'xtol': 1e-5},
+}
+
+
+def create_problem(problem, n_points, n_peaks, seed=1):
+    """
+    :return: the fit request of a problem
+    :rtype: dict
+    """
+    if problem == 'overlapping':
+        return create_overlapping_request(n_points, n_peaks, seed)
+    request = json.loads(create_request(n_points, n_peaks, 'gaussian', 'linear', seed))
+    for peak in request['peaks']:
+        parameters = {p['name']: p for p in peak['parameters']}
+        fwhm = parameters['fwhm']['value']
+        if problem == 'bounded':
+            parameters['amplitude']['min'] = 0
+            parameters['center'].update(min=parameters['center']['value'] - fwhm,
+                                        max=parameters['center']['value'] + fwhm)
+            parameters['fwhm'].update(min=fwhm / 4, max=fwhm * 4)
+        elif problem == 'far_start':
+            parameters['center']['value'] += fwhm / 2
+            parameters['fwhm']['value'] = fwhm * 1.5
+    return request
+
+
+def create_overlapping_request(n_points, n_peaks, seed=1):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 100, n_points)
+    y = 10 + 0.05 * x + rng.normal(0, 0.1, n_points)
+    n_pairs = max(1, n_peaks // 2)
+    fwhm = min(1.0, 100 / n_pairs / 8)
+    sigma = convert_lorentzian_fwhm_to_sigma(fwhm)
+    peaks = []
+    for i in range(n_pairs):
+        for center in 100 / n_pairs * (i + 0.5) + np.array([-0.25, 0.25]) * fwhm:
+            amplitude = rng.uniform(5, 20)
+            y += pvoigt(x, amplitude, center, sigma, 0.5)
+            values = {'amplitude': amplitude * rng.uniform(0.9, 1.1),
+                      'center': center + rng.uniform(-0.1, 0.1) * fwhm,
+                      'fwhm': fwhm * rng.uniform(0.9, 1.1), 'fraction': 0.4}
+            peaks.append({'type': 'pseudovoigt',
+                          'parameters': [{'name': name, 'value': value} for name, value in values.items()]})
+    background = {'type': 'linear', 'parameters': [{'name': 'intercept', 'value': 0.0},
+                                                   {'name': 'slope', 'value': 0.0}]}
+    return {'pattern': {'x': x.tolist(), 'y': y.tolist()}, 'peaks': peaks, 'background': background}
+
+
+def run_solver(data_dict, solver, engine='flat', repeat=3):
+    """
+    Fit a decoded request with the solver options, the best time of repeat fits.
+    :rtype: dict
+    """
+    times = []
+    for _ in range(repeat):
+        pattern, model, params = read_data(data_dict, engine == 'flat')
+        fit_manager = FitManager('BENCHMARK')
+        fit_manager.data_dict = data_dict
+        fit_manager.pattern = pattern
+        fit_manager.params = params
+        fit_manager.progress_names = base_parameter_names(params)
+        start = time.perf_counter()
+        fit_manager.fit(pattern, model, params, solver)
+        times.append(time.perf_counter() - start)
+    result = fit_manager.result
+    return {'solver': solver_options(solver), 'fit': min(times), 'nfev': result.nfev,
+            'success': bool(result.success), 'chi2': float(result.chisqr)}
+
+
+def run_problem(problem, n_points, n_peaks, engine='flat', repeat=3, solvers=SOLVERS):
+    data_dict = decode_request(json.dumps(create_problem(problem, n_points, n_peaks)))
+    results = []
+    for name, solver in solvers.items():
+        result = run_solver(data_dict, solver, engine, repeat)
+        result.update({'problem': problem, 'points': n_points, 'peaks': len(data_dict['peaks']), 'engine': engine,
+                       'name': name})
+        results.append(result)
+    best_chi2 = min(result['chi2'] for result in results)
+    for result in results:
+        result['relative_chi2'] = result['chi2'] / best_chi2
+    return results
+
+
+def format_result(result):
+    return (f"{result['problem']:<12} {result['points']:>8} points {result['peaks']:>4} peaks {result['engine']:<6} "
+            f"{result['name']:<24} fit {result['fit'] * 1e3:8.1f} ms, nfev {result['nfev']:>5}, "
+            f"chi2 {result['relative_chi2']:.6f}{'' if result['success'] else ', failed'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--problems', nargs='+', default=PROBLEMS, choices=PROBLEMS)
+    parser.add_argument('--points', type=int, nargs='+', default=(10_000,))
+    parser.add_argument('--peaks', type=int, nargs='+', default=(10,))
+    parser.add_argument('--engine', default='flat', choices=('flat', 'lmfit'))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args(argv)
+
+    results = []
+    for problem in args.problems:
+        for n_points in args.points:
+            for n_peaks in args.peaks:
+                for result in run_problem(problem, n_points, n_peaks, args.engine, args.repeat):
+                    print(format_result(result), flush=True)
+                    results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
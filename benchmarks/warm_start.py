@@ -0,0 +1,110 @@
+"""
+Compare warm-started refits (the "warm_start" option of a fit request) with cold starts of the same request and
+save the results as JSON.
+
+    python -m benchmarks.warm_start
+    python -m benchmarks.warm_start --points 100000 --peaks 20 --local-pass --output warm_start.json
+
+The requests start from the values of the far_start problem of benchmarks.solvers, rough first guesses which
+the warm start replaces by the previous result, and the edited peak starts from the close values of
+benchmarks.pipeline. Edits between the previous request and the refit:
+
+- added_peak: the previous request has all peaks but the last one
+- nudged: the refit moves the start center of the middle peak close to its true center
+
+For both starts the best time of --repeat runs of FitManager.process_request and the function evaluations are
+printed, for the warm start without the fit of the previous request.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from benchmarks.pipeline import create_request, environment
+from benchmarks.solvers import create_problem
+from peak_prophet_server.fitting import FitManager
+from peak_prophet_server.result_cache import result_cache
+
+EDITS = ('added_peak', 'nudged')
+
+
+def create_requests(edit, n_points, n_peaks):
+    """
+    :return: the previous request and the refit request of an edit
+    :rtype: tuple[dict, dict]
+    """
+    request = create_problem('far_start', n_points, n_peaks)
+    close_peaks = json.loads(create_request(n_points, n_peaks, 'gaussian', 'linear'))['peaks']
+    refit = json.loads(json.dumps(request))
+    if edit == 'added_peak':
+        request['peaks'] = request['peaks'][:-1]
+        refit['peaks'][-1] = close_peaks[-1]
+    else:
+        i = n_peaks // 2
+        refit['peaks'][i]['parameters'][1]['value'] = close_peaks[i]['parameters'][1]['value']
+    return request, refit
+
+
+async def run_fits(previous, refit, warm):
+    fit_manager = FitManager('BENCHMARK')
+    if warm:
+        await fit_manager.process_request(json.dumps(previous))
+    result_cache.clear()
+    start = time.perf_counter()
+    response = await fit_manager.process_request(json.dumps(refit))
+    return time.perf_counter() - start, response
+
+
+def run_edit(edit, n_points, n_peaks, engine='flat', local_pass=False, repeat=3):
+    """
+    Time the refit of an edit with a warm and a cold start.
+    :rtype: dict
+    """
+    previous, refit = create_requests(edit, n_points, n_peaks)
+    previous['engine'] = refit['engine'] = engine
+    refit['warm_start'] = {'local_pass': local_pass}
+    result = {'edit': edit, 'points': n_points, 'peaks': n_peaks, 'engine': engine, 'local_pass': local_pass}
+    for start in ('warm', 'cold'):
+        runs = [asyncio.run(run_fits(previous, refit, start == 'warm')) for _ in range(repeat)]
+        duration, response = min(runs, key=lambda run: run[0])
+        result[start] = duration
+        result[f'{start}_nfev'] = response['nfev']
+        result[f'{start}_success'] = response['success']
+    result['speedup'] = result['cold'] / result['warm']
+    return result
+
+
+def format_result(result):
+    return (f"{result['edit']:<10} {result['points']:>8} points {result['peaks']:>4} peaks {result['engine']:<6} "
+            f"warm {result['warm'] * 1e3:8.1f} ms, nfev {result['warm_nfev']:>5}; "
+            f"cold {result['cold'] * 1e3:8.1f} ms, nfev {result['cold_nfev']:>5}; {result['speedup']:.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--edits', nargs='+', default=EDITS, choices=EDITS)
+    parser.add_argument('--points', type=int, nargs='+', default=(10_000,))
+    parser.add_argument('--peaks', type=int, nargs='+', default=(10,))
+    parser.add_argument('--engine', default='flat', choices=('flat', 'lmfit'))
+    parser.add_argument('--local-pass', action='store_true', help='fit the changed peaks alone first')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args(argv)
+
+    results = []
+    for edit in args.edits:
+        for n_points in args.points:
+            for n_peaks in args.peaks:
+                result = run_edit(edit, n_points, n_peaks, args.engine, args.local_pass, args.repeat)
+                print(format_result(result), flush=True)
+                results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
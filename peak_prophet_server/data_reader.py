@@ -1,30 +1,113 @@
 import numpy as np
+# several times faster than json for the large number arrays of the pattern data
+from orjson import loads
 
 from lmfit.models import LinearModel, QuadraticModel, PolynomialModel, GaussianModel, LorentzianModel, PseudoVoigtModel
 from lmfit import Parameters
 
-from peak_prophet_server.pattern import Pattern
+from peak_prophet_server.engine import MultiPeakModel
+from peak_prophet_server.model_cache import ModelCache, model_signature
+from peak_prophet_server.pattern import Pattern, read_binary_array
 
+# models and default parameters by model signature, shared by all requests
+model_cache = ModelCache()
 
-def read_data(data_dict):
+
+def read_request(request):
+    """
+    Read a fit request as sent by the client, either
+      - a JSON string with the pattern x and y (and optional weights) as lists, or
+      - a dictionary with the JSON string without the pattern data under 'request' and the pattern data as
+        binary socket.io attachments under 'x', 'y' and optional 'weights' and the 'dtype' of the
+        attachments ('float64' (default) or 'float32'), for a series the list of these binary patterns is
+        under 'patterns'
+    :param request: JSON string or dictionary
+    :return: the input dictionary, in the binary case with the pattern data as numpy arrays
+    :rtype: dict
+    """
+    if isinstance(request, (str, bytes)):
+        return loads(request)
+
+    data_dict = loads(request['request'])
+    dtype = request.get('dtype', 'float64')
+    if request.get('patterns') is not None:
+        data_dict['patterns'] = [
+            {key: read_binary_array(value, dtype) if isinstance(value, (bytes, bytearray, memoryview)) else value
+             for key, value in pattern_dict.items()} for pattern_dict in request['patterns']]
+        return data_dict
+    pattern_dict = data_dict.setdefault('pattern', {})
+    for key in ('x', 'y', 'weights'):
+        if request.get(key) is not None:
+            pattern_dict[key] = read_binary_array(request[key], dtype)
+    return data_dict
+
+
+def read_data(data_dict, flat=False, pattern_store=None):
     """
     Read the data from the input dictionary and return the pattern, model and parameters
     :param data_dict: the input dictionary containing the pattern, peaks and background
+    :param flat: if True, the model is a MultiPeakModel evaluating all peaks at once, otherwise the peaks
+                 are chained into an lmfit CompositeModel
+    :param pattern_store: PatternStore for patterns referenced by id, see read_pattern
     :return: pattern, model, parameters
-    :rtype: (Pattern, Model, Parameters)
+    :rtype: (Pattern, Model | MultiPeakModel, Parameters)
     """
-    pattern = read_pattern(data_dict['pattern'])
-    peaks, peaks_parameters = read_peaks(data_dict['peaks'])
-    bkg_model, bkg_params = read_background(data_dict['background'])
-    model = bkg_model
-    for peak in peaks:
-        model += peak
+    pattern = read_pattern(data_dict['pattern'], pattern_store)
+    model, params = read_model(data_dict, flat)
+    return pattern, model, params
 
-    params = bkg_params
-    for peak_params in peaks_parameters:
-        params.update(peak_params)
 
-    return pattern, model, params
+def read_model(data_dict, flat=False):
+    """
+    Read the model and parameters from the peaks and background of the input dictionary, the pattern is
+    not needed. The model and default parameters are taken from the model cache, only the parameter values,
+    bounds and vary flags are set for every request.
+    :param data_dict: the input dictionary containing the peaks and background
+    :param flat: see read_data
+    :return: model, parameters
+    :rtype: (Model | MultiPeakModel, Parameters)
+    """
+    template = model_cache.get(model_signature(data_dict, flat), lambda: build_model(data_dict, flat))
+    params = template.create_params()
+    set_background_parameters(params, data_dict['background'])
+    for i, peak_dict in enumerate(data_dict['peaks']):
+        set_peak_parameters(params, peak_dict, f'p{i}_')
+    return template.model, params
+
+
+def build_model(data_dict, flat=False):
+    """
+    Build the model and its default parameters for the background and peak types of the input dictionary.
+    :param data_dict: the input dictionary containing the peaks and background
+    :param flat: see read_data
+    :return: model, default parameters
+    :rtype: (Model | MultiPeakModel, Parameters)
+    """
+    background_dict = data_dict['background']
+    model = create_background_model(background_dict['type'], background_dict.get('degree'))
+    params = model.make_params()
+    peaks = []
+    for i, peak_dict in enumerate(data_dict['peaks']):
+        peak = create_peak_model(peak_dict['type'], f'p{i}_')
+        params.update(peak.make_params())
+        peaks.append(peak)
+
+    if flat:
+        model = MultiPeakModel.from_dict(data_dict)
+    else:
+        for peak in peaks:
+            model += peak
+    return model, params
+
+
+def base_parameter_names(params):
+    """
+    Names of the parameters which are not calculated from an expression (e.g. fwhm and height of the peaks),
+    their values define the state of all parameters.
+    :param params: lmfit Parameters
+    :rtype: list[str]
+    """
+    return [name for name, param in params.items() if param.expr is None]
 
 
 def read_background(background_dict):
@@ -34,38 +117,64 @@ def read_background(background_dict):
     :return: background model, background parameters
     :rtype: (Model, Parameters)
     """
+    model = create_background_model(background_dict['type'], background_dict.get('degree'))
+    params = model.make_params()
+    set_background_parameters(params, background_dict)
+    return model, params
+
+
+def create_background_model(background_type, degree=None):
+    match background_type:
+        case 'linear':
+            return LinearModel(prefix='bkg_')
+        case 'quadratic':
+            return QuadraticModel(prefix='bkg_')
+        case 'polynomial':
+            return PolynomialModel(degree=degree, prefix='bkg_')
+        case _:
+            raise ValueError('Unknown background type')
+
+
+def set_background_parameters(params, background_dict):
+    """
+    Set the background parameter values of the input dictionary.
+    :param params: Parameters containing the background parameters
+    :param background_dict: dictionary containing the background type and parameters
+    """
     parameter_values = {p['name']: p['value'] for p in background_dict['parameters']}
 
     match background_dict['type']:
         case 'linear':
-            model = LinearModel(prefix='bkg_')
-            params = model.make_params(intercept=parameter_values['intercept'],
-                                       slope=parameter_values['slope'])
-            return model, params
+            names = ['intercept', 'slope']
         case 'quadratic':
-            model = QuadraticModel(prefix='bkg_')
-            params = model.make_params(a=parameter_values['a'],
-                                       b=parameter_values['b'],
-                                       c=parameter_values['c'])
-            return model, params
+            names = ['a', 'b', 'c']
         case 'polynomial':
-            model = PolynomialModel(degree=background_dict['degree'], prefix='bkg_')
-            params = model.make_params()
-            for i in range(background_dict['degree'] + 1):
-                params[f'bkg_c{i}'].set(value=parameter_values[f'c{i}'])
-            return model, params
+            names = [f'c{i}' for i in range(background_dict['degree'] + 1)]
         case _:
             raise ValueError('Unknown background type')
+    for name in names:
+        params[f'bkg_{name}'].set(value=parameter_values[name])
 
 
-def read_pattern(pattern_dict):
+def read_pattern(pattern_dict, pattern_store=None):
     """
     Read the pattern from the input dictionary.
-    :param pattern_dict: dictionary containing the pattern x and y values
+    :param pattern_dict: dictionary containing the pattern x and y values and optional weights, either as
+                         lists or as binary data with the 'dtype' of it (see read_binary_array), or the 'id'
+                         of a pattern uploaded before
+    :param pattern_store: PatternStore to look up the pattern id in
     :return: the extracted pattern
     :rtype: Pattern
     """
-    return Pattern(x=pattern_dict['x'], y=pattern_dict['y'])
+    if 'id' in pattern_dict:
+        if pattern_store is None:
+            raise ValueError('Pattern ids can only be used with a pattern store')
+        return pattern_store.get(pattern_dict['id'])
+
+    dtype = pattern_dict.get('dtype', 'float64')
+    x, y, weights = (read_binary_array(value, dtype) if isinstance(value, (bytes, bytearray, memoryview))
+                     else value for value in (pattern_dict['x'], pattern_dict['y'], pattern_dict.get('weights')))
+    return Pattern(x=x, y=y, weights=weights)
 
 
 def read_peaks(peaks_list):
@@ -92,56 +201,49 @@ def read_peak(peak_dict, prefix=''):
     :return: peak model, parameters
     :rtype: (Model, Parameters)
     """
+    model = create_peak_model(peak_dict['type'], prefix)
+    params = model.make_params()
+    set_peak_parameters(params, peak_dict, prefix)
+    return model, params
 
-    # Get the parameter names, values, vary, min and max
-    parameter_names = [p['name'] for p in peak_dict['parameters']]
-    parameter_values = {p['name']: p['value'] for p in peak_dict['parameters']}
-    parameter_vary = {p['name']: p['vary'] for p in peak_dict['parameters']}
-    parameter_min = {p['name']: p['min'] for p in peak_dict['parameters']}
-    parameter_max = {p['name']: p['max'] for p in peak_dict['parameters']}
 
-    # Create the model and parameters based on the peak type
-    match peak_dict['type'].lower():
+def create_peak_model(peak_type, prefix=''):
+    match peak_type.lower():
         case 'gaussian':
-            model = GaussianModel(prefix=prefix)
+            return GaussianModel(prefix=prefix)
         case 'lorentzian':
-            model = LorentzianModel(prefix=prefix)
+            return LorentzianModel(prefix=prefix)
         case 'pseudovoigt':
-            model = PseudoVoigtModel(prefix=prefix)
+            return PseudoVoigtModel(prefix=prefix)
         case _:
-            raise ValueError(f'Unknown peak type: {peak_dict["type"]}')
-    params = model.make_params()
+            raise ValueError(f'Unknown peak type: {peak_type}')
+
 
-    # Set the parameters
-    for parameter_name in parameter_names:
-        if parameter_name == 'fwhm':
-            continue
-        params[prefix + parameter_name].set(value=parameter_values[parameter_name],
-                                            vary=parameter_vary[parameter_name],
-                                            min=parameter_min[parameter_name],
-                                            max=parameter_max[parameter_name])
+def set_peak_parameters(params, peak_dict, prefix=''):
+    """
+    Set the values, vary flags and bounds of the peak parameters of the input dictionary, the fwhm is
+    converted to sigma.
+    :param params: Parameters containing the parameters of the peak
+    :param peak_dict: dictionary containing the peak type and parameters
+    :param prefix: prefix of the peak parameters
+    """
 
-    # Set the fwhm parameter based on the peak type (gaussian and lorentzian have different fwhm definitions)
     match peak_dict['type'].lower():
         case 'gaussian':
-            params[prefix + 'sigma'].set(value=convert_gaussian_fwhm_to_sigma(parameter_values['fwhm']),
-                                         vary=parameter_vary['fwhm'],
-                                         min=convert_gaussian_fwhm_to_sigma(parameter_min['fwhm']),
-                                         max=convert_gaussian_fwhm_to_sigma(parameter_max['fwhm']))
-        case 'lorentzian':
-            params[prefix + 'sigma'].set(value=convert_lorentzian_fwhm_to_sigma(parameter_values['fwhm']),
-                                         vary=parameter_vary['fwhm'],
-                                         min=convert_lorentzian_fwhm_to_sigma(parameter_min['fwhm']),
-                                         max=convert_lorentzian_fwhm_to_sigma(parameter_max['fwhm']))
-        case 'pseudovoigt':
-            params[prefix + 'sigma'].set(value=convert_lorentzian_fwhm_to_sigma(parameter_values['fwhm']),
-                                         vary=parameter_vary['fwhm'],
-                                         min=convert_lorentzian_fwhm_to_sigma(parameter_min['fwhm']),
-                                         max=convert_lorentzian_fwhm_to_sigma(parameter_max['fwhm']))
+            convert_fwhm = convert_gaussian_fwhm_to_sigma
+        case 'lorentzian' | 'pseudovoigt':
+            convert_fwhm = convert_lorentzian_fwhm_to_sigma
         case _:
             raise ValueError(f'Unknown peak type: {peak_dict["type"]}')
 
-    return model, params
+    # the fwhm is set as sigma, gaussian and lorentzian peaks have different fwhm definitions
+    for parameter in peak_dict['parameters']:
+        if parameter['name'] == 'fwhm':
+            params[prefix + 'sigma'].set(value=convert_fwhm(parameter['value']), vary=parameter['vary'],
+                                         min=convert_fwhm(parameter['min']), max=convert_fwhm(parameter['max']))
+        else:
+            params[prefix + parameter['name']].set(value=parameter['value'], vary=parameter['vary'],
+                                                   min=parameter['min'], max=parameter['max'])
 
 
 def convert_gaussian_fwhm_to_sigma(fwhm):
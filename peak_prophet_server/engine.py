@@ -0,0 +1,353 @@
+import numpy as np
+from lmfit import minimize
+
+S2PI = np.sqrt(2 * np.pi)
+SQRT_2LN2 = np.sqrt(2 * np.log(2))
+TINY = 1.0e-15
+
+# maximum number of elements of a (peaks x points) block evaluated at once, keeps the temporary arrays
+# small for patterns with a lot of points and a lot of peaks
+BLOCK_SIZE = 2 ** 21
+
+# peaks whose profile at the nearest point of the pattern is smaller than this fraction of its maximum have zero
+# derivatives in the Jacobian
+NEGLIGIBLE_DERIVATIVE = 1e-10
+
+BACKGROUND_PARAMETERS = {
+    'linear': ['intercept', 'slope'],
+    'quadratic': ['a', 'b', 'c'],
+}
+
+PEAK_PARAMETERS = {
+    'gaussian': ['amplitude', 'center', 'sigma'],
+    'lorentzian': ['amplitude', 'center', 'sigma'],
+    'pseudovoigt': ['amplitude', 'center', 'sigma', 'fraction'],
+}
+
+
+class MultiPeakModel:
+    """
+    Background plus an arbitrary number of peaks, evaluated as one stacked NumPy computation over the
+    parameter vector instead of recursing through a chained lmfit CompositeModel.
+
+    The parameter names are the same as the ones created by data_reader (bkg_*, p0_*, p1_*, ...), so the
+    Parameters from read_data can be used directly and the fit result can be passed to the output functions
+    in fitting.py. The model uses the same peak definitions as lmfit (amplitude is the peak area).
+    """
+
+    def __init__(self, background_type, peak_types, degree=None):
+        """
+        :param background_type: 'linear', 'quadratic' or 'polynomial'
+        :param peak_types: list of peak types ('gaussian', 'lorentzian' or 'pseudovoigt'), one per peak
+        :param degree: degree of the polynomial background, only used for the 'polynomial' type
+        """
+        self.background_type = background_type
+        self.degree = degree
+        self.peak_types = [peak_type.lower() for peak_type in peak_types]
+
+        match background_type:
+            case 'linear' | 'quadratic':
+                background_names = BACKGROUND_PARAMETERS[background_type]
+            case 'polynomial':
+                background_names = [f'c{i}' for i in range(degree + 1)]
+            case _:
+                raise ValueError('Unknown background type')
+
+        self.param_names = [f'bkg_{name}' for name in background_names]
+        self.n_background = len(background_names)
+
+        # indices into the parameter vector, grouped by peak type, so that all peaks of one type are
+        # evaluated at once
+        self.groups = {}
+        for i, peak_type in enumerate(self.peak_types):
+            if peak_type not in PEAK_PARAMETERS:
+                raise ValueError(f'Unknown peak type: {peak_type}')
+            group = self.groups.setdefault(peak_type, {name: [] for name in PEAK_PARAMETERS[peak_type]})
+            for name in PEAK_PARAMETERS[peak_type]:
+                group[name].append(len(self.param_names))
+                self.param_names.append(f'p{i}_{name}')
+        for group in self.groups.values():
+            for name in group:
+                group[name] = np.array(group[name], dtype=int)
+        self.index = {name: i for i, name in enumerate(self.param_names)}
+
+    @classmethod
+    def from_dict(cls, data_dict):
+        """
+        Create the model from the same input dictionary as used by data_reader.read_data.
+        :param data_dict: dictionary containing the peaks and background
+        :rtype: MultiPeakModel
+        """
+        background = data_dict['background']
+        return cls(background['type'], [peak['type'] for peak in data_dict['peaks']], background.get('degree'))
+
+    def values(self, params):
+        """
+        Get the parameter vector in the order used by the model.
+        :param params: lmfit Parameters
+        :rtype: np.ndarray
+        """
+        return np.fromiter((params[name].value for name in self.param_names), dtype=float,
+                           count=len(self.param_names))
+
+    def evaluate(self, values, x):
+        """
+        Evaluate background plus all peaks.
+        :param values: parameter vector, see values()
+        :param x: x values
+        :rtype: np.ndarray
+        """
+        x = np.asarray(x, dtype=float)
+        out = self.evaluate_background(values, x)
+        n_peaks = len(self.peak_types)
+        if n_peaks == 0:
+            return out
+        step = max(1, BLOCK_SIZE // n_peaks)
+        for start in range(0, len(x), step):
+            out[start:start + step] += self.evaluate_peaks(values, x[start:start + step])
+        return out
+
+    def evaluate_background(self, values, x):
+        coefficients = values[:self.n_background]
+        match self.background_type:
+            case 'linear':
+                intercept, slope = coefficients
+                return slope * x + intercept
+            case 'quadratic':
+                a, b, c = coefficients
+                return (a * x + b) * x + c
+            case 'polynomial':
+                return np.polyval(coefficients[::-1], x)
+
+    def evaluate_peaks(self, values, x):
+        """
+        Sum of all peaks. The Gaussian and the Lorentzian parts of all peaks are stacked into one
+        (components x points) array each, the weighted sum over the components is a single matrix product.
+        """
+        gaussian_parts, lorentzian_parts = self.components(values)
+        out = np.zeros_like(x)
+        if len(gaussian_parts[0]):
+            out += gaussian_parts[2] @ gaussian_kernel(x, gaussian_parts[0], gaussian_parts[1])
+        if len(lorentzian_parts[0]):
+            out += lorentzian_parts[2] @ lorentzian_kernel(x, lorentzian_parts[0], lorentzian_parts[1])
+        return out
+
+    def components(self, values):
+        """
+        Split all peaks into Gaussian and Lorentzian components (a pseudo-Voigt contributes to both).
+        :param values: parameter vector
+        :return: (centers, sigmas, weights) for the Gaussian and for the Lorentzian components
+        """
+        gaussian_parts = ([], [], [])
+        lorentzian_parts = ([], [], [])
+        for peak_type, group in self.groups.items():
+            amplitude = values[group['amplitude']]
+            center = values[group['center']]
+            sigma = values[group['sigma']]
+            match peak_type:
+                case 'gaussian':
+                    add_components(gaussian_parts, center, sigma, amplitude / np.maximum(TINY, S2PI * sigma))
+                case 'lorentzian':
+                    add_components(lorentzian_parts, center, sigma, amplitude / np.maximum(TINY, np.pi * sigma))
+                case 'pseudovoigt':
+                    fraction = values[group['fraction']]
+                    sigma_g = sigma / SQRT_2LN2
+                    add_components(gaussian_parts, center, sigma_g,
+                                   (1 - fraction) * amplitude / np.maximum(TINY, S2PI * sigma_g))
+                    add_components(lorentzian_parts, center, sigma,
+                                   fraction * amplitude / np.maximum(TINY, np.pi * sigma))
+        return ([np.concatenate(part) if part else np.empty(0) for part in gaussian_parts],
+                [np.concatenate(part) if part else np.empty(0) for part in lorentzian_parts])
+
+    def eval(self, params, x):
+        """
+        Evaluate the model for lmfit Parameters, same call signature as lmfit.Model.eval
+        """
+        return self.evaluate(self.values(params), x)
+
+    def residual(self, params, x, data, weights=None):
+        resid = self.evaluate(self.values(params), x) - data
+        if weights is not None:
+            resid *= weights
+        return resid
+
+    def jacobian(self, params, x, data=None, weights=None):
+        """
+        Analytic Jacobian of the residual with respect to the varying parameters, in the lmfit Dfun
+        format with col_deriv=True, i.e. one row per varying parameter (in the order of params).
+        :param params: lmfit Parameters
+        :param x: x values
+        :param data: y values, not needed but passed by lmfit
+        :param weights: weights multiplied with the residual
+        :rtype: np.ndarray
+        """
+        rows = [self.index[name] for name, param in params.items() if param.vary and param.expr is None]
+        jacobian = self.derivatives(self.values(params), x)[rows]
+
+        # Peaks far outside of the pattern have derivatives of e.g. 1e-30. Finite differences give exactly
+        # zero for those, but leastsq scales the step with the inverse derivative norm and would send these
+        # parameters to infinity. Treat them as not affecting the fit, like the finite difference Jacobian.
+        # Every peak is judged by its own profile, never relative to the derivatives of other parameters,
+        # which can be orders of magnitude larger, e.g. for a polynomial background at large x.
+        jacobian[self.outside_parameters(self.values(params), x)[rows]] = 0
+        jacobian[np.abs(jacobian).max(axis=1, initial=0) < np.finfo(float).tiny] = 0
+        if weights is not None:
+            jacobian *= weights
+        return jacobian
+
+    def outside_parameters(self, values, x):
+        """
+        Parameters of the peaks which are so far outside of the pattern that their profile at the nearest point
+        is less than NEGLIGIBLE_DERIVATIVE of its maximum.
+        :param values: parameter vector, see values()
+        :param x: increasing x values
+        :return: boolean array with one entry per parameter
+        """
+        outside = np.zeros(len(self.param_names), dtype=bool)
+        if len(x) == 0:
+            return outside
+        for peak_type, group in self.groups.items():
+            center = values[group['center']]
+            sigma = np.maximum(TINY, np.abs(values[group['sigma']]))
+            nearest = np.searchsorted(x, center).clip(1, len(x) - 1)
+            distance = np.minimum(np.abs(x[nearest - 1] - center), np.abs(x[nearest] - center))
+            if peak_type == 'gaussian':
+                profile = np.exp(-0.5 * np.minimum((distance / sigma) ** 2, 1e4))
+            else:
+                # the Lorentzian part of a pseudo-Voigt decays slower than the Gaussian part
+                profile = 1 / (1 + (distance / sigma) ** 2)
+            for indices in group.values():
+                outside[indices] = profile < NEGLIGIBLE_DERIVATIVE
+        return outside
+
+    def derivatives(self, values, x):
+        """
+        Partial derivatives of the model with respect to all parameters.
+        :param values: parameter vector, see values()
+        :param x: x values
+        :return: array with shape (len(param_names), len(x))
+        """
+        x = np.asarray(x, dtype=float)
+        out = np.empty((len(self.param_names), len(x)))
+
+        match self.background_type:
+            case 'linear':
+                out[0] = 1
+                out[1] = x
+            case 'quadratic':
+                out[0] = x ** 2
+                out[1] = x
+                out[2] = 1
+            case 'polynomial':
+                out[:self.n_background] = x[None, :] ** np.arange(self.n_background)[:, None]
+
+        for peak_type, group in self.groups.items():
+            amplitude = values[group['amplitude']][:, None]
+            center = values[group['center']][:, None]
+            sigma = values[group['sigma']][:, None]
+            dx = x[None, :] - center
+            match peak_type:
+                case 'gaussian':
+                    derivatives = gaussian_derivatives(dx, amplitude, sigma)[:3]
+                case 'lorentzian':
+                    derivatives = lorentzian_derivatives(dx, amplitude, sigma)[:3]
+                case 'pseudovoigt':
+                    fraction = values[group['fraction']][:, None]
+                    d_amplitude_g, d_center_g, d_sigma_g, g = gaussian_derivatives(dx, amplitude, sigma / SQRT_2LN2)
+                    d_amplitude_l, d_center_l, d_sigma_l, l = lorentzian_derivatives(dx, amplitude, sigma)
+                    derivatives = ((1 - fraction) * d_amplitude_g + fraction * d_amplitude_l,
+                                   (1 - fraction) * d_center_g + fraction * d_center_l,
+                                   (1 - fraction) * d_sigma_g / SQRT_2LN2 + fraction * d_sigma_l,
+                                   l - g)
+            for name, derivative in zip(PEAK_PARAMETERS[peak_type], derivatives):
+                out[group[name]] = derivative
+        return out
+
+    def fit(self, data, params, x, weights=None, method='leastsq', iter_cb=None, fit_kws=None, max_nfev=None):
+        """
+        Fit the model to the data, same call signature as lmfit.Model.fit.
+        :param data: y values
+        :param params: lmfit Parameters with the names from param_names
+        :param x: x values
+        :param weights: weights multiplied with the residual, e.g. 1 / uncertainty of y
+        :param method: 'leastsq' or 'least_squares'
+        :param iter_cb: lmfit iteration callback
+        :param fit_kws: options of the scipy solver, e.g. the tolerances
+        :param max_nfev: maximum number of function evaluations, the lmfit default if None
+        :return: the lmfit MinimizerResult
+        """
+        x = np.asarray(x, dtype=float)
+        data = np.asarray(data, dtype=float)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+        if method == 'leastsq':
+            jacobian = {'Dfun': self.jacobian, 'col_deriv': True}
+        elif method == 'least_squares':
+            # least_squares has no col_deriv, it needs one column per parameter
+            jacobian = {'jac': lambda *args: self.jacobian(*args).T}
+        else:
+            raise ValueError(f'Unknown fit method: {method}')
+        result = minimize(self.residual, params, method=method, args=(x, data, weights), iter_cb=iter_cb,
+                          max_nfev=max_nfev, **jacobian, **(fit_kws or {}))
+        if not hasattr(result, 'chisqr'):
+            # lmfit does not calculate the statistics for aborted fits, lmfit.Model.fit results always have them
+            result.chisqr = np.sum(result.residual ** 2)
+            result.redchi = result.chisqr / max(1, len(data) - result.nvarys)
+        return result
+
+
+def add_components(parts, center, sigma, weight):
+    parts[0].append(center)
+    parts[1].append(sigma)
+    parts[2].append(weight)
+
+
+def gaussian_kernel(x, center, sigma):
+    """
+    Unnormalized Gaussians exp(-(x - center)^2 / (2 sigma^2)) as (len(center) x len(x)) array, computed
+    in place to avoid temporaries.
+    """
+    out = np.subtract(x[None, :], center[:, None])
+    np.square(out, out=out)
+    out *= (-1 / np.maximum(TINY, 2 * sigma ** 2))[:, None]
+    return np.exp(out, out=out)
+
+
+def gaussian_derivatives(dx, amplitude, sigma):
+    """
+    Derivatives of lmfit's gaussian with respect to amplitude, center and sigma.
+    :param dx: x - center, (peaks x points) array
+    :return: d_amplitude, d_center, d_sigma, gaussian values
+    """
+    sigma = np.maximum(TINY, sigma)
+    d_amplitude = np.exp(-dx ** 2 / (2 * sigma ** 2)) / (S2PI * sigma)
+    value = amplitude * d_amplitude
+    d_center = value * dx / sigma ** 2
+    d_sigma = value * ((dx / sigma) ** 2 - 1) / sigma
+    return d_amplitude, d_center, d_sigma, value
+
+
+def lorentzian_derivatives(dx, amplitude, sigma):
+    """
+    Derivatives of lmfit's lorentzian with respect to amplitude, center and sigma.
+    :param dx: x - center, (peaks x points) array
+    :return: d_amplitude, d_center, d_sigma, lorentzian values
+    """
+    sigma = np.maximum(TINY, sigma)
+    kernel = 1 / (1 + (dx / sigma) ** 2)
+    d_amplitude = kernel / (np.pi * sigma)
+    value = amplitude * d_amplitude
+    d_center = value * kernel * 2 * dx / sigma ** 2
+    d_sigma = value * kernel * ((dx / sigma) ** 2 - 1) / sigma
+    return d_amplitude, d_center, d_sigma, value
+
+
+def lorentzian_kernel(x, center, sigma):
+    """
+    Unnormalized Lorentzians 1 / (1 + ((x - center) / sigma)^2) as (len(center) x len(x)) array.
+    """
+    out = np.subtract(x[None, :], center[:, None])
+    out *= (1 / np.maximum(TINY, sigma))[:, None]
+    np.square(out, out=out)
+    out += 1
+    return np.reciprocal(out, out=out)
@@ -1,70 +1,686 @@
 import asyncio
-import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
 import numpy as np
 
-from .data_reader import read_data
+from .data_reader import read_pattern, read_model, base_parameter_names
+from .metrics import metrics, COUNT_BUCKETS, SIZE_BUCKETS
+from .profiling import FitProfile
+from .result_cache import result_cache, request_key
+from .warm_start import (
+    DEFAULT_RADIUS,
+    warm_start_options,
+    model_dict,
+    seed_parameters,
+    fix_distant_peaks,
+    update_values,
+)
+from .engine import MultiPeakModel
+from .schema import decode_request
+from .solvers import solver_options, fit_arguments
+from .regions import (
+    DEFAULT_RADIUS as REGION_RADIUS,
+    region_options,
+    find_regions,
+    coupled_peaks,
+    region_dict,
+    region_parameter_names,
+)
+from .multiresolution import DEFAULT_FACTOR, DEFAULT_POINTS_PER_FWHM, multiresolution_options, resolution_strides
+from .workers import SharedArrays, SharedProgress, fit_worker, fit_arrays, get_executor
+
+logger = logging.getLogger(__name__)
+PHASE_SECONDS = "peak_prophet_phase_seconds"
 
 
 class FitManager:
     data_dict = None
-    current_progress = None
     result = None
-    stop = False
     pattern = None
+    params = None
+    progress_names = None
+    shared_progress = None
+    # input dictionary without the pattern and result of the last successful fit, the start of warm started fits
+    last_fit = None
+    # "flat" evaluates all peaks at once with the MultiPeakModel, "lmfit" uses the chained CompositeModel
+    engine = "flat"
+    # "thread" fits in the default thread pool, "process" in the worker process pool, which does not share
+    # the GIL between the fits of different clients
+    backend = os.getenv("PEAK_PROPHET_BACKEND", "thread")
+    # id of the job of the fit, set by the JobManager
+    job_id = None
+    # profile every request, otherwise only requests with "profile": true are profiled
+    profiling = False
+    # FitProfile of a profiled request, the fits of a profiled request run in the thread pool
+    profile = None
 
-    def __init__(self, sid=None):
+    def __init__(self, sid=None, pattern_store=None):
+        """
+        :param sid: session id of the client
+        :param pattern_store: PatternStore with the patterns uploaded by the client, fit requests can
+                              reference them by id
+        """
         self.sid = sid
+        self.pattern_store = pattern_store
+        self._stop = False
+        # set with the stop flag, ends the wait for an identical running fit, see ResultCache.get
+        self.stopped = asyncio.Event()
+        self._current_progress = None
+        self._progress_count = 0
+        # (iteration, chi2, values of progress_names, residual) of the last iteration, the JSON ready
+        # progress is only created from it when it is requested
+        self._snapshot = None
+        self._snapshot_version = 0
+        # SharedProgress of the running fit_pattern calls, used for their stop flags
+        self.sub_fit_progress = []
+        # running sub fits whose progress is reported as the progress of the request, (SharedProgress, index in
+        # progress_names of every value of the sub fit or -1), see report_sub_fits
+        self.reported_sub_fits = []
+        # values of progress_names and iterations from the finished reported sub fits, None without sub fits
+        self._sub_fit_values = None
+        self._sub_fit_iterations = 0
+        self._sub_fit_model = None
+        self._sub_fit_params = None
+        # the last progress snapshot of the sub fits and the future of the residual calculation in the executor,
+        # see sub_fit_snapshot
+        self._sub_fit_snapshot = None
+        self._sub_fit_future = None
+        # wall time in seconds of the phases of the request
+        self.phases = {}
+
+    @property
+    def stop(self):
+        return self._stop
+
+    @stop.setter
+    def stop(self, value):
+        self._stop = value
+        if value:
+            self.stopped.set()
+        else:
+            self.stopped.clear()
+        if self.shared_progress is not None:
+            self.shared_progress.stop = value
+        for progress in self.sub_fit_progress:
+            progress.stop = value
+
+    @property
+    def current_progress(self):
+        version = self.progress_version
+        if version != self._snapshot_version:
+            snapshot = self.progress_snapshot
+            if snapshot is not None:
+                self._current_progress = self.create_progress(*snapshot)
+                self._snapshot_version = version
+        return self._current_progress
+
+    @property
+    def progress_snapshot(self):
+        """
+        (iteration, chi2, values of progress_names, residual) of the last iteration, None before the first one.
+        Until the final fit of a request with sub fits has its first iteration, it is the progress of the sub
+        fits, see report_sub_fits.
+        """
+        if self.shared_progress is not None:
+            return self.shared_progress.read()
+        if self._snapshot is None and self._sub_fit_values is not None:
+            return self.sub_fit_snapshot()
+        return self._snapshot
+
+    @property
+    def progress_version(self):
+        """
+        Changes whenever a new progress snapshot is available, used to skip unchanged snapshots.
+        """
+        version = self._progress_count + sum(progress.version for progress, _ in self.reported_sub_fits)
+        if self.shared_progress is not None:
+            version += self.shared_progress.version
+        return version
 
     async def process_request(self, request):
-        self.data_dict = json.loads(request)
-        self.pattern, model, params = read_data(self.data_dict)
+        start = time.perf_counter()
+        self.start_profile("fit")
+        with self.timed("parse"):
+            data_dict = self.profiled(decode_request, request)
+        engine = data_dict.get("engine", self.engine)
+        warm_start = warm_start_options(data_dict.get("warm_start"))
+        regions = region_options(data_dict.get("regions"))
+        multiresolution = multiresolution_options(data_dict.get("multiresolution"))
+        with self.timed("read_pattern"):
+            self.pattern = self.profiled(read_pattern, data_dict["pattern"], self.pattern_store)
+        self.start_profile("fit", data_dict, [self.pattern])
+
+        async def fit():
+            if warm_start is not None and self.last_fit is not None:
+                response = await self.warm_start_fit(data_dict, engine, **warm_start)
+            elif regions is not None:
+                response = await self.region_fit(data_dict, engine, **regions)
+            elif multiresolution is not None:
+                response = await self.multiresolution_fit(data_dict, engine, **multiresolution)
+            else:
+                response = await self.run_fit(data_dict, engine)
+            return response, not self.stop
 
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, self.fit, self.pattern, model, params)
-        out = self.result
-        print(self.sid, "fit finished")
+        # warm started fits depend on the last fit of the session, profiled fits have to run
+        if self.profile is None and (warm_start is None or self.last_fit is None):
+            response = await result_cache.get(request_key(data_dict, self.pattern, engine), fit, self.stopped)
+            if response is None:
+                response = {"success": False, "message": "Fit stopped while waiting for an identical fit", "nfev": 0}
+        else:
+            response, _ = await fit()
+        duration = time.perf_counter() - start
+        self.observe_phase("request", duration)
+        logger.info(
+            "fit finished",
+            extra={
+                "sid": self.sid,
+                "success": response["success"],
+                "nfev": response["nfev"],
+                "points": len(self.pattern),
+                "peaks": len(data_dict["peaks"]),
+                "duration": duration,
+                "cached": response.get("cached", False),
+            },
+        )
+
+        if response["success"]:
+            self.last_fit = (model_dict(data_dict), response["result"])
+        return response
+
+    async def process_series(self, request, on_result=None):
+        """
+        Fit a series of patterns with the same model, e.g. of a time-resolved measurement. The request is a
+        fit request with a list of patterns under "patterns" instead of a single pattern (in the binary format
+        the "patterns" of the request dictionary hold the binary x, y and weights). Every fit starts from the
+        result of the previous successful fit in the series. With "chunks" > 1 the series is split into that
+        many consecutive chunks which are fitted concurrently (in parallel with the process backend), each
+        chunk starting from the initial values of the request.
+        :param request: see data_reader.read_request
+        :param on_result: optional coroutine function called with the response of every pattern as soon as
+                          it is finished, the response has the "index" of the pattern in the series
+        :return: the responses in the order of the patterns
+        :rtype: list[dict]
+        """
+        start = time.perf_counter()
+        self.start_profile("series")
+        with self.timed("parse"):
+            data_dict = self.profiled(decode_request, request, True)
+        flat = data_dict.get("engine", self.engine) == "flat"
+        patterns = [read_pattern(pattern_dict, self.pattern_store) for pattern_dict in data_dict["patterns"]]
+        self.start_profile("series", data_dict, patterns)
+        n_chunks = data_dict.get("chunks", 1)
+        if n_chunks < 1:
+            raise ValueError("The number of chunks has to be positive")
+        responses = [None] * len(patterns)
 
-        background_result = create_background_output(
-            self.data_dict["background"], out.params
+        async def fit_chunk(indices):
+            chunk_dict = model_dict(data_dict)
+            for index in indices:
+                if self.stop:
+                    break
+                summary = await self.fit_pattern(chunk_dict, patterns[index], flat)
+                if summary is None:
+                    response = {"success": False, "message": "The pattern has too few points", "nfev": 0}
+                else:
+                    response = create_response(chunk_dict, summary)
+                    if summary.success:
+                        update_values(chunk_dict, response["result"])
+                response["index"] = int(index)
+                responses[index] = response
+                if on_result is not None:
+                    await on_result(response)
+
+        chunks = np.array_split(np.arange(len(patterns)), min(n_chunks, max(1, len(patterns))))
+        await asyncio.gather(*(fit_chunk(chunk) for chunk in chunks))
+        duration = time.perf_counter() - start
+        self.observe_phase("series", duration)
+        logger.info(
+            "series finished",
+            extra={"sid": self.sid, "patterns": len(patterns), "chunks": len(chunks), "duration": duration},
         )
-        peaks_result = create_peaks_output(self.data_dict["peaks"], out.params)
+        return responses
 
-        return {
-            "success": out.success,
-            "message": out.message,
-            "chi2": out.chisqr,
-            "red_chi2": out.redchi,
-            "nfev": out.nfev,
-            "result": {
-                "background": background_result,
-                "peaks": peaks_result,
-            },
-        }
+    async def run_fit(self, data_dict, engine):
+        """
+        Fit the current pattern with the model of the input dictionary.
+        :return: the fit response
+        :rtype: dict
+        """
+        self.data_dict = data_dict
+        with self.timed("build_model"):
+            model, self.params = self.profiled(read_model, data_dict, engine == "flat")
+            self.progress_names = base_parameter_names(self.params)
+
+        start = time.perf_counter()
+        if self.backend == "process" and self.profile is None:
+            await self.fit_in_process(self.pattern, self.params, engine == "flat")
+        else:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None, self.profiled, self.fit, self.pattern, model, self.params, data_dict.get("solver")
+            )
+        duration = time.perf_counter() - start
+        observe_fit(duration, self.result.nfev, len(self.pattern), len(data_dict["peaks"]))
+        self.record_phase("fit", duration)
+
+        with self.timed("output"):
+            return self.profiled(create_response, self.data_dict, self.result)
+
+    async def warm_start_fit(self, data_dict, engine, local_pass=False, radius=DEFAULT_RADIUS):
+        """
+        Refit starting the unchanged parameters from the previous converged result. With local_pass the
+        peaks far away from the changed ones are fixed in a first pass, before all parameters are polished.
+        The response gets a "warm_start" entry with the number of seeded parameters and fixed peaks, the
+        function evaluations of the local pass and the wall time, "nfev" counts the evaluations of both passes.
+        """
+        start = time.perf_counter()
+        seeded_dict = model_dict(data_dict)
+        seeded, changed_peaks = seed_parameters(seeded_dict, *self.last_fit)
+        info = {"seeded": seeded, "fixed_peaks": 0, "local_nfev": 0}
+
+        if local_pass and 0 < len(changed_peaks) < len(seeded_dict["peaks"]):
+            local_dict, info["fixed_peaks"] = fix_distant_peaks(seeded_dict, changed_peaks, radius)
+            if info["fixed_peaks"] > 0:
+                local_response = await self.run_fit(local_dict, engine)
+                if self.stop:
+                    return local_response
+                info["local_nfev"] = local_response["nfev"]
+                update_values(seeded_dict, local_response["result"])
+
+        response = await self.run_fit(seeded_dict, engine)
+        response["nfev"] += info["local_nfev"]
+        info["time"] = time.perf_counter() - start
+        response["warm_start"] = info
+        return response
+
+    async def region_fit(self, data_dict, engine, radius=REGION_RADIUS, refine=True):
+        """
+        Split the pattern into independent regions of overlapping peaks (see regions.find_regions) and fit them
+        in parallel, every region with its own local linear background. Afterward the global background and,
+        with refine, the peaks of coupled neighbouring regions are fitted jointly on the whole pattern, with the
+        other peaks fixed at their region results. The response gets a "regions" entry with the number of
+        regions, the refined peaks and the function evaluations of the region fits, "nfev" counts all fits.
+        """
+        flat = engine == "flat"
+        regions = find_regions(data_dict["peaks"], radius)
+        if len(regions) < 2:
+            return await self.run_fit(data_dict, engine)
+
+        region_dicts = [region_dict(data_dict, region) for region in regions]
+        self.report_sub_fits(data_dict, engine)
+        summaries = await asyncio.gather(
+            *(
+                self.fit_pattern(
+                    sub_dict,
+                    self.pattern.crop(region.x_min, region.x_max),
+                    flat,
+                    parameter_names=region_parameter_names(sub_dict, region),
+                )
+                for sub_dict, region in zip(region_dicts, regions)
+            )
+        )
+
+        refined = set(coupled_peaks(data_dict["peaks"], regions, radius) if refine else [])
+        joint_dict = model_dict(data_dict)
+        region_outputs = {}
+        for region, sub_dict, summary in zip(regions, region_dicts, summaries):
+            if summary is None:
+                continue
+            outputs = create_peaks_output(sub_dict["peaks"], summary.params)
+            for i, output in zip(region.peaks, outputs):
+                region_outputs[i] = output
+                for parameter, parameter_output in zip(joint_dict["peaks"][i]["parameters"], output["parameters"]):
+                    parameter["value"] = parameter_output["value"]
+                    if i not in refined:
+                        parameter["vary"] = False
+
+        response = await self.run_fit(joint_dict, engine)
+        for i, output in region_outputs.items():
+            if i not in refined:
+                response["result"]["peaks"][i] = output
+        region_nfev = sum(summary.nfev for summary in summaries if summary is not None)
+        response["success"] = response["success"] and all(
+            summary.success for summary in summaries if summary is not None
+        )
+        response["nfev"] += region_nfev
+        response["regions"] = {"count": len(regions), "refined_peaks": len(refined), "nfev": region_nfev}
+        return response
+
+    async def multiresolution_fit(
+        self, data_dict, engine, factor=DEFAULT_FACTOR, points_per_fwhm=DEFAULT_POINTS_PER_FWHM
+    ):
+        """
+        Fit coarse to fine: first every stride-th point of the pattern for the strides of
+        multiresolution.resolution_strides, every stage starting from the result of the previous one, and
+        finally the full pattern. Only the final fit estimates the uncertainties. The response gets a
+        "multiresolution" entry with the points and function evaluations of the coarse stages and the wall time,
+        "nfev" counts the evaluations of all stages.
+        """
+        start = time.perf_counter()
+        flat = engine == "flat"
+        stage_dict = model_dict(data_dict)
+        n_params = len(MultiPeakModel.from_dict(stage_dict).param_names)
+        strides = resolution_strides(self.pattern, stage_dict["peaks"], n_params, factor, points_per_fwhm)
+        if strides:
+            self.report_sub_fits(stage_dict, engine)
+        stages = []
+        stopped_response = None
+        for stride in strides:
+            pattern = self.pattern.decimate(stride)
+            # the stages fit the model of the request, all parameters are reported
+            parameter_names = {name: name for name in self.progress_names}
+            summary = await self.fit_pattern(
+                stage_dict, pattern, flat, calc_covar=False, parameter_names=parameter_names
+            )
+            stages.append({"stride": stride, "points": len(pattern), "nfev": summary.nfev})
+            stage_response = create_response(stage_dict, summary)
+            if self.stop:
+                stopped_response = stage_response
+                break
+            if summary.success:
+                update_values(stage_dict, stage_response["result"])
+
+        coarse_nfev = sum(stage["nfev"] for stage in stages)
+        if stopped_response is not None:
+            response = stopped_response
+            response["nfev"] = coarse_nfev
+        else:
+            response = await self.run_fit(stage_dict, engine)
+            response["nfev"] += coarse_nfev
+        response["multiresolution"] = {"stages": stages, "nfev": coarse_nfev, "time": time.perf_counter() - start}
+        return response
 
-    def fit(self, pattern, model, params):
-        self.result = model.fit(pattern.y, params, x=pattern.x, iter_cb=self.iter_cb)
+    async def fit_pattern(self, sub_dict, pattern, flat, calc_covar=True, parameter_names=None):
+        """
+        Fit an input dictionary to a pattern independently of the fit of the session (used for regions, series
+        and the coarse multiresolution stages), in the worker process pool for the process backend and in the
+        default thread pool otherwise.
+        :param calc_covar: estimate the uncertainties of the parameters, see workers.fit_arrays
+        :param parameter_names: {parameter of sub_dict: parameter of the request}, the progress of the fit is
+                                reported for these parameters, see report_sub_fits; None to not report it
+        :return: the fit summary or None if the pattern has too few points to be fitted
+        :rtype: FitSummary | None
+        """
+        n_params = len(MultiPeakModel.from_dict(sub_dict).param_names)
+        if len(pattern) <= n_params:
+            return None
+        arrays = [pattern.x, pattern.y]
+        if pattern.weights is not None:
+            arrays.append(pattern.weights)
+        progress = SharedProgress(n_params, len(pattern))
+        progress.stop = self.stop
+        self.sub_fit_progress.append(progress)
+        reported = None
+        if parameter_names is not None:
+            # the order of the values written by fit_arrays
+            names = base_parameter_names(read_model(sub_dict, flat)[1])
+            index = {name: i for i, name in enumerate(self.progress_names)}
+            reported = (progress, np.array([index.get(parameter_names.get(name), -1) for name in names], dtype=int))
+            self.reported_sub_fits.append(reported)
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            if self.backend != "process" or self.profile is not None:
+                summary = await loop.run_in_executor(
+                    None, self.profiled, fit_arrays, sub_dict, flat, *arrays[:2], progress, pattern.weights, calc_covar
+                )
+            else:
+                shared_pattern = SharedArrays.from_arrays(*arrays)
+                try:
+                    summary = await loop.run_in_executor(
+                        get_executor(), fit_worker, sub_dict, flat, shared_pattern.handle, progress.handle, calc_covar
+                    )
+                finally:
+                    shared_pattern.release()
+            # includes building the model and the output of the summary
+            duration = time.perf_counter() - start
+            observe_fit(duration, summary.nfev, len(pattern), len(sub_dict["peaks"]), "sub_fit")
+            self.record_phase("sub_fit", duration)
+            return summary
+        finally:
+            self.sub_fit_progress.remove(progress)
+            if reported is not None:
+                self.reported_sub_fits.remove(reported)
+                self._progress_count += progress.version
+                self.merge_sub_fit(progress.read(), reported[1])
+            progress.release()
+
+    def report_sub_fits(self, data_dict, engine):
+        """
+        Report the progress of the sub fits of a request (region fits and coarse multiresolution stages) as the
+        progress of the request until its final fit has its first iteration. The parameters of the request take
+        the latest values of the sub fits, the others keep their start values, and the residual and chi2 are
+        calculated on the whole pattern when the progress is requested, see sub_fit_snapshot.
+        """
+        self.data_dict = data_dict
+        _, self.params = read_model(data_dict, engine == "flat")
+        self.progress_names = base_parameter_names(self.params)
+        self._sub_fit_model = MultiPeakModel.from_dict(data_dict)
+        self._sub_fit_params = self.params.copy()
+        self._sub_fit_values = np.array([self.params[name].value for name in self.progress_names], dtype=float)
+        self._sub_fit_iterations = 0
+        self._sub_fit_snapshot = None
+        self._sub_fit_future = None
+
+    def merge_sub_fit(self, snapshot, indices, values=None):
+        """
+        Set the values of the request parameters from the snapshot of a reported sub fit.
+        :param indices: index in progress_names of every value of the sub fit, -1 for unreported values
+        :param values: values of progress_names to update, those of the finished sub fits if None
+        :return: the iterations of the sub fit
+        """
+        if snapshot is None:
+            return 0
+        iteration, _, sub_values, _ = snapshot
+        reported = indices >= 0
+        if values is None:
+            values = self._sub_fit_values
+            self._sub_fit_iterations += iteration
+        values[indices[reported]] = sub_values[reported]
+        return iteration
+
+    def sub_fit_snapshot(self):
+        """
+        Progress snapshot of the request from the finished and the running reported sub fits. Evaluating the
+        model on the whole pattern would block the event loop, so the residual of the latest values is calculated
+        in the default thread pool, and until it is done the previous snapshot is returned. The progress version
+        changes when the new snapshot is ready.
+        """
+        if self._sub_fit_future is not None:
+            return self._sub_fit_snapshot
+        values = self._sub_fit_values.copy()
+        iteration = self._sub_fit_iterations
+        for progress, indices in self.reported_sub_fits:
+            iteration += self.merge_sub_fit(progress.read(), indices, values)
+        latest = self._sub_fit_snapshot[0] if self._sub_fit_snapshot is not None else 0
+        if iteration > latest:
+            future = asyncio.get_running_loop().run_in_executor(
+                None, self.sub_fit_residual, self._sub_fit_model, self._sub_fit_params, iteration, values
+            )
+            future.add_done_callback(self.sub_fit_residual_done)
+            self._sub_fit_future = future
+        return self._sub_fit_snapshot
+
+    def sub_fit_residual(self, model, params, iteration, values):
+        """
+        Progress snapshot of the sub fits with the residual on the whole pattern, runs in the thread pool.
+        """
+        for name, value in zip(self.progress_names, values):
+            params[name].value = value
+        resid = model.residual(params, self.pattern.x, self.pattern.y, self.pattern.weights)
+        return iteration, float(np.dot(resid, resid)), values, resid
+
+    def sub_fit_residual_done(self, future):
+        if future is not self._sub_fit_future:
+            return
+        self._sub_fit_future = None
+        if not future.cancelled() and future.exception() is None:
+            self._sub_fit_snapshot = future.result()
+            self._progress_count += 1
+
+    def start_profile(self, kind, data_dict=None, patterns=None):
+        """
+        Start the profile of a request if the session profiles all requests, or the decoded request has
+        "profile": true, and keep the request in it for the replay.
+        """
+        if self.profile is None and (self.profiling or (data_dict is not None and data_dict.get("profile"))):
+            self.profile = FitProfile(self.job_id, self.sid, kind)
+        if self.profile is None:
+            return
+        self.profile.phases = self.phases
+        if data_dict is not None:
+            self.profile.data_dict = data_dict
+            self.profile.patterns = patterns
+            self.profile.last_fit = self.last_fit
+
+    def profiled(self, function, *args):
+        """
+        Call a function, under cProfile in the current thread for profiled requests.
+        """
+        if self.profile is None:
+            return function(*args)
+        return self.profile.call(function, *args)
+
+    @contextmanager
+    def timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, time.perf_counter() - start)
+
+    def observe_phase(self, phase, duration):
+        metrics.observe(PHASE_SECONDS, duration, phase=phase)
+        self.record_phase(phase, duration)
+
+    def record_phase(self, phase, duration):
+        """
+        Add a wall time in seconds to a phase of the request, the phases of concurrent sub fits add up.
+        """
+        self.phases[phase] = self.phases.get(phase, 0) + duration
+
+    def fit(self, pattern, model, params, solver=None):
+        """
+        :param solver: the "solver" option of the request, see solvers.solver_options
+        """
+        self.result = model.fit(
+            pattern.y,
+            params,
+            x=pattern.x,
+            weights=pattern.weights,
+            iter_cb=self.iter_cb,
+            **fit_arguments(solver_options(solver), params),
+        )
+
+    async def fit_in_process(self, pattern, params, flat):
+        """
+        Fit in the worker process pool. The pattern is sent to the worker through shared memory, and the
+        worker writes its progress to shared memory, which is also used for the stop flag.
+        """
+        model_dict = {key: value for key, value in self.data_dict.items() if key != "pattern"}
+        pattern_arrays = [pattern.x, pattern.y]
+        if pattern.weights is not None:
+            pattern_arrays.append(pattern.weights)
+        shared_pattern = SharedArrays.from_arrays(*pattern_arrays)
+        self.shared_progress = SharedProgress(len(self.progress_names), len(pattern))
+        self.shared_progress.stop = self.stop
+        try:
+            loop = asyncio.get_running_loop()
+            self.result = await loop.run_in_executor(
+                get_executor(),
+                fit_worker,
+                model_dict,
+                flat,
+                shared_pattern.handle,
+                self.shared_progress.handle,
+            )
+        finally:
+            shared_progress, self.shared_progress = self.shared_progress, None
+            self._snapshot = shared_progress.read()
+            self._progress_count += shared_progress.version
+            shared_progress.release()
+            shared_pattern.release()
 
     def iter_cb(self, params, iter, resid, *args, **kwargs):
         if self.sid is None:
-            print("sid is None")
-            return
+            return self.stop
+        start = time.perf_counter()
 
-        chi2 = np.sum(resid**2)
-        red_chi2 = chi2 / (len(self.pattern.y) - 1)
+        # only keep what is needed to create the progress later, the residual is a new array in every
+        # iteration and does not need to be copied
+        values = np.fromiter(
+            (params[name].value for name in self.progress_names),
+            dtype=float,
+            count=len(self.progress_names),
+        )
+        self._snapshot = (iter, np.dot(resid, resid), values, resid)
+        self._progress_count += 1
+        metrics.observe("peak_prophet_iter_cb_seconds", time.perf_counter() - start)
+        return self.stop
 
-        self.current_progress = {
-            "iter": iter,
+    def create_progress(self, iteration, chi2, values, resid):
+        """
+        Create the JSON ready progress from a snapshot of an iteration.
+        :param iteration: iteration number
+        :param chi2: chi2 of the iteration
+        :param values: values of the parameters in progress_names
+        :param resid: residual of the iteration
+        """
+        return {
+            "iter": iteration,
             "resid": resid.tolist(),
             "chi2": chi2,
-            "red_chi2": red_chi2,
-            "result": {
-                "background": create_background_output(
-                    self.data_dict["background"], params
-                ),
-                "peaks": create_peaks_output(self.data_dict["peaks"], params),
-            },
+            "red_chi2": chi2 / (len(self.pattern) - 1),
+            "result": self.create_progress_result(values),
         }
-        return self.stop
+
+    def create_progress_result(self, values):
+        """
+        Create the background and peaks output of an iteration.
+        :param values: values of the parameters in progress_names
+        """
+        for name, value in zip(self.progress_names, values):
+            self.params[name].value = value
+
+        return {
+            "background": create_background_output(self.data_dict["background"], self.params),
+            "peaks": create_peaks_output(self.data_dict["peaks"], self.params),
+        }
+
+
+def observe_fit(duration, nfev, points, peaks, phase="fit"):
+    """
+    Record the metrics of a finished fit.
+    """
+    metrics.observe(PHASE_SECONDS, duration, phase=phase)
+    metrics.observe("peak_prophet_evaluation_seconds", duration / max(nfev, 1))
+    metrics.observe("peak_prophet_nfev", nfev, COUNT_BUCKETS)
+    metrics.observe("peak_prophet_points", points, SIZE_BUCKETS)
+    metrics.observe("peak_prophet_peaks", peaks, COUNT_BUCKETS)
+
+
+def create_response(data_dict, out):
+    """
+    Create the fit response from a fit result.
+    :param data_dict: the input dictionary of the fit
+    :param out: lmfit result or FitSummary
+    :rtype: dict
+    """
+    return {
+        "success": out.success,
+        "message": out.message,
+        "chi2": out.chisqr,
+        "red_chi2": out.redchi,
+        "nfev": out.nfev,
+        "solver": solver_options(data_dict.get("solver")),
+        "result": {
+            "background": create_background_output(data_dict["background"], out.params),
+            "peaks": create_peaks_output(data_dict["peaks"], out.params),
+        },
+    }
 
 
 def create_background_output(background_input, params):
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import uuid
+
+from .metrics import metrics
+from .profiling import profile_store
+from .scheduler import FitScheduler
+from .state import get_state_backend
+
+QUEUED = "queued"
+RUNNING = "running"
+CANCELLED = "cancelled"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (CANCELLED, DONE, FAILED)
+
+logger = logging.getLogger(__name__)
+
+# number of finished jobs of a session kept for status requests
+FINISHED_JOBS = 32
+
+# scheduler shared by the jobs of all sessions
+scheduler = FitScheduler()
+metrics.gauge("peak_prophet_running_fits", lambda: scheduler.n_running)
+metrics.gauge("peak_prophet_queued_fits", lambda: scheduler.n_queued)
+metrics.gauge("peak_prophet_rejected_fits", lambda: scheduler.n_rejected)
+metrics.gauge("peak_prophet_saturation", lambda: scheduler.n_running / scheduler.max_running)
+metrics.describe("peak_prophet_saturation", "Running fits relative to the maximum number of running fits")
+
+
+class Job:
+    """
+    One fit or series fit of a session. Every job has its own FitManager, whose stop flag is the
+    cancellation token of the job: it is checked after every function evaluation of the fit, also in the
+    worker processes.
+    """
+
+    def __init__(self, fit_manager, kind="fit"):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.fit_manager = fit_manager
+        self.state = QUEUED
+        self.response = None
+        self.error = None
+        self.task = None
+        # Ticket of the job in the FitScheduler
+        self.ticket = None
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def cancel(self):
+        """
+        Cancel the job, a queued job is removed from the queue, a running fit stops after the current
+        function evaluation.
+        """
+        if self.finished:
+            return
+        self.fit_manager.stop = True
+        if self.state == QUEUED:
+            self.state = CANCELLED
+            self.ticket.scheduler.cancel(self.ticket)
+            self.task.cancel()
+
+    def status(self):
+        status = {"job_id": self.id, "kind": self.kind, "state": self.state}
+        if self.state == QUEUED and self.ticket is not None:
+            status["position"] = self.ticket.position
+            status["estimated_wait"] = self.ticket.estimated_wait
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+class JobManager:
+    """
+    The fit jobs of one session. Jobs are queued in the FitScheduler and wait in the queued state until it
+    starts them.
+    """
+
+    def __init__(self, sid=None, pattern_store=None, fit_scheduler=None, state=None):
+        """
+        :param sid: session id of the client
+        :param pattern_store: PatternStore of the session, shared by all jobs
+        :param fit_scheduler: FitScheduler, the scheduler shared by all sessions by default
+        :param state: StateBackend in which the jobs are registered, the one of the server process by default
+        """
+        self.sid = sid
+        self.pattern_store = pattern_store
+        self.jobs = {}
+        self.latest = None
+        # input and result of the last successful fit of the session, the start of warm started fits
+        self.last_fit = None
+        # profile all jobs of the session, see FitManager.profiling
+        self.profiling = False
+        self.scheduler = fit_scheduler if fit_scheduler is not None else scheduler
+        self.state = state if state is not None else get_state_backend()
+
+    def submit(self, request, kind="fit", on_result=None):
+        """
+        Start a job.
+        :param request: fit request, see FitManager.process_request and FitManager.process_series
+        :param kind: "fit" or "series"
+        :param on_result: for series, called with the response of every pattern
+        :rtype: Job
+        :raises ServerBusy: if the scheduler queue is full
+        """
+        # imported here to keep lmfit out of the server start, see warmup.py
+        from .fitting import FitManager
+
+        if kind not in ("fit", "series"):
+            raise ValueError(f"Unknown job kind: {kind}")
+        fit_manager = FitManager(self.sid, self.pattern_store)
+        fit_manager.last_fit = self.last_fit
+        fit_manager.profiling = self.profiling
+        job = Job(fit_manager, kind)
+        fit_manager.job_id = job.id
+        job.ticket = self.scheduler.reserve(self)
+        job.task = asyncio.create_task(self._run(job, request, on_result))
+        self.jobs[job.id] = job
+        self.state.register_job(job)
+        self.latest = job
+        self._forget_finished()
+        return job
+
+    async def _run(self, job, request, on_result):
+        try:
+            await self.scheduler.acquire(job.ticket)
+        except asyncio.CancelledError:
+            if job.state == CANCELLED:
+                return
+            raise
+        try:
+            if job.fit_manager.stop:
+                job.state = CANCELLED
+                return
+            job.state = RUNNING
+            if job.kind == "series":
+                job.response = await job.fit_manager.process_series(request, on_result)
+            else:
+                job.response = await job.fit_manager.process_request(request)
+                job.response["job_id"] = job.id
+                if job.response["success"]:
+                    self.last_fit = job.fit_manager.last_fit
+            job.state = CANCELLED if job.fit_manager.stop else DONE
+        except Exception as e:
+            job.state = FAILED
+            job.error = str(e)
+        finally:
+            self.scheduler.release(job.ticket)
+        if job.fit_manager.profile is not None:
+            await self._save_profile(job)
+
+    async def _save_profile(self, job):
+        """
+        Store the profile of a profiled job, a fit response gets the summary of the profile.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            summary = await loop.run_in_executor(
+                None, profile_store.save, job.fit_manager.profile, job.state, job.response, job.error
+            )
+        except OSError:
+            logger.exception("saving the profile failed", extra={"sid": self.sid, "job_id": job.id})
+            return
+        if job.kind == "fit" and job.response is not None:
+            job.response["profile"] = summary
+
+    async def wait(self, job):
+        """
+        Wait until a job is finished.
+        :return: the response of the job, None if it was cancelled before it started
+        :raises ValueError: if the job failed
+        """
+        await asyncio.shield(job.task)
+        if job.state == FAILED:
+            raise ValueError(job.error)
+        return job.response
+
+    def get(self, job_id=None):
+        """
+        :param job_id: id of the job, the latest job if None
+        :rtype: Job
+        """
+        if job_id is None:
+            if self.latest is None:
+                raise ValueError("No job was submitted")
+            return self.latest
+        if job_id not in self.jobs:
+            raise ValueError(f"Unknown job id: {job_id}")
+        return self.jobs[job_id]
+
+    def cancel(self, job_id):
+        """
+        Cancel a job of the session, see Job.cancel.
+        :return: the status of the job
+        :rtype: dict
+        """
+        job = self.get(job_id)
+        job.cancel()
+        return job.status()
+
+    def cancel_all(self):
+        for job in self.jobs.values():
+            job.cancel()
+
+    async def command(self, job_id, command):
+        """
+        Run a job command for a job of any session, also of sessions of other server processes, see
+        StateBackend.job_command.
+        """
+        return await self.state.job_command(job_id, command)
+
+    def close(self):
+        """
+        Cancel all jobs and the unfinished pattern uploads and remove the jobs from the state backend, when the
+        client disconnects.
+        """
+        self.cancel_all()
+        if self.pattern_store is not None:
+            self.pattern_store.close()
+        for job_id in self.jobs:
+            self.state.unregister_job(job_id)
+
+    def status(self):
+        """
+        :return: status of all jobs, oldest first
+        :rtype: list[dict]
+        """
+        return [job.status() for job in self.jobs.values()]
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(finished) - FINISHED_JOBS)]:
+            del self.jobs[job_id]
+            self.state.unregister_job(job_id)
+
+    @property
+    def progress_version(self):
+        """
+        Version of the progress of the latest job, see FitManager.progress_version.
+        """
+        if self.latest is None:
+            return None
+        return self.latest.id, self.latest.fit_manager.progress_version
+
+    @property
+    def current_progress(self):
+        if self.latest is None:
+            return None
+        return self.latest.fit_manager.current_progress
+
+    def compact_progress(self, encoder, job_id=None):
+        """
+        :param encoder: ProgressEncoder of the client
+        :param job_id: id of a job of the session, the latest job if None
+        :return: compact progress of the job, None if there is no job or no iteration yet
+        :rtype: dict | None
+        """
+        if job_id is None and self.latest is None:
+            return None
+        job = self.get(job_id)
+        return encoder.encode(job.id, job.fit_manager)
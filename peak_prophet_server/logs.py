@@ -0,0 +1,38 @@
+import json
+import logging
+import os
+import sys
+
+LOG_LEVEL = os.getenv("PEAK_PROPHET_LOG_LEVEL", "INFO")
+# attributes of every LogRecord, the other attributes are the extra fields of a log call
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as JSON lines with the time, level, logger, message and the extra fields of the log call.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=LOG_LEVEL):
+    """
+    Log the records of the server as JSON lines to stderr.
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger("peak_prophet_server")
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
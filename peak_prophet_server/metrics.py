@@ -0,0 +1,144 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds of the histogram buckets
+TIME_BUCKETS = (1e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000)
+SIZE_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7)
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus sense, safe to be observed from several threads.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def cumulative_counts(self):
+        """
+        :return: the number of observations <= each bucket bound, the last one for +Inf
+        :rtype: list[int]
+        """
+        with self._lock:
+            counts = list(self.counts)
+        for i in range(1, len(counts)):
+            counts[i] += counts[i - 1]
+        return counts
+
+
+class Metrics:
+    """
+    Histograms by name and labels, and gauges which are read when the metrics are exported.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.descriptions = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, description):
+        self.descriptions[name] = description
+
+    def histogram(self, name, buckets=TIME_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        self.histogram(name, buckets, **labels).observe(value)
+
+    @contextmanager
+    def time(self, name, **labels):
+        """
+        Observe the wall time of the block in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def gauge(self, name, read):
+        """
+        :param read: function returning the current value
+        """
+        self.gauges[name] = read
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def render(self):
+        """
+        The metrics in the Prometheus text format.
+        :rtype: str
+        """
+        lines = []
+        names = set()
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name not in names:
+                names.add(name)
+                if self.descriptions.get(name):
+                    lines.append(f"# HELP {name} {self.descriptions[name]}")
+                lines.append(f"# TYPE {name} histogram")
+            counts = histogram.cumulative_counts()
+            for bound, count in zip(histogram.buckets + (float("inf"),), counts):
+                bound = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum!r}")
+            lines.append(f"{name}_count{format_labels(labels)} {counts[-1]}")
+        for name, read in sorted(self.gauges.items()):
+            if self.descriptions.get(name):
+                lines.append(f"# HELP {name} {self.descriptions[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {float(read())!r}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+metrics = Metrics()
+metrics.describe("peak_prophet_phase_seconds", "Wall time of the phases of fit requests")
+metrics.describe("peak_prophet_queue_wait_seconds", "Time fits waited in the scheduler queue")
+metrics.describe("peak_prophet_evaluation_seconds", "Fit time per function evaluation")
+metrics.describe("peak_prophet_iter_cb_seconds", "Time per call of the iteration callback")
+metrics.describe("peak_prophet_nfev", "Function evaluations per fit")
+metrics.describe("peak_prophet_points", "Points of the fitted patterns")
+metrics.describe("peak_prophet_peaks", "Peaks of the fitted models")
+
+
+async def metrics_app(scope, receive, send):
+    """
+    ASGI app serving the metrics on GET /metrics, mounted next to the socketio.ASGIApp.
+    """
+    if scope["type"] != "http":
+        return
+    if scope["path"].rstrip("/") == "/metrics" and scope["method"] in ("GET", "HEAD"):
+        status, body, content_type = 200, metrics.render().encode(), b"text/plain; version=0.0.4"
+    else:
+        status, body, content_type = 404, b"Not Found", b"text/plain"
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body if scope["method"] != "HEAD" else b""})
@@ -0,0 +1,92 @@
+import os
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+
+# maximum number of model templates kept in the cache
+MODEL_CACHE_SIZE = int(os.getenv("PEAK_PROPHET_MODEL_CACHE_SIZE", 64))
+
+
+def model_signature(data_dict, flat=False):
+    """
+    Structural signature of the model of an input dictionary: the background type and degree, the sequence of
+    peak types and whether the flat model is used. Requests with the same signature only differ in the values,
+    bounds and vary flags of the parameters.
+    :param data_dict: the input dictionary containing the peaks and background
+    :param flat: see data_reader.read_data
+    :rtype: tuple
+    """
+    background = data_dict['background']
+    return (background['type'], background.get('degree'), tuple(peak['type'].lower() for peak in data_dict['peaks']),
+            bool(flat))
+
+
+class ModelTemplate:
+    """
+    Model and default parameters of one model signature. The model is shared between all requests with the
+    signature and must not be modified, every request gets its own copy of the parameters.
+    """
+
+    def __init__(self, model, params):
+        self.model = model
+        self.params = params
+
+    def create_params(self):
+        """
+        :return: copy of the default parameters
+        :rtype: Parameters
+        """
+        return deepcopy(self.params)
+
+
+class ModelCache:
+    """
+    Least recently used cache of model templates, keyed by the model signature.
+    """
+
+    def __init__(self, max_size=MODEL_CACHE_SIZE):
+        self.max_size = max_size
+        self.templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # the cache is used by the event loop and the fitting threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.templates)
+
+    def get(self, signature, build):
+        """
+        Get the template of a signature, building it on a miss.
+        :param signature: see model_signature
+        :param build: function without arguments returning the model and default parameters of the signature
+        :rtype: ModelTemplate
+        """
+        with self._lock:
+            template = self.templates.get(signature)
+            if template is not None:
+                self.templates.move_to_end(signature)
+                self.hits += 1
+                return template
+            self.misses += 1
+
+        template = ModelTemplate(*build())
+        if self.max_size > 0:
+            with self._lock:
+                self.templates[signature] = template
+                while len(self.templates) > self.max_size:
+                    self.templates.popitem(last=False)
+        return template
+
+    def stats(self):
+        """
+        :return: number of cached templates, hits and misses
+        :rtype: dict
+        """
+        return {'size': len(self.templates), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self.templates.clear()
+            self.hits = 0
+            self.misses = 0
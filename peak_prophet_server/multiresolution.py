@@ -0,0 +1,52 @@
+import numpy as np
+
+# the grid of every coarse stage is this many times coarser than the grid of the next stage
+DEFAULT_FACTOR = 4
+# minimum number of points per fwhm of the narrowest peak on the coarsest grid, fewer points do not resolve the
+# peak shape and the coarse fit drifts away from the full resolution result
+DEFAULT_POINTS_PER_FWHM = 8
+# minimum number of points of a coarse stage per parameter of the model
+POINTS_PER_PARAMETER = 10
+
+
+def multiresolution_options(option):
+    """
+    Read the 'multiresolution' option of a fit request, either a bool or a dictionary with 'factor' (see
+    DEFAULT_FACTOR) and 'points_per_fwhm' (see DEFAULT_POINTS_PER_FWHM).
+    :return: the options or None if the pattern is fitted at full resolution only
+    :rtype: dict | None
+    """
+    if not option:
+        return None
+    if option is True:
+        option = {}
+    factor = option.get('factor', DEFAULT_FACTOR)
+    if not isinstance(factor, int) or isinstance(factor, bool) or factor < 2:
+        raise ValueError('The multiresolution factor has to be an integer of at least 2')
+    points_per_fwhm = option.get('points_per_fwhm', DEFAULT_POINTS_PER_FWHM)
+    if points_per_fwhm <= 0:
+        raise ValueError('The multiresolution points per fwhm have to be positive')
+    return {'factor': factor, 'points_per_fwhm': points_per_fwhm}
+
+
+def resolution_strides(pattern, peaks_list, n_params, factor=DEFAULT_FACTOR,
+                       points_per_fwhm=DEFAULT_POINTS_PER_FWHM):
+    """
+    Strides of the coarse stages of a fit, from the coarsest to the finest, every stride factor times the next
+    one. The coarsest grid keeps points_per_fwhm points per fwhm of the narrowest peak (by the start values)
+    and POINTS_PER_PARAMETER points per parameter. The full resolution stage (stride 1) is not included.
+    :param pattern: the Pattern
+    :param peaks_list: the peaks of the input dictionary
+    :param n_params: number of parameters of the model
+    :rtype: list[int]
+    """
+    max_stride = len(pattern) // (POINTS_PER_PARAMETER * max(1, n_params))
+    if peaks_list and pattern.step > 0:
+        fwhm = min(abs(p['value']) for peak in peaks_list for p in peak['parameters'] if p['name'] == 'fwhm')
+        max_stride = min(max_stride, int(fwhm / (pattern.step * points_per_fwhm)))
+    strides = []
+    stride = factor
+    while stride <= max_stride:
+        strides.insert(0, stride)
+        stride *= factor
+    return strides
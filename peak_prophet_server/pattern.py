@@ -1,5 +1,150 @@
+import hashlib
+
+import numpy as np
+
+# relative deviation of the x steps from the mean step up to which a pattern counts as uniform grid
+UNIFORM_TOLERANCE = 1e-6
+# maximum number of cached x-range index lookups
+RANGE_CACHE_SIZE = 64
+# dtypes of the binary pattern attachments, always little-endian
+BINARY_DTYPES = {'float64': '<f8', 'float32': '<f4'}
+
+
+def read_binary_array(buffer, dtype='float64'):
+    """
+    Read a little-endian float array from a binary attachment, the array uses the buffer without copying it.
+    :param buffer: bytes like object
+    :param dtype: 'float64' or 'float32'
+    :rtype: np.ndarray
+    """
+    if dtype not in BINARY_DTYPES:
+        raise ValueError(f'Unknown binary dtype: {dtype}')
+    return np.frombuffer(buffer, dtype=BINARY_DTYPES[dtype])
+
+
 class Pattern:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+    """
+    Pattern data as contiguous float64 arrays. The data is validated once on construction (matching
+    lengths, strictly increasing x, finite values, non-negative weights), derived quantities like the step
+    size are calculated on first use and cached, the arrays must not be modified afterward.
+    """
+
+    __slots__ = ('x', 'y', 'weights', '_step', '_uniform', '_range_cache', '_hash')
+
+    def __init__(self, x, y, weights=None):
+        """
+        :param x: x values, strictly increasing
+        :param y: y values
+        :param weights: optional weights multiplied with the residual of a fit
+        """
+        self.x = as_float_array(x, 'x')
+        self.y = as_float_array(y, 'y')
+        self.weights = None if weights is None else as_float_array(weights, 'weights')
+
+        if len(self.x) != len(self.y):
+            raise ValueError('Pattern x and y have different lengths')
+        if self.weights is not None:
+            if len(self.weights) != len(self.y):
+                raise ValueError('Pattern weights and y have different lengths')
+            if np.any(self.weights < 0):
+                raise ValueError('Pattern weights have to be non-negative')
+        if np.any(np.diff(self.x) <= 0):
+            raise ValueError('Pattern x has to be strictly increasing')
+
+        self._step = None
+        self._uniform = None
+        self._range_cache = {}
+        self._hash = None
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def nbytes(self):
+        return self.x.nbytes + self.y.nbytes + (0 if self.weights is None else self.weights.nbytes)
+
+    @property
+    def content_hash(self):
+        """
+        Hex digest of the BLAKE2b hash of the float64 data, equal for patterns with identical data.
+        """
+        if self._hash is None:
+            digest = hashlib.blake2b(digest_size=20)
+            digest.update(len(self.x).to_bytes(8, 'little'))
+            digest.update(self.x)
+            digest.update(self.y)
+            if self.weights is not None:
+                digest.update(self.weights)
+            self._hash = digest.hexdigest()
+        return self._hash
+
+    @property
+    def step(self):
+        """
+        Mean x step size, the exact step for a uniform grid.
+        """
+        if self._step is None:
+            self._step = (self.x[-1] - self.x[0]) / (len(self.x) - 1) if len(self.x) > 1 else 0.0
+        return self._step
+
+    @property
+    def is_uniform(self):
+        """
+        True if x is a uniform grid, i.e. x = x[0] + i * step.
+        """
+        if self._uniform is None:
+            self._uniform = (len(self.x) < 3 or
+                             bool(np.all(np.abs(np.diff(self.x) - self.step) <= UNIFORM_TOLERANCE * self.step)))
+        return self._uniform
+
+    def x_range_indices(self, x_min, x_max):
+        """
+        Index range of the points with x_min <= x <= x_max, calculated directly for uniform grids and
+        with a binary search otherwise.
+        :return: start, stop, to be used as slice(start, stop)
+        :rtype: (int, int)
+        """
+        key = (x_min, x_max)
+        indices = self._range_cache.get(key)
+        if indices is None:
+            if self.is_uniform and self.step > 0:
+                start = int(np.clip(np.ceil((x_min - self.x[0]) / self.step - UNIFORM_TOLERANCE), 0, len(self.x)))
+                stop = int(np.clip(np.floor((x_max - self.x[0]) / self.step + UNIFORM_TOLERANCE) + 1, 0,
+                                   len(self.x)))
+                indices = (start, max(start, stop))
+            else:
+                indices = (int(np.searchsorted(self.x, x_min, side='left')),
+                           int(np.searchsorted(self.x, x_max, side='right')))
+            if len(self._range_cache) >= RANGE_CACHE_SIZE:
+                self._range_cache.clear()
+            self._range_cache[key] = indices
+        return indices
+
+    def crop(self, x_min, x_max):
+        """
+        Part of the pattern with x_min <= x <= x_max, the arrays are views of the arrays of this pattern.
+        :rtype: Pattern
+        """
+        start, stop = self.x_range_indices(x_min, x_max)
+        return Pattern(self.x[start:stop], self.y[start:stop],
+                       None if self.weights is None else self.weights[start:stop])
+
+    def decimate(self, stride):
+        """
+        Every stride-th point of the pattern, starting with the first one, as a new pattern with contiguous
+        copies of the points.
+        :rtype: Pattern
+        """
+        return Pattern(self.x[::stride], self.y[::stride], None if self.weights is None else self.weights[::stride])
+
 
+def as_float_array(values, name):
+    """
+    Convert to a contiguous 1D float64 array, without copying if values already is one.
+    """
+    array = np.ascontiguousarray(values, dtype=np.float64)
+    if array.ndim != 1:
+        raise ValueError(f'Pattern {name} has to be one-dimensional')
+    if not np.all(np.isfinite(array)):
+        raise ValueError(f'Pattern {name} contains non-finite values')
+    return array
@@ -0,0 +1,227 @@
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from peak_prophet_server.pattern import Pattern, read_binary_array
+
+MEGABYTE = 1024 ** 2
+# memory limit of the patterns of one session and of the patterns shared between sessions
+SESSION_STORE_BYTES = int(os.getenv("PEAK_PROPHET_SESSION_PATTERNS_MB", 256)) * MEGABYTE
+SHARED_STORE_BYTES = int(os.getenv("PEAK_PROPHET_SHARED_PATTERNS_MB", 1024)) * MEGABYTE
+# maximum number of unfinished chunked uploads per store
+MAX_UPLOADS = 4
+# seconds without a chunk after which an unfinished chunked upload is discarded
+UPLOAD_TIMEOUT = float(os.getenv("PEAK_PROPHET_UPLOAD_TIMEOUT", 300))
+
+
+class PatternStore:
+    """
+    Patterns uploaded once and referenced by their content hash in later fit requests. The least recently
+    used patterns are evicted when the patterns need more memory than max_bytes. A session store can fall
+    back to a store shared between all sessions. The preallocated data of unfinished chunked uploads counts
+    towards the memory of the store the pattern is uploaded to, abandoned uploads expire after UPLOAD_TIMEOUT.
+    """
+
+    def __init__(self, max_bytes=SESSION_STORE_BYTES, shared=None):
+        """
+        :param max_bytes: memory limit for the pattern data
+        :param shared: PatternStore shared between sessions, used by get() if a pattern is not in this store
+        """
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.patterns = OrderedDict()
+        # bytes of the patterns and of the pending uploads
+        self.nbytes = 0
+        # chunked uploads started in this store by upload id
+        self.uploads = {}
+        # unfinished uploads of patterns for this store, also of shared patterns uploaded in session stores
+        self.pending = set()
+
+    def __contains__(self, pattern_id):
+        return pattern_id in self.patterns or (self.shared is not None and pattern_id in self.shared)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def add(self, pattern, shared=False):
+        """
+        Add a pattern, adding the same data again only marks it as recently used.
+        :param pattern: Pattern
+        :param shared: add it to the shared store instead, so that other sessions can use it too
+        :return: pattern id (the content hash)
+        :rtype: str
+        """
+        if shared and self.shared is not None:
+            return self.shared.add(pattern)
+
+        if pattern.nbytes > self.max_bytes:
+            raise ValueError(f'Pattern needs {pattern.nbytes} bytes, the store is limited to {self.max_bytes}')
+        pattern_id = pattern.content_hash
+        if pattern_id in self.patterns:
+            self.patterns.move_to_end(pattern_id)
+            return pattern_id
+
+        self.reserve(pattern.nbytes)
+        self.patterns[pattern_id] = pattern
+        return pattern_id
+
+    def reserve(self, n_bytes):
+        """
+        Add n_bytes to the memory of the store, evicting the least recently used patterns if needed.
+        :raises ValueError: if the pending uploads leave less than n_bytes
+        """
+        self._expire_uploads()
+        pending_bytes = sum(upload.nbytes for upload in self.pending)
+        if n_bytes > self.max_bytes - pending_bytes:
+            raise ValueError(f'Pattern needs {n_bytes} bytes, the store is limited to {self.max_bytes} and '
+                             f'{pending_bytes} bytes are used by unfinished uploads')
+        self.nbytes += n_bytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.patterns.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def get(self, pattern_id):
+        """
+        :param pattern_id: id returned by add()
+        :rtype: Pattern
+        """
+        if pattern_id in self.patterns:
+            self.patterns.move_to_end(pattern_id)
+            return self.patterns[pattern_id]
+        if self.shared is not None and pattern_id in self.shared:
+            return self.shared.get(pattern_id)
+        raise ValueError(f'Unknown pattern id: {pattern_id}, the pattern has to be uploaded (again)')
+
+    def begin_upload(self, n_points, dtype='float64', weights=False, shared=False):
+        """
+        Start a chunked upload of a pattern with n_points points.
+        :return: upload id
+        :rtype: str
+        """
+        store = self.shared if shared and self.shared is not None else self
+        n_bytes = n_points * 8 * (3 if weights else 2)
+        if n_bytes > store.max_bytes:
+            raise ValueError(f'Pattern needs {n_bytes} bytes, the store is limited to {store.max_bytes}')
+        self._expire_uploads()
+        if len(self.uploads) >= MAX_UPLOADS:
+            raise ValueError(f'Only {MAX_UPLOADS} uploads can be in progress at the same time')
+        store.reserve(n_bytes)
+        upload = PatternUpload(n_points, dtype, weights, store)
+        store.pending.add(upload)
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = upload
+        return upload_id
+
+    def upload_chunk(self, upload_id, offset, x, y, weights=None):
+        """
+        Write a chunk of binary data at the point offset.
+        :return: number of points received so far
+        """
+        return self._get_upload(upload_id).write(offset, x, y, weights)
+
+    def finish_upload(self, upload_id, expected_hash=None):
+        """
+        Finish a chunked upload and add the pattern to the store.
+        :param expected_hash: content hash calculated by the client, checked if given
+        :return: pattern id
+        """
+        upload = self._get_upload(upload_id)
+        pattern = upload.pattern()
+        if expected_hash is not None and expected_hash != pattern.content_hash:
+            raise ValueError('The uploaded pattern does not match the expected hash')
+        # an incomplete or mismatching upload is kept, so that the missing or wrong chunks can be sent again
+        del self.uploads[upload_id]
+        upload.store._discard_upload(upload)
+        return upload.store.add(pattern)
+
+    def cancel_upload(self, upload_id):
+        upload = self.uploads.pop(upload_id, None)
+        if upload is not None:
+            upload.store._discard_upload(upload)
+
+    def close(self):
+        """
+        Cancel the unfinished uploads, when the client disconnects.
+        """
+        for upload_id in list(self.uploads):
+            self.cancel_upload(upload_id)
+
+    def _discard_upload(self, upload):
+        if upload in self.pending:
+            self.pending.remove(upload)
+            self.nbytes -= upload.nbytes
+        upload.release()
+
+    def _expire_uploads(self):
+        for upload_id, upload in list(self.uploads.items()):
+            if upload.expired:
+                self.cancel_upload(upload_id)
+        for upload in list(self.pending):
+            if upload.expired:
+                self._discard_upload(upload)
+
+    def _get_upload(self, upload_id):
+        self._expire_uploads()
+        if upload_id not in self.uploads:
+            raise ValueError(f'Unknown upload id: {upload_id}')
+        return self.uploads[upload_id]
+
+
+class PatternUpload:
+    """
+    Pattern data received in chunks, written into preallocated arrays.
+    """
+
+    def __init__(self, n_points, dtype, weights, store):
+        """
+        :param store: PatternStore the pattern is added to, its memory includes the arrays of the upload
+        """
+        self.dtype = dtype
+        self.store = store
+        self.x = np.empty(n_points)
+        self.y = np.empty(n_points)
+        self.weights = np.empty(n_points) if weights else None
+        self.received = np.zeros(n_points, dtype=bool)
+        self.nbytes = self.x.nbytes + self.y.nbytes + (self.weights.nbytes if weights else 0)
+        self.last_chunk = time.monotonic()
+
+    @property
+    def expired(self):
+        return time.monotonic() - self.last_chunk > UPLOAD_TIMEOUT
+
+    def write(self, offset, x, y, weights=None):
+        x = read_binary_array(x, self.dtype)
+        y = read_binary_array(y, self.dtype)
+        if len(x) != len(y) or (self.weights is not None and weights is None):
+            raise ValueError('Chunks of x, y and weights need to have the same length')
+        if offset < 0 or offset + len(x) > len(self.x):
+            raise ValueError('Chunk is outside of the pattern')
+
+        chunk = slice(offset, offset + len(x))
+        self.x[chunk] = x
+        self.y[chunk] = y
+        if self.weights is not None:
+            weights = read_binary_array(weights, self.dtype)
+            if len(weights) != len(x):
+                raise ValueError('Chunks of x, y and weights need to have the same length')
+            self.weights[chunk] = weights
+        self.received[chunk] = True
+        self.last_chunk = time.monotonic()
+        return int(np.count_nonzero(self.received))
+
+    def pattern(self):
+        if not np.all(self.received):
+            raise ValueError('Upload is incomplete')
+        return Pattern(self.x, self.y, self.weights)
+
+    def release(self):
+        """
+        Drop the data of a finished, cancelled or expired upload, the pattern keeps its own reference.
+        """
+        self.x = self.y = self.weights = None
+
+
+shared_store = PatternStore(SHARED_STORE_BYTES)
@@ -0,0 +1,228 @@
+import numpy as np
+from numpy.polynomial import Polynomial
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import peak_prominences, peak_widths
+
+# number of windows whose minima are used to estimate the background
+BACKGROUND_WINDOWS = 512
+# iterations of the background fit, in which the window minima above the fitted background are clipped
+BACKGROUND_ITERATIONS = 20
+# minimum prominence of a peak in units of the noise of the pattern
+DEFAULT_MIN_SNR = 5
+# default minimum fwhm of a peak in points, excludes spikes of the noise
+MIN_FWHM_POINTS = 4
+# half width in points of the neighbourhood in which maxima are checked for a higher point, see prominence_candidates
+CANDIDATE_RADIUS = 8
+# bounds of the fwhm of a detected peak relative to the estimated fwhm
+FWHM_BOUNDS = (0.2, 5)
+# initial Lorentzian fraction of pseudo-Voigt peaks
+DEFAULT_FRACTION = 0.5
+
+
+def detect_peaks(pattern, peak_type='gaussian', background_type='linear', degree=None, min_snr=DEFAULT_MIN_SNR,
+                 min_prominence=None, min_fwhm=None, max_peaks=None):
+    """
+    Estimate the background and find the peaks of a pattern, as initial guesses for a fit.
+    :param pattern: Pattern
+    :param peak_type: type of the returned peaks, 'gaussian', 'lorentzian' or 'pseudovoigt'
+    :param background_type: 'linear', 'quadratic' or 'polynomial'
+    :param degree: degree of a polynomial background
+    :param min_snr: minimum prominence of a peak in units of the noise
+    :param min_prominence: minimum prominence of a peak in y units, used instead of min_snr if given
+    :param min_fwhm: minimum fwhm of a peak in x units, MIN_FWHM_POINTS times the step by default
+    :param max_peaks: maximum number of peaks, the most prominent peaks are returned
+    :return: background and peaks in the format of the input dictionary (see data_reader.read_data)
+    :rtype: (dict, list[dict])
+    """
+    if peak_type.lower() not in ('gaussian', 'lorentzian', 'pseudovoigt'):
+        raise ValueError(f'Unknown peak type: {peak_type}')
+    if len(pattern) < 3:
+        raise ValueError('The pattern needs at least 3 points to detect peaks')
+
+    noise = estimate_noise(pattern.y)
+    background = estimate_background(pattern, background_type, degree, noise)
+    signal = pattern.y - background(pattern.x)
+    if min_prominence is None:
+        min_prominence = min_snr * noise
+    min_width = MIN_FWHM_POINTS if min_fwhm is None or pattern.step == 0 else min_fwhm / pattern.step
+
+    # a moving average over the minimum width removes most maxima of the noise
+    signal = moving_average(signal, max(1, int(min_width)))
+    indices = local_maxima(signal)
+    indices = indices[signal[indices] >= min_prominence]
+    indices = prominence_candidates(signal, indices, min_prominence)
+    prominences = peak_prominences(signal, indices)
+    selected = prominences[0] >= min_prominence
+    indices = indices[selected]
+    prominences = tuple(value[selected] for value in prominences)
+    widths = peak_widths(signal, indices, rel_height=0.5, prominence_data=prominences)
+    selected = widths[0] >= min_width
+    indices = indices[selected]
+    properties = {'prominences': prominences[0][selected], 'left_ips': widths[2][selected],
+                  'right_ips': widths[3][selected]}
+
+    if max_peaks is not None and len(indices) > max_peaks:
+        keep = np.sort(np.argsort(properties['prominences'])[::-1][:max_peaks])
+        indices = indices[keep]
+        properties = {key: value[keep] for key, value in properties.items()}
+
+    point_indices = np.arange(len(pattern))
+    left = np.interp(properties['left_ips'], point_indices, pattern.x)
+    right = np.interp(properties['right_ips'], point_indices, pattern.x)
+    fwhm = np.maximum(right - left, pattern.step)
+    heights = properties['prominences']
+    amplitudes = heights * fwhm * peak_area_factor(peak_type.lower())
+
+    peaks = [create_peak_dict(peak_type, amplitudes[i], pattern.x[indices[i]], fwhm[i], left[i], right[i])
+             for i in range(len(indices))]
+    return create_background_dict(background, background_type, degree), peaks
+
+
+def moving_average(y, window):
+    """
+    Centered moving average, shorter at the ends.
+    :param window: number of points
+    :rtype: np.ndarray
+    """
+    if window <= 1:
+        return y
+    cumulative = np.concatenate(([0.0], np.cumsum(y)))
+    stop = np.minimum(np.arange(len(y)) + window - window // 2, len(y))
+    start = np.maximum(np.arange(len(y)) - window // 2, 0)
+    return (cumulative[stop] - cumulative[start]) / (stop - start)
+
+
+def local_maxima(y):
+    """
+    Indices of the points which are higher than their left neighbour and not lower than their right neighbour.
+    :rtype: np.ndarray
+    """
+    return np.flatnonzero((y[1:-1] > y[:-2]) & (y[1:-1] >= y[2:])) + 1
+
+
+def prominence_candidates(y, maxima, min_prominence, radius=CANDIDATE_RADIUS):
+    """
+    Remove the maxima whose prominence is certainly below min_prominence, which are most maxima of the noise
+    on top of broad peaks. The prominence of a maximum is its height above the higher one of the minima between it
+    and the nearest higher points on both sides. If there is a higher point within radius on one side, the minimum
+    on that side is known and its difference to the maximum is an upper bound of the prominence. This is checked
+    for all maxima at once, so that the exact prominence only has to be calculated for the remaining ones.
+    :param y: the signal
+    :param maxima: indices of the local maxima
+    :param min_prominence: minimum prominence
+    :param radius: size of the neighbourhood in points on each side of a maximum
+    :return: the maxima which can have a prominence of at least min_prominence
+    :rtype: np.ndarray
+    """
+    if len(maxima) == 0:
+        return maxima
+    padded = np.pad(y, radius, constant_values=-np.inf)
+    windows = sliding_window_view(padded, 2 * radius + 1)[maxima]
+    heights = y[maxima][:, None]
+    keep = np.ones(len(maxima), dtype=bool)
+    # the neighbourhoods left and right of the maxima, ordered by the distance to the maximum
+    for side in (windows[:, radius - 1::-1], windows[:, radius + 1:]):
+        higher = side > heights
+        has_higher = higher.any(axis=1)
+        nearest = np.argmax(higher, axis=1)
+        minima = np.minimum.accumulate(side, axis=1)[np.arange(len(maxima)), nearest]
+        keep &= ~has_higher | (heights[:, 0] - minima >= min_prominence)
+    return maxima[keep]
+
+
+def estimate_background(pattern, background_type='linear', degree=None, noise=None):
+    """
+    Fit a polynomial of the degree of the background type to the minima of BACKGROUND_WINDOWS windows of the
+    pattern, the minima above the fitted polynomial are clipped to it in every iteration, so that the peaks are
+    ignored. The minima are below the background by a multiple of the noise, the polynomial is shifted by the
+    median of the points within 3 noise levels of it to correct for that.
+    :param noise: noise of the pattern, see estimate_noise
+    :rtype: Polynomial
+    """
+    match background_type:
+        case 'linear':
+            degree = 1
+        case 'quadratic':
+            degree = 2
+        case 'polynomial':
+            if degree is None:
+                raise ValueError('A polynomial background needs a degree')
+        case _:
+            raise ValueError('Unknown background type')
+
+    n_windows = min(BACKGROUND_WINDOWS, len(pattern))
+    starts = np.linspace(0, len(pattern), n_windows + 1).astype(int)[:-1]
+    counts = np.diff(np.append(starts, len(pattern)))
+    x = np.add.reduceat(pattern.x, starts) / counts
+    y = np.minimum.reduceat(pattern.y, starts)
+    degree = min(degree, n_windows - 1)
+
+    for _ in range(BACKGROUND_ITERATIONS):
+        background = Polynomial.fit(x, y, degree)
+        y = np.minimum(y, background(x))
+
+    if noise is None:
+        noise = estimate_noise(pattern.y)
+    residual = pattern.y - background(pattern.x)
+    offset = np.min(residual)
+    for _ in range(3):
+        offset = np.median(residual[residual < offset + 3 * noise])
+    return background + offset
+
+
+def estimate_noise(y):
+    """
+    Standard deviation of the noise, from the median absolute difference of neighbouring points.
+    """
+    return 1.4826 * np.median(np.abs(np.diff(y))) / np.sqrt(2)
+
+
+def peak_area_factor(peak_type, fraction=DEFAULT_FRACTION):
+    """
+    Ratio of the amplitude (area) of a peak to its height times fwhm.
+    """
+    gaussian = np.sqrt(np.pi / 4 / np.log(2))
+    lorentzian = np.pi / 2
+    match peak_type:
+        case 'gaussian':
+            return gaussian
+        case 'lorentzian':
+            return lorentzian
+        case 'pseudovoigt':
+            return 1 / ((1 - fraction) / gaussian + fraction / lorentzian)
+
+
+def create_peak_dict(peak_type, amplitude, center, fwhm, center_min, center_max):
+    parameters = [
+        {'name': 'amplitude', 'value': float(amplitude), 'vary': True, 'min': 0, 'max': None},
+        {'name': 'center', 'value': float(center), 'vary': True, 'min': float(center_min),
+         'max': float(center_max)},
+        {'name': 'fwhm', 'value': float(fwhm), 'vary': True, 'min': float(fwhm * FWHM_BOUNDS[0]),
+         'max': float(fwhm * FWHM_BOUNDS[1])},
+    ]
+    if peak_type.lower() == 'pseudovoigt':
+        parameters.append({'name': 'fraction', 'value': DEFAULT_FRACTION, 'vary': True, 'min': 0, 'max': 1})
+    return {'type': peak_type, 'parameters': parameters}
+
+
+def create_background_dict(background, background_type, degree=None):
+    """
+    :param background: the background as Polynomial
+    :return: the background in the format of the input dictionary
+    :rtype: dict
+    """
+    coefficients = background.convert().coef
+    match background_type:
+        case 'linear':
+            names = ['intercept', 'slope']
+        case 'quadratic':
+            names = ['c', 'b', 'a']
+        case _:
+            names = [f'c{i}' for i in range(degree + 1)]
+    coefficients = np.pad(coefficients, (0, max(0, len(names) - len(coefficients))))
+    background_dict = {'type': background_type,
+                       'parameters': [{'name': name, 'value': float(value), 'vary': True, 'min': None, 'max': None}
+                                      for name, value in zip(names, coefficients)]}
+    if background_type == 'polynomial':
+        background_dict['degree'] = degree
+    return background_dict
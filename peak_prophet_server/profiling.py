@@ -0,0 +1,270 @@
+"""
+Opt-in profiling of single fit jobs, switched on per request ("profile": true) or per session
+("set_profiling"). A profiled job runs its parsing, model building, fits and output under cProfile and is
+stored by its job id:
+
+- request.json: the decoded request with the pattern data, a fit request which can be replayed offline
+- last_fit.json: the last fit of the session, the start of warm started fits
+- profile.prof: the cProfile statistics, e.g. for ``python -m pstats`` or snakeviz
+- summary.json: timings, counts and the most expensive functions
+
+Replay a stored request offline with ``python -m peak_prophet_server.profiling <job id or directory>``.
+"""
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+PROFILE_DIR = os.getenv("PEAK_PROPHET_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "peak_prophet_profiles"))
+MAX_PROFILES = int(os.getenv("PEAK_PROPHET_MAX_PROFILES", 32))
+# number of functions in the summary, by cumulative time
+TOP_FUNCTIONS = 25
+# functions counted in the summary: the objective function of lmfit, called for every function evaluation
+# including the Jacobian estimation, and the iteration callbacks of the server
+RESIDUAL_FUNCTION = "__residual"
+ITER_CB_FUNCTION = "iter_cb"
+
+
+class FitProfile:
+    """
+    cProfile statistics and timings of one job. Every profiled call gets its own profiler, because a profiler
+    only sees the thread it was enabled in and the fits of one job can run in several threads at once, the
+    statistics of the calls are merged.
+    """
+
+    def __init__(self, job_id=None, sid=None, kind="fit"):
+        self.job_id = job_id
+        self.sid = sid
+        self.kind = kind
+        self.start = datetime.now(timezone.utc)
+        self.stats = None
+        # wall time in seconds of the phases, see FitManager.phases
+        self.phases = {}
+        # decoded request and patterns of the job, stored for the replay
+        self.data_dict = None
+        self.patterns = None
+        self.last_fit = None
+        self._lock = threading.Lock()
+
+    def call(self, function, *args):
+        """
+        Call a function under cProfile in the current thread.
+        """
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args)
+        finally:
+            with self._lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profiler)
+                else:
+                    self.stats.add(profiler)
+
+    def count_calls(self, function_name):
+        """
+        :return: number of calls of the functions with the name
+        :rtype: int
+        """
+        if self.stats is None:
+            return 0
+        return sum(entry[1] for (_, _, name), entry in self.stats.stats.items() if name == function_name)
+
+    def top_functions(self, n=TOP_FUNCTIONS):
+        if self.stats is None:
+            return []
+        entries = sorted(self.stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:n]
+        return [
+            {
+                "function": pstats.func_std_string(function),
+                "ncalls": entry[1],
+                "tottime": entry[2],
+                "cumtime": entry[3],
+            }
+            for function, entry in entries
+        ]
+
+    def summary(self, state=None, response=None, error=None):
+        """
+        :param state: final state of the job
+        :param response: response of the job, a list of responses for series
+        :param error: error message of a failed job
+        :rtype: dict
+        """
+        responses = response if isinstance(response, list) else [response] if response is not None else []
+        patterns = self.patterns or []
+        return {
+            "job_id": self.job_id,
+            "sid": self.sid,
+            "kind": self.kind,
+            "start": self.start.isoformat(),
+            "state": state,
+            "error": error,
+            "phases": self.phases,
+            "nfev": sum(r.get("nfev", 0) for r in responses if r is not None),
+            "residual_calls": self.count_calls(RESIDUAL_FUNCTION),
+            "iter_cb_calls": self.count_calls(ITER_CB_FUNCTION),
+            "points": sum(len(pattern) for pattern in patterns),
+            "peaks": len(self.data_dict["peaks"]) if self.data_dict is not None else None,
+            "top": self.top_functions(),
+        }
+
+
+class ProfileStore:
+    """
+    Profiles of the finished profiled jobs in a directory per job id, only the newest max_profiles are kept.
+    The directory can be shared by the server processes of a machine.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, max_profiles=MAX_PROFILES):
+        self.directory = directory
+        self.max_profiles = max_profiles
+
+    def path(self, job_id):
+        if not job_id or os.path.basename(job_id) != job_id or job_id.startswith("."):
+            raise ValueError(f"Invalid job id: {job_id!r}")
+        return os.path.join(self.directory, job_id)
+
+    def save(self, profile, state=None, response=None, error=None):
+        """
+        :return: the summary of the profile
+        :rtype: dict
+        """
+        path = self.path(profile.job_id)
+        os.makedirs(path, exist_ok=True)
+        summary = profile.summary(state, response, error)
+        if profile.data_dict is not None:
+            write_json(os.path.join(path, "request.json"), replay_request(profile.data_dict, profile.patterns))
+        if profile.last_fit is not None:
+            write_json(os.path.join(path, "last_fit.json"), profile.last_fit)
+        if profile.stats is not None:
+            profile.stats.dump_stats(os.path.join(path, "profile.prof"))
+        write_json(os.path.join(path, "summary.json"), summary)
+        self._prune()
+        return summary
+
+    def load(self, job_id, sid=None):
+        """
+        :param sid: only load the profile of a job of this session, any job's if None
+        :return: the summary of the profile of a job
+        :rtype: dict
+        :raises ValueError: if there is no profile of the job (of the session)
+        """
+        try:
+            with open(os.path.join(self.path(job_id), "summary.json")) as f:
+                summary = json.load(f)
+        except FileNotFoundError:
+            raise ValueError(f"No profile of job {job_id}")
+        if sid is not None and summary.get("sid") != sid:
+            raise ValueError(f"No profile of job {job_id}")
+        return summary
+
+    def _prune(self):
+        paths = [entry.path for entry in os.scandir(self.directory) if entry.is_dir()]
+        paths.sort(key=os.path.getmtime)
+        for path in paths[: max(0, len(paths) - self.max_profiles)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def replay_request(data_dict, patterns):
+    """
+    :param data_dict: decoded request
+    :param patterns: patterns of the request, one for a fit, all of the series for a series
+    :return: a JSON fit request with the pattern data, also for requests referencing uploaded patterns
+    :rtype: dict
+    """
+    request = {key: value for key, value in data_dict.items() if key not in ("pattern", "patterns")}
+    pattern_dicts = [pattern_request(pattern) for pattern in patterns or []]
+    if "patterns" in data_dict:
+        request["patterns"] = pattern_dicts
+    elif pattern_dicts:
+        request["pattern"] = pattern_dicts[0]
+    return request
+
+
+def pattern_request(pattern):
+    pattern_dict = {"x": pattern.x, "y": pattern.y}
+    if pattern.weights is not None:
+        pattern_dict["weights"] = pattern.weights
+    return pattern_dict
+
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f, default=json_default)
+
+
+def json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# store of the server process
+profile_store = ProfileStore()
+
+
+async def replay(path, runs=1):
+    """
+    Fit a stored request again in a new FitManager under cProfile.
+    :return: the profile and response of the last run
+    :rtype: (FitProfile, dict | list[dict])
+    """
+    from .fitting import FitManager
+
+    with open(os.path.join(path, "request.json")) as f:
+        request = f.read()
+    last_fit = None
+    if os.path.exists(os.path.join(path, "last_fit.json")):
+        with open(os.path.join(path, "last_fit.json")) as f:
+            last_fit = tuple(json.load(f))
+    series = "patterns" in json.loads(request)
+
+    for _ in range(runs):
+        fit_manager = FitManager("REPLAY")
+        fit_manager.last_fit = last_fit
+        fit_manager.profile = FitProfile("replay", kind="series" if series else "fit")
+        if series:
+            response = await fit_manager.process_series(request)
+        else:
+            response = await fit_manager.process_request(request)
+    return fit_manager.profile, response
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a profiled fit request offline.")
+    parser.add_argument("profile", help="job id in the profile directory or path of a profile directory")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--sort", default="cumulative", help="sort order of the printed statistics")
+    parser.add_argument("--limit", type=int, default=TOP_FUNCTIONS)
+    args = parser.parse_args(argv)
+
+    path = args.profile if os.path.isdir(args.profile) else profile_store.path(args.profile)
+    with open(os.path.join(path, "summary.json")) as f:
+        captured = json.load(f)
+    profile, response = asyncio.run(replay(path, args.runs))
+    replayed = profile.summary(response=response)
+
+    for key in ("nfev", "residual_calls", "iter_cb_calls"):
+        print(f"{key}: captured {captured[key]}, replayed {replayed[key]}")
+    for phase, duration in replayed["phases"].items():
+        captured_duration = captured["phases"].get(phase)
+        captured_text = f"{captured_duration * 1e3:.1f} ms" if captured_duration is not None else "-"
+        print(f"{phase}: captured {captured_text}, replayed {duration * 1e3:.1f} ms")
+    if profile.stats is not None:
+        profile.stats.sort_stats(args.sort).print_stats(args.limit)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import asyncio
+from collections import OrderedDict
+
+import numpy as np
+from socketio.exceptions import TimeoutError
+
+DEFAULT_MAX_RATE = 5
+MAX_RATE = 60
+ACK_TIMEOUT = 10
+# number of bins of the residual envelope, about the width of a plot in pixels
+DEFAULT_WIDTH = 1024
+RESID_FORMATS = ("envelope", "float32")
+# sent compact progress messages kept as base of the parameter deltas until they are acknowledged
+MAX_UNACKNOWLEDGED = 16
+
+
+class ProgressPublisher:
+    """
+    Pushes the progress of the fits of one client with 'progress' events, instead of the client polling
+    with 'request_progress'.
+
+    The publisher wakes up at most max_rate times per second and only sends a snapshot when a new iteration
+    was done since the last one, intermediate iterations are skipped. Nothing is called from the fitting
+    thread or process, the publisher only reads the progress of the FitManager. With ack=True the client
+    has to acknowledge every progress event before the next one is sent, so a slow client gets the latest
+    snapshot instead of a queue of stale ones.
+    """
+
+    def __init__(self, sio, sid, fit_manager, max_rate=DEFAULT_MAX_RATE, ack=False, encoder=None):
+        """
+        :param sio: socketio.AsyncServer
+        :param sid: session id of the client
+        :param fit_manager: FitManager of the client or its JobManager, which follows the latest job
+        :param max_rate: maximum number of progress events per second
+        :param ack: wait for the acknowledgement of the client before sending the next progress event
+        :param encoder: ProgressEncoder to send compact progress, with ack=True every acknowledged event
+                        becomes the base of the parameter deltas
+        """
+        if max_rate <= 0:
+            raise ValueError("max_rate has to be positive")
+        self.sio = sio
+        self.sid = sid
+        self.fit_manager = fit_manager
+        self.interval = 1 / min(max_rate, MAX_RATE)
+        self.ack = ack
+        self.encoder = encoder
+        self.task = None
+        self.last_version = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.publish()
+
+    async def publish(self):
+        """
+        Send the current progress if it changed since the last published one.
+        :return: True if a progress event was sent
+        """
+        version = self.fit_manager.progress_version
+        if version == self.last_version:
+            return False
+        self.last_version = version
+        if self.encoder is not None:
+            progress = self.fit_manager.compact_progress(self.encoder)
+        else:
+            progress = self.fit_manager.current_progress
+        if progress is None:
+            return False
+
+        if self.ack:
+            try:
+                await self.sio.call("progress", progress, to=self.sid, timeout=ACK_TIMEOUT)
+            except TimeoutError:
+                pass
+            else:
+                if self.encoder is not None:
+                    self.encoder.acknowledge(progress["seq"])
+        else:
+            await self.sio.emit("progress", progress, to=self.sid)
+        return True
+
+
+class ProgressEncoder:
+    """
+    Creates compact progress messages for one client. The full progress has the residual of every point and
+    all parameters of every iteration, for large patterns megabytes of JSON per message. A compact message has
+
+    - "seq": sequence number of the message, the client acknowledges it to make it the base of the deltas
+    - "iter", "chi2", "red_chi2": as in the full progress
+    - "resid": with resid="envelope" {"index", "min", "max"}, the minimum and maximum residual in width
+      bins of consecutive points, "index" is the first point of each bin, with resid="float32" the residual
+      as little endian float32 binary
+    - "full": True if the message has all parameters, False if it only has the parameters which changed
+      since the last acknowledged message
+    - "background": {name: value} and "peaks": {peak index: {name: value}} of the parameters
+
+    The client applies every message to its copy of the parameters in the order received. The first message
+    of a job is full, so is every message until the client acknowledged one.
+    """
+
+    def __init__(self, width=DEFAULT_WIDTH, resid="envelope"):
+        """
+        :param width: number of bins of the residual envelope
+        :param resid: "envelope" or "float32"
+        """
+        self.configure(width, resid)
+        self.seq = 0
+        # seq: (key, values) of the sent messages which are not acknowledged yet
+        self.sent = OrderedDict()
+        self.base_key = None
+        self.base_values = None
+        # parameters which changed since the base in any message sent after it
+        self.dirty = None
+
+    def configure(self, width=None, resid=None):
+        """
+        Change the width and the residual format, None keeps the current one.
+        :raises ValueError: for an invalid width or format
+        """
+        width = self.width if width is None else width
+        resid = self.resid if resid is None else resid
+        if not isinstance(width, int) or isinstance(width, bool) or width < 1:
+            raise ValueError(f"width has to be a positive integer, got {width!r}")
+        if resid not in RESID_FORMATS:
+            raise ValueError(f"resid has to be one of {', '.join(RESID_FORMATS)}, got {resid!r}")
+        self.width = width
+        self.resid = resid
+
+    def acknowledge(self, seq):
+        """
+        Make a sent message the base of the parameter deltas, older messages are dropped.
+        """
+        if seq not in self.sent:
+            return
+        while True:
+            sent_seq, (key, values) = self.sent.popitem(last=False)
+            if sent_seq == seq:
+                break
+        self.base_key = key
+        self.base_values = values
+        self.dirty = np.zeros(len(values), dtype=bool)
+        for sent_key, sent_values in self.sent.values():
+            if sent_key == key:
+                self.dirty |= sent_values != values
+
+    def encode(self, key, fit_manager):
+        """
+        :param key: id of the job of the fit, deltas are only sent relative to a message of the same job
+        :param fit_manager: FitManager of the job
+        :return: compact progress of the last iteration, None before the first iteration
+        :rtype: dict | None
+        """
+        snapshot = fit_manager.progress_snapshot
+        if snapshot is None:
+            return None
+        iteration, chi2, values, resid = snapshot
+        result = fit_manager.create_progress_result(values)
+        values = np.array(
+            [param["value"] for param in result["background"]["parameters"]]
+            + [param["value"] for peak in result["peaks"] for param in peak["parameters"]],
+            dtype=float,
+        )
+
+        full = key != self.base_key or len(values) != len(self.base_values)
+        if full:
+            changed = np.ones(len(values), dtype=bool)
+        else:
+            self.dirty |= values != self.base_values
+            changed = self.dirty
+
+        self.seq += 1
+        self.sent[self.seq] = (key, values)
+        if len(self.sent) > MAX_UNACKNOWLEDGED:
+            self.sent.popitem(last=False)
+
+        message = {
+            "seq": self.seq,
+            "iter": iteration,
+            "chi2": chi2,
+            "red_chi2": chi2 / (len(fit_manager.pattern) - 1),
+            "resid": self.encode_resid(resid),
+            "full": full,
+            "background": {},
+            "peaks": {},
+        }
+        i = 0
+        for param in result["background"]["parameters"]:
+            if changed[i]:
+                message["background"][param["name"]] = param["value"]
+            i += 1
+        for index, peak in enumerate(result["peaks"]):
+            for param in peak["parameters"]:
+                if changed[i]:
+                    message["peaks"].setdefault(str(index), {})[param["name"]] = param["value"]
+                i += 1
+        return message
+
+    def encode_resid(self, resid):
+        if self.resid == "float32":
+            return resid.astype("<f4").tobytes()
+        return resid_envelope(resid, self.width)
+
+
+def resid_envelope(resid, width):
+    """
+    Minimum and maximum of the residual in width bins of consecutive points, a plot of both lines looks the
+    same as the plot of all points at that width.
+    :rtype: dict
+    """
+    n_bins = min(width, len(resid))
+    if n_bins == 0:
+        return {"index": [], "min": [], "max": []}
+    index = np.linspace(0, len(resid), n_bins + 1).astype(int)[:-1]
+    return {
+        "index": index.tolist(),
+        "min": np.minimum.reduceat(resid, index).tolist(),
+        "max": np.maximum.reduceat(resid, index).tolist(),
+    }
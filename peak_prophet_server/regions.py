@@ -0,0 +1,127 @@
+import numpy as np
+
+from peak_prophet_server.engine import MultiPeakModel
+
+# half width of the x-range of a peak in units of its fwhm, peaks with overlapping ranges are in the same region
+DEFAULT_RADIUS = 5
+# regions whose peaks are in one region when the radius is multiplied by this factor are coupled and refined
+# together in the final joint fit
+COUPLING_FACTOR = 2
+
+
+def region_options(option):
+    """
+    Read the 'regions' option of a fit request, either a bool or a dictionary with 'radius' (see DEFAULT_RADIUS)
+    and 'refine' (refine the peaks of coupled regions in a final joint fit, default True).
+    :return: the options or None if the pattern is not split into regions
+    :rtype: dict | None
+    """
+    if not option:
+        return None
+    if option is True:
+        option = {}
+    radius = option.get('radius', DEFAULT_RADIUS)
+    if radius <= 0:
+        raise ValueError('The region radius has to be positive')
+    return {'radius': radius, 'refine': option.get('refine', True)}
+
+
+class Region:
+    """
+    Indices of peaks which overlap each other but no other peaks and the x-range covered by them.
+    """
+
+    def __init__(self, peaks, x_min, x_max):
+        self.peaks = peaks
+        self.x_min = x_min
+        self.x_max = x_max
+
+    def __repr__(self):
+        return f'Region(peaks={self.peaks}, x_min={self.x_min}, x_max={self.x_max})'
+
+
+def find_regions(peaks_list, radius=DEFAULT_RADIUS):
+    """
+    Split the peaks into independent regions. Every peak covers center +- radius * fwhm, peaks with
+    overlapping ranges are in the same region.
+    :param peaks_list: the peaks of the input dictionary
+    :param radius: see DEFAULT_RADIUS
+    :return: regions sorted by x
+    :rtype: list[Region]
+    """
+    if not peaks_list:
+        return []
+    centers = np.empty(len(peaks_list))
+    widths = np.empty(len(peaks_list))
+    for i, peak_dict in enumerate(peaks_list):
+        values = {p['name']: p['value'] for p in peak_dict['parameters']}
+        centers[i] = values['center']
+        widths[i] = radius * abs(values['fwhm'])
+    lower = centers - widths
+    upper = centers + widths
+
+    order = np.argsort(lower, kind='stable')
+    # a new region starts where a peak starts after the end of all previous peaks
+    ends = np.maximum.accumulate(upper[order])
+    starts = np.flatnonzero(lower[order][1:] > ends[:-1]) + 1
+    regions = []
+    for indices in np.split(order, starts):
+        regions.append(Region(sorted(indices.tolist()), float(lower[indices].min()), float(upper[indices].max())))
+    return regions
+
+
+def coupled_peaks(peaks_list, regions, radius=DEFAULT_RADIUS):
+    """
+    Peaks of regions which are close enough to neighbouring regions that they still influence each other, i.e.
+    which are in the same region for COUPLING_FACTOR times the radius.
+    :rtype: list[int]
+    """
+    region_of_peak = {peak: i for i, region in enumerate(regions) for peak in region.peaks}
+    coupled = []
+    for wide_region in find_regions(peaks_list, radius * COUPLING_FACTOR):
+        if len({region_of_peak[peak] for peak in wide_region.peaks}) > 1:
+            coupled.extend(wide_region.peaks)
+    return sorted(coupled)
+
+
+def region_dict(data_dict, region):
+    """
+    Input dictionary of the peaks of a region with a local linear background, which starts on the line through
+    the global background at the ends of the region.
+    :param data_dict: the input dictionary
+    :param region: Region
+    :rtype: dict
+    """
+    background = data_dict['background']
+    model = MultiPeakModel(background['type'], [], background.get('degree'))
+    values = {p['name']: p['value'] for p in background['parameters']}
+    coefficients = np.array([values[name[len('bkg_'):]] for name in model.param_names], dtype=float)
+    x = np.array([region.x_min, region.x_max])
+    y = model.evaluate_background(coefficients, x)
+    slope = (y[1] - y[0]) / (x[1] - x[0]) if x[1] > x[0] else 0.0
+
+    sub_dict = {
+        'background': {'type': 'linear', 'parameters': [{'name': 'intercept', 'value': float(y[0] - slope * x[0])},
+                                                        {'name': 'slope', 'value': float(slope)}]},
+        'peaks': [data_dict['peaks'][i] for i in region.peaks],
+    }
+    if 'solver' in data_dict:
+        sub_dict['solver'] = data_dict['solver']
+    return sub_dict
+
+
+def region_parameter_names(sub_dict, region):
+    """
+    Names of the parameters of the request of the peak parameters of a region fit, the local background of the
+    region has no parameters in the request.
+    :param sub_dict: the input dictionary of the region, see region_dict
+    :param region: Region
+    :return: {parameter of the region fit: parameter of the request}
+    :rtype: dict
+    """
+    names = {}
+    for name in MultiPeakModel.from_dict(sub_dict).param_names:
+        if name.startswith('p'):
+            index, suffix = name[1:].split('_', 1)
+            names[name] = f'p{region.peaks[int(index)]}_{suffix}'
+    return names
@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from copy import deepcopy
+
+from peak_prophet_server.metrics import metrics
+
+MEGABYTE = 1024 ** 2
+# memory limit of the cached responses, 0 disables the cache, identical requests in flight are still shared
+RESULT_CACHE_BYTES = int(os.getenv('PEAK_PROPHET_RESULT_CACHE_MB', 64)) * MEGABYTE
+# keys of the request which do not change the response
+IGNORED_KEYS = ('pattern', 'profile')
+
+
+def request_key(data_dict, pattern, engine):
+    """
+    Canonical hash of a fit request: the content hash of the pattern data, the engine and the request without
+    the pattern as JSON with sorted keys. Requests with the same key have the same response, whether their
+    pattern was sent as lists, as binary data or uploaded before.
+    :param data_dict: the decoded input dictionary, see schema.decode_request
+    :param pattern: Pattern of the request
+    :param engine: engine used for the fit
+    :rtype: str
+    """
+    model = {key: value for key, value in data_dict.items() if key not in IGNORED_KEYS}
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(pattern.content_hash.encode())
+    digest.update(engine.encode())
+    digest.update(json.dumps(model, sort_keys=True, separators=(',', ':')).encode())
+    return digest.hexdigest()
+
+
+def response_size(response):
+    """
+    :return: approximate memory of a response in bytes, the length of its JSON
+    :rtype: int
+    """
+    return len(json.dumps(response, default=str))
+
+
+class ResultCache:
+    """
+    Least recently used cache of fit responses, keyed by request_key and bounded by the size of the responses.
+    Identical requests running at the same time share one fit (single flight): the first one fits, the others
+    wait for its response. Responses of stopped fits are neither cached nor shared, the waiting requests fit
+    themselves then. A waiting request which is stopped itself returns right away without a response. Every
+    caller gets its own copy of the response, cached and shared copies have "cached": True. The cache is only
+    used from the event loop.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        # key: future of the running fit
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    async def get(self, key, fit, stopped=None):
+        """
+        Get the response of a request from the cache, from an identical running fit or by fitting.
+        :param key: see request_key
+        :param fit: coroutine function without arguments returning the response and whether it is final, False
+                    for stopped fits
+        :param stopped: optional asyncio.Event set when the request is stopped, which ends the wait for an
+                        identical running fit
+        :return: the response, None if the request was stopped while it waited for an identical fit
+        :rtype: dict | None
+        """
+        while True:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return cached_copy(entry[0])
+
+            future = self.in_flight.get(key)
+            if future is None:
+                return await self._fit(key, fit)
+            if not await wait_unless_stopped(future, stopped):
+                return None
+            if future.cancelled():
+                # the request it waited for was cancelled, it fits itself
+                continue
+            response, final = future.result()
+            if final:
+                self.shared += 1
+                return cached_copy(response)
+
+    async def _fit(self, key, fit):
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            response, final = await fit()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # the exception is raised here, the waiting requests may not retrieve it
+            future.exception()
+            raise
+        finally:
+            del self.in_flight[key]
+        if final:
+            stored = deepcopy(response)
+            self._put(key, stored)
+            future.set_result((stored, True))
+        else:
+            future.set_result((None, False))
+        return response
+
+    def _put(self, key, response):
+        size = response_size(response)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (response, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, removed_size) = self.entries.popitem(last=False)
+            self.nbytes -= removed_size
+
+    def stats(self):
+        """
+        :return: number and memory of the cached responses, hits, misses and shared fits
+        :rtype: dict
+        """
+        return {'size': len(self.entries), 'bytes': self.nbytes, 'max_bytes': self.max_bytes, 'hits': self.hits,
+                'misses': self.misses, 'shared': self.shared}
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+
+async def wait_unless_stopped(future, stopped=None):
+    """
+    Wait until the future is done or the stopped event is set, without cancelling the future.
+    :return: True if the future is done
+    :rtype: bool
+    """
+    if stopped is None:
+        await asyncio.wait([future])
+        return True
+    if stopped.is_set():
+        return future.done()
+    stop_task = asyncio.ensure_future(stopped.wait())
+    try:
+        await asyncio.wait([future, stop_task], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stop_task.cancel()
+    return future.done()
+
+
+def cached_copy(response):
+    response = deepcopy(response)
+    response['cached'] = True
+    return response
+
+
+# cache shared by all sessions of the server process
+result_cache = ResultCache()
+metrics.gauge('peak_prophet_result_cache_bytes', lambda: result_cache.nbytes)
+metrics.gauge('peak_prophet_result_cache_hits', lambda: result_cache.hits)
+metrics.gauge('peak_prophet_result_cache_shared', lambda: result_cache.shared)
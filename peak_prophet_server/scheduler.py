@@ -0,0 +1,198 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+
+from .metrics import metrics
+
+# maximum number of fits running at the same time over all sessions
+MAX_RUNNING_FITS = int(os.getenv("PEAK_PROPHET_MAX_FITS", os.cpu_count() or 1))
+# maximum number of queued fits over all sessions, further fits are rejected
+MAX_QUEUED_FITS = int(os.getenv("PEAK_PROPHET_MAX_QUEUE", 100))
+# maximum number of running fits of one session
+SESSION_JOBS = int(os.getenv("PEAK_PROPHET_SESSION_JOBS", 4))
+# maximum number of queued fits of one session
+SESSION_QUEUE = int(os.getenv("PEAK_PROPHET_SESSION_QUEUE", 32))
+# weight of the last fit in the moving average of the fit durations
+DURATION_SMOOTHING = 0.2
+
+
+class ServerBusy(ValueError):
+    """
+    Raised when a fit is rejected because the queue is full.
+    """
+
+
+class Ticket:
+    """
+    Place of one fit in the scheduler, either queued, running or released.
+    """
+
+    def __init__(self, scheduler, session):
+        self.scheduler = scheduler
+        self.session = session
+        self.future = asyncio.get_running_loop().create_future()
+        self.reserve_time = time.perf_counter()
+        self.start_time = None
+        self.released = False
+
+    @property
+    def started(self):
+        return self.start_time is not None
+
+    @property
+    def position(self):
+        """
+        Number of queued fits which start before this one, None if the fit is not queued.
+        """
+        return self.scheduler.position(self)
+
+    @property
+    def estimated_wait(self):
+        """
+        Estimated time in seconds until the fit starts, None if unknown.
+        """
+        return self.scheduler.estimated_wait(self)
+
+
+class FitScheduler:
+    """
+    Admission control and fair queueing of the fits of all sessions. At most max_running fits run at the same
+    time, at most session_running of them of one session. Each session has its own queue and the sessions are
+    served round-robin, so that a session with many queued fits does not delay the fits of other sessions by
+    more than one fit each. Fits which would exceed the total or per session queue depth are rejected right
+    away with ServerBusy.
+    """
+
+    def __init__(self, max_running=MAX_RUNNING_FITS, max_queued=MAX_QUEUED_FITS, session_running=SESSION_JOBS,
+                 session_queued=SESSION_QUEUE):
+        if max_running < 1 or session_running < 1:
+            raise ValueError("The number of running fits has to be positive")
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.session_running = session_running
+        self.session_queued = session_queued
+        # queues of the sessions in round-robin order, the last served session is moved to the end
+        self._queues = OrderedDict()
+        self._running = {}
+        self.n_running = 0
+        self.n_queued = 0
+        self.n_rejected = 0
+        # moving average of the fit durations in seconds
+        self.average_duration = None
+
+    def reserve(self, session):
+        """
+        Queue a fit, it is started right away if a worker is free.
+        :param session: key of the session, e.g. its sid
+        :rtype: Ticket
+        :raises ServerBusy: if the queue is full
+        """
+        queue = self._queues.get(session)
+        if self.n_queued >= self.max_queued or (queue is not None and len(queue) >= self.session_queued):
+            self.n_rejected += 1
+            raise ServerBusy(f"Server busy: {self.n_running} fits running and {self.n_queued} queued")
+        ticket = Ticket(self, session)
+        if queue is None:
+            queue = self._queues[session] = deque()
+        queue.append(ticket)
+        self.n_queued += 1
+        self._dispatch()
+        return ticket
+
+    async def acquire(self, ticket):
+        """
+        Wait until the fit can start. If the waiting task is cancelled, the ticket is cancelled as well.
+        """
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            self.cancel(ticket)
+            raise
+
+    def release(self, ticket):
+        """
+        Free the worker of a finished fit and start the next queued fit.
+        """
+        if not ticket.started or ticket.released:
+            return
+        ticket.released = True
+        duration = time.perf_counter() - ticket.start_time
+        if self.average_duration is None:
+            self.average_duration = duration
+        else:
+            self.average_duration += DURATION_SMOOTHING * (duration - self.average_duration)
+        self.n_running -= 1
+        self._running[ticket.session] -= 1
+        if self._running[ticket.session] == 0:
+            del self._running[ticket.session]
+        self._dispatch()
+
+    def cancel(self, ticket):
+        """
+        Remove a queued fit from its queue or release a running one.
+        """
+        if ticket.started:
+            self.release(ticket)
+            return
+        queue = self._queues.get(ticket.session)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        self.n_queued -= 1
+        if not queue:
+            del self._queues[ticket.session]
+        if not ticket.future.done():
+            ticket.future.cancel()
+
+    def _dispatch(self):
+        while self.n_running < self.max_running:
+            session = next((session for session in self._queues
+                            if self._running.get(session, 0) < self.session_running), None)
+            if session is None:
+                return
+            queue = self._queues[session]
+            ticket = queue.popleft()
+            self.n_queued -= 1
+            if queue:
+                self._queues.move_to_end(session)
+            else:
+                del self._queues[session]
+            self.n_running += 1
+            self._running[session] = self._running.get(session, 0) + 1
+            ticket.start_time = time.perf_counter()
+            ticket.future.set_result(None)
+            metrics.observe("peak_prophet_queue_wait_seconds", ticket.start_time - ticket.reserve_time)
+
+    def position(self, ticket):
+        """
+        Number of queued fits which start before the ticket, assuming that all sessions can start fits.
+        """
+        queue = self._queues.get(ticket.session)
+        if queue is None or ticket not in queue:
+            return None
+        index = queue.index(ticket)
+        position = index
+        before = True
+        for session, other in self._queues.items():
+            if session == ticket.session:
+                before = False
+                continue
+            position += min(len(other), index + 1 if before else index)
+        return position
+
+    def estimated_wait(self, ticket):
+        """
+        Estimated time until the fit starts from the average fit duration, None if no fit has finished yet.
+        """
+        position = self.position(ticket)
+        if position is None:
+            return 0.0 if ticket.started else None
+        if self.average_duration is None:
+            return None
+        return (position // self.max_running + 1) * self.average_duration
+
+    def stats(self):
+        return {"running": self.n_running, "queued": self.n_queued, "rejected": self.n_rejected,
+                "max_running": self.max_running, "max_queued": self.max_queued,
+                "average_duration": self.average_duration}
@@ -0,0 +1,253 @@
+import math
+
+import numpy as np
+
+from peak_prophet_server.data_reader import read_request
+from peak_prophet_server.solvers import METHODS, DEFAULT_METHOD, TOLERANCES, DEFAULT_TOLERANCES
+
+PEAK_PARAMETERS = {
+    'gaussian': ('amplitude', 'center', 'fwhm'),
+    'lorentzian': ('amplitude', 'center', 'fwhm'),
+    'pseudovoigt': ('amplitude', 'center', 'fwhm'),
+}
+# parameters which keep the default of the model if they are missing
+OPTIONAL_PEAK_PARAMETERS = {'pseudovoigt': ('fraction',)}
+BACKGROUND_PARAMETERS = {
+    'linear': ('intercept', 'slope'),
+    'quadratic': ('a', 'b', 'c'),
+}
+# maximum degree of a polynomial background (lmfit PolynomialModel)
+MAX_DEGREE = 7
+ENGINES = ('flat', 'lmfit')
+
+
+class SchemaError(ValueError):
+    """
+    Raised for a fit request which does not match the schema, the message starts with the path of the invalid
+    value, e.g. "peaks[2].parameters[0].value: expected a finite number, got 'a'".
+    """
+
+    def __init__(self, path, message):
+        super().__init__(f'{path}: {message}' if path else message)
+        self.path = path
+
+
+def decode_request(request, series=False):
+    """
+    Read a fit request (see read_request) and check it against the schema of the input dictionary before
+    anything is built from it. The pattern data is converted to float64 arrays, the parameters get the
+    default vary (True), min and max (None) if they are missing.
+    :param request: JSON string or dictionary with binary attachments
+    :param series: True for a series request with 'patterns' instead of 'pattern'
+    :return: the checked input dictionary
+    :rtype: dict
+    :raises SchemaError: if the request does not match the schema
+    """
+    data_dict = read_request(request)
+    if not isinstance(data_dict, dict):
+        raise SchemaError('', f'expected a request object, got {type_name(data_dict)}')
+    decoded = dict(data_dict)
+    if series:
+        patterns = require(data_dict, 'patterns', '', list)
+        if not patterns:
+            raise SchemaError('patterns', 'expected at least one pattern')
+        decoded['patterns'] = [decode_pattern(pattern_dict, f'patterns[{i}]') for i, pattern_dict in
+                               enumerate(patterns)]
+    else:
+        decoded['pattern'] = decode_pattern(require(data_dict, 'pattern', '', dict), 'pattern')
+    decoded['background'] = decode_background(require(data_dict, 'background', '', dict), 'background')
+    peaks = require(data_dict, 'peaks', '', list)
+    decoded['peaks'] = [decode_peak(peak_dict, f'peaks[{i}]') for i, peak_dict in enumerate(peaks)]
+
+    if data_dict.get('engine') is not None and data_dict['engine'] not in ENGINES:
+        raise SchemaError('engine', f'expected one of {", ".join(ENGINES)}, got {data_dict["engine"]!r}')
+    if 'chunks' in data_dict:
+        chunks = data_dict['chunks']
+        if not is_integer(chunks) or chunks < 1:
+            raise SchemaError('chunks', f'expected a positive integer, got {chunks!r}')
+    if 'profile' in data_dict and not isinstance(data_dict['profile'], bool):
+        raise SchemaError('profile', f'expected a boolean, got {type_name(data_dict["profile"])}')
+    if data_dict.get('solver') is not None:
+        decode_solver(data_dict['solver'], 'solver')
+    for key in ('warm_start', 'regions', 'multiresolution'):
+        if data_dict.get(key) is not None and not isinstance(data_dict[key], (bool, dict)):
+            raise SchemaError(key, f'expected a boolean or an object, got {type_name(data_dict[key])}')
+    if all(data_dict.get(key) not in (None, False) for key in ('regions', 'multiresolution')):
+        raise SchemaError('multiresolution', 'cannot be combined with "regions"')
+    return decoded
+
+
+def decode_solver(solver, path):
+    if isinstance(solver, str):
+        solver = {'method': solver}
+        method_path = path
+    elif isinstance(solver, dict):
+        method_path = f'{path}.method'
+    else:
+        raise SchemaError(path, f'expected a method name or an object, got {type_name(solver)}')
+    if solver.get('method', DEFAULT_METHOD) not in METHODS:
+        raise SchemaError(method_path, f'expected one of {", ".join(METHODS)}, got {solver["method"]!r}')
+    for name in TOLERANCES:
+        if name in solver and not (is_number(solver[name]) and 0 <= solver[name] < 1):
+            raise SchemaError(f'{path}.{name}', f'expected a number from 0 to 1, got {solver[name]!r}')
+    method = solver.get('method', DEFAULT_METHOD)
+    tolerances = {**DEFAULT_TOLERANCES[method], **{name: solver[name] for name in TOLERANCES if name in solver}}
+    # scipy's least_squares refuses to start otherwise
+    if method == 'least_squares' and all(value < np.finfo(float).eps for value in tolerances.values()):
+        raise SchemaError(path, f'expected at least one of {", ".join(TOLERANCES)} above the machine epsilon for '
+                                f'least_squares, got {tolerances}')
+    max_nfev = solver.get('max_nfev')
+    if max_nfev is not None and (not is_integer(max_nfev) or max_nfev < 1):
+        raise SchemaError(f'{path}.max_nfev', f'expected a positive integer, got {max_nfev!r}')
+    x_scale = solver.get('x_scale', 'jac')
+    if x_scale != 'jac' and not (is_number(x_scale) and math.isfinite(x_scale) and x_scale > 0):
+        raise SchemaError(f'{path}.x_scale', f'expected "jac" or a positive number, got {x_scale!r}')
+
+
+def decode_pattern(pattern_dict, path):
+    if not isinstance(pattern_dict, dict):
+        raise SchemaError(path, f'expected an object, got {type_name(pattern_dict)}')
+    if 'id' in pattern_dict:
+        if not isinstance(pattern_dict['id'], str):
+            raise SchemaError(f'{path}.id', f'expected a string, got {type_name(pattern_dict["id"])}')
+        return pattern_dict
+    decoded = dict(pattern_dict)
+    for key in ('x', 'y', 'weights'):
+        if key in pattern_dict and (key != 'weights' or pattern_dict[key] is not None):
+            decoded[key] = decode_array(pattern_dict[key], f'{path}.{key}')
+        elif key != 'weights':
+            raise SchemaError(path, f'missing "{key}"')
+    for key in ('y', 'weights'):
+        if decoded.get(key) is not None and len(decoded[key]) != len(decoded['x']):
+            raise SchemaError(f'{path}.{key}', f'expected {len(decoded["x"])} values like x, got {len(decoded[key])}')
+    return decoded
+
+
+def decode_array(values, path):
+    """
+    :return: the values as float64 array, without copying float64 arrays
+    :rtype: np.ndarray
+    """
+    if isinstance(values, np.ndarray):
+        array = values
+    elif isinstance(values, list):
+        try:
+            array = np.array(values)
+        except ValueError:
+            raise SchemaError(path, 'expected a flat array of numbers')
+        if array.dtype.kind not in 'iuf' and len(values) > 0:
+            bad = next((value for value in values if not is_number(value)), None)
+            raise SchemaError(path, f'expected numbers, got {bad!r}')
+    else:
+        raise SchemaError(path, f'expected an array of numbers, got {type_name(values)}')
+    if array.ndim != 1:
+        raise SchemaError(path, 'expected a flat array of numbers')
+    if array.dtype != np.float64:
+        array = array.astype(np.float64)
+    return array
+
+
+def decode_background(background_dict, path):
+    background_type = require(background_dict, 'type', path, str)
+    decoded = dict(background_dict)
+    if background_type == 'polynomial':
+        degree = require(background_dict, 'degree', path)
+        if not is_integer(degree) or not 0 <= degree <= MAX_DEGREE:
+            raise SchemaError(f'{path}.degree', f'expected an integer from 0 to {MAX_DEGREE}, got {degree!r}')
+        names = tuple(f'c{i}' for i in range(degree + 1))
+    elif background_type in BACKGROUND_PARAMETERS:
+        names = BACKGROUND_PARAMETERS[background_type]
+    else:
+        raise SchemaError(f'{path}.type', f'unknown background type {background_type!r}')
+    decoded['parameters'] = decode_parameters(require(background_dict, 'parameters', path, list), names,
+                                              f'{path}.parameters')
+    return decoded
+
+
+def decode_peak(peak_dict, path):
+    if not isinstance(peak_dict, dict):
+        raise SchemaError(path, f'expected an object, got {type_name(peak_dict)}')
+    peak_type = require(peak_dict, 'type', path, str)
+    names = PEAK_PARAMETERS.get(peak_type.lower())
+    if names is None:
+        raise SchemaError(f'{path}.type', f'unknown peak type {peak_type!r}')
+    decoded = dict(peak_dict)
+    decoded['parameters'] = decode_parameters(require(peak_dict, 'parameters', path, list), names,
+                                              f'{path}.parameters', OPTIONAL_PEAK_PARAMETERS.get(peak_type.lower(), ()))
+    return decoded
+
+
+def decode_parameters(parameters, names, path, optional=()):
+    """
+    Check that there is exactly one parameter for each of the names and at most one for the optional names.
+    """
+    decoded = []
+    for i, parameter in enumerate(parameters):
+        decoded.append(decode_parameter(parameter, f'{path}[{i}]'))
+    found = [parameter['name'] for parameter in decoded]
+    unknown = [name for name in found if name not in names and name not in optional]
+    if unknown:
+        raise SchemaError(path, f'unknown parameter {unknown[0]!r}, expected {", ".join(names + optional)}')
+    duplicates = [name for name in names + optional if found.count(name) > 1]
+    if duplicates:
+        raise SchemaError(path, f'duplicate parameter {duplicates[0]!r}')
+    missing = [name for name in names if name not in found]
+    if missing:
+        raise SchemaError(path, f'missing parameter {missing[0]!r}')
+    return decoded
+
+
+def decode_parameter(parameter, path):
+    if not isinstance(parameter, dict):
+        raise SchemaError(path, f'expected an object, got {type_name(parameter)}')
+    name = require(parameter, 'name', path, str)
+    value = require(parameter, 'value', path)
+    if not is_number(value) or not math.isfinite(value):
+        raise SchemaError(f'{path}.value', f'expected a finite number, got {value!r}')
+    vary = parameter.get('vary', True)
+    if not isinstance(vary, bool):
+        raise SchemaError(f'{path}.vary', f'expected a boolean, got {vary!r}')
+    bounds = []
+    for key in ('min', 'max'):
+        bound = parameter.get(key)
+        if bound is not None and not is_number(bound):
+            raise SchemaError(f'{path}.{key}', f'expected a number or null, got {bound!r}')
+        bounds.append(bound)
+    if bounds[0] is not None and bounds[1] is not None and bounds[0] > bounds[1]:
+        raise SchemaError(path, f'min {bounds[0]} is larger than max {bounds[1]}')
+    return {**parameter, 'name': name, 'value': value, 'vary': vary, 'min': bounds[0], 'max': bounds[1]}
+
+
+def require(dictionary, key, path, expected_type=None):
+    if key not in dictionary:
+        raise SchemaError(path, f'missing "{key}"')
+    value = dictionary[key]
+    if expected_type is not None and not isinstance(value, expected_type):
+        expected = {dict: 'an object', list: 'an array', str: 'a string'}[expected_type]
+        raise SchemaError(f'{path}.{key}' if path else key, f'expected {expected}, got {type_name(value)}')
+    return value
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def type_name(value):
+    match value:
+        case None:
+            return 'null'
+        case bool():
+            return 'a boolean'
+        case int() | float():
+            return 'a number'
+        case str():
+            return 'a string'
+        case list():
+            return 'an array'
+        case dict():
+            return 'an object'
+    return type(value).__name__
@@ -1,36 +1,330 @@
-from peak_prophet_server.fitting import FitManager
+import asyncio
+import logging
+
+from peak_prophet_server.jobs import JobManager, DONE, scheduler
+from peak_prophet_server.pattern_store import PatternStore, shared_store
+from peak_prophet_server.profiling import profile_store
+from peak_prophet_server.progress import ProgressPublisher, ProgressEncoder, DEFAULT_MAX_RATE, DEFAULT_WIDTH
+from peak_prophet_server.scheduler import ServerBusy
+
+logger = logging.getLogger(__name__)
+
+# lmfit, scipy and the fitting modules are imported where they are used, not at the start of the server, they
+# are imported in the background by the warm-up, see warmup.py
+
+
+def error_response(error):
+    """
+    :param error: ValueError of invalid event data, KeyError of a missing key or TypeError of data which is not an
+                  object
+    :return: {'error'} with the message
+    """
+    if isinstance(error, KeyError):
+        return {'error': f'missing "{error.args[0]}"'}
+    return {'error': str(error)}
 
 
 def connect_events(sio):
     @sio.on('connect')
     async def connect(sid, _):
-        print(sid, 'connected!')
-        await sio.save_session(sid, {'fit_manager': FitManager(sid)})
+        logger.info('connected', extra={'sid': sid})
+        pattern_store = PatternStore(shared=shared_store)
+        await sio.save_session(sid, {'jobs': JobManager(sid, pattern_store)})
         return sid
 
     @sio.on('fit')
     async def fit(sid, data):
-        print(sid, 'fitting')
+        """
+        Fit and return the response when the fit is finished, the response has the 'job_id' of the fit.
+        If the server is too busy to queue the fit, {'error', 'busy': True} is returned right away.
+        """
+        logger.info('fit requested', extra={'sid': sid})
+        session = await sio.get_session(sid)
+        jobs = session['jobs']
+        try:
+            job = jobs.submit(data)
+        except ServerBusy as e:
+            return {'error': str(e), 'busy': True}
+        try:
+            response = await jobs.wait(job)
+        except ValueError as e:
+            return {'error': str(e), 'job_id': job.id}
+        if response is None:
+            return {'success': False, 'message': 'The fit was cancelled before it started', 'job_id': job.id}
+        return response
+
+    @sio.on('submit_fit')
+    async def submit_fit(sid, data):
+        """
+        Start a fit without waiting for it, the response is sent with a 'fit_result' event
+        {'job_id', 'state', 'response' or 'error'} when the fit is finished.
+        :return: {'job_id', 'state'} and for queued fits the 'position' in the queue and the 'estimated_wait'
+                 in seconds, {'error', 'busy': True} if the server is too busy to queue the fit
+        """
+        session = await sio.get_session(sid)
+        jobs = session['jobs']
+        try:
+            job = jobs.submit(data)
+        except ServerBusy as e:
+            return {'error': str(e), 'busy': True}
+
+        async def send_result():
+            try:
+                response = await jobs.wait(job)
+            except ValueError:
+                response = None
+            result = job.status()
+            result['response'] = response
+            await sio.emit('fit_result', result, to=sid)
+
+        asyncio.create_task(send_result())
+        return job.status()
+
+    @sio.on('fit_series')
+    async def fit_series(sid, data):
+        """
+        Fit a series of patterns with one model, see FitManager.process_series. The result of every pattern
+        is sent with a 'series_result' event as soon as it is finished.
+        """
+        logger.info('series fit requested', extra={'sid': sid})
+        session = await sio.get_session(sid)
+        jobs = session['jobs']
+
+        async def send_result(response):
+            await sio.emit('series_result', response, to=sid)
+
+        try:
+            job = jobs.submit(data, 'series', send_result)
+        except ServerBusy as e:
+            return {'error': str(e), 'busy': True}
+        try:
+            responses = await jobs.wait(job) or []
+        except ValueError as e:
+            return {'error': str(e), 'job_id': job.id}
+        return {
+            'success': job.state == DONE and all(response is not None and response['success']
+                                                   for response in responses),
+            'n_patterns': len(responses),
+            'nfev': sum(response['nfev'] for response in responses if response is not None),
+            'job_id': job.id,
+        }
+
+    @sio.on('cancel_job')
+    async def cancel_job(sid, job_id):
+        """
+        Cancel a fit, also one started by another connection or server process.
+        :return: {'job_id', 'state'} or {'error'}
+        """
+        session = await sio.get_session(sid)
+        try:
+            return await session['jobs'].command(job_id, 'cancel')
+        except ValueError as e:
+            return {'error': str(e)}
+
+    @sio.on('job_status')
+    async def job_status(sid, job_id=None):
+        """
+        :return: {'job_id', 'kind', 'state', for queued jobs 'position' and 'estimated_wait'} of one job or a
+                 list of them for all jobs of the session
+        """
+        session = await sio.get_session(sid)
+        if job_id is None:
+            return session['jobs'].status()
+        try:
+            return await session['jobs'].command(job_id, 'status')
+        except ValueError as e:
+            return {'error': str(e)}
+
+    @sio.on('upload_pattern')
+    async def upload_pattern(sid, data):
+        """
+        Upload a pattern once, fit requests can then use {'pattern': {'id': pattern_id}}.
+        data: {'x', 'y', optional 'weights' as lists or binary, 'dtype' of binary data, 'shared': make the
+        pattern available to all sessions}
+        """
+        from peak_prophet_server.data_reader import read_pattern
+
+        session = await sio.get_session(sid)
+        try:
+            pattern = read_pattern(data)
+            return {'pattern_id': session['jobs'].pattern_store.add(pattern, data.get('shared', False))}
+        except ValueError as e:
+            return {'error': str(e)}
+
+    @sio.on('begin_pattern_upload')
+    async def begin_pattern_upload(sid, data):
+        """
+        Start a chunked pattern upload.
+        data: {'n_points', 'dtype' of the chunks, 'weights': True if weights are uploaded, 'shared'}
+        """
+        session = await sio.get_session(sid)
+        try:
+            upload_id = session['jobs'].pattern_store.begin_upload(
+                data['n_points'], data.get('dtype', 'float64'), data.get('weights', False), data.get('shared', False))
+            return {'upload_id': upload_id}
+        except (KeyError, TypeError, ValueError) as e:
+            return error_response(e)
+
+    @sio.on('upload_pattern_chunk')
+    async def upload_pattern_chunk(sid, data):
+        """
+        data: {'upload_id', 'offset' (in points), binary 'x', 'y' and 'weights' of the chunk}
+        """
+        session = await sio.get_session(sid)
+        try:
+            received = session['jobs'].pattern_store.upload_chunk(
+                data['upload_id'], data['offset'], data['x'], data['y'], data.get('weights'))
+            return {'received': received}
+        except (KeyError, TypeError, ValueError) as e:
+            return error_response(e)
+
+    @sio.on('finish_pattern_upload')
+    async def finish_pattern_upload(sid, data):
+        """
+        data: {'upload_id', optional 'hash' to check the uploaded data against}
+        """
+        session = await sio.get_session(sid)
+        try:
+            pattern_id = session['jobs'].pattern_store.finish_upload(data['upload_id'], data.get('hash'))
+            return {'pattern_id': pattern_id}
+        except (KeyError, TypeError, ValueError) as e:
+            return error_response(e)
+
+    @sio.on('detect_peaks')
+    async def detect(sid, data):
+        """
+        Estimate the background and find the peaks of a pattern, the result can be used as 'background' and
+        'peaks' of a fit request.
+        data: {'pattern' as in a fit request (data, binary data or id), optional 'peak_type', 'background_type',
+        'degree', 'min_snr', 'min_prominence', 'min_fwhm', 'max_peaks'}
+        """
+        from peak_prophet_server.data_reader import read_pattern
+        from peak_prophet_server.peak_detection import detect_peaks, DEFAULT_MIN_SNR
+
         session = await sio.get_session(sid)
-        fit_manager = session['fit_manager']
-        result = await fit_manager.process_request(data)
-        return result
+        try:
+            pattern = read_pattern(data['pattern'], session['jobs'].pattern_store)
+            background, peaks = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: detect_peaks(pattern, data.get('peak_type', 'gaussian'),
+                                           data.get('background_type', 'linear'), data.get('degree'),
+                                           data.get('min_snr', DEFAULT_MIN_SNR), data.get('min_prominence'),
+                                           data.get('min_fwhm'), data.get('max_peaks')))
+        except (KeyError, TypeError, ValueError) as e:
+            return error_response(e)
+        return {'background': background, 'peaks': peaks}
+
+    @sio.on('has_pattern')
+    async def has_pattern(sid, pattern_id):
+        session = await sio.get_session(sid)
+        return pattern_id in session['jobs'].pattern_store
+
+    @sio.on('scheduler_status')
+    async def scheduler_status(sid):
+        """
+        :return: number of running, queued and rejected fits of the server, see FitScheduler.stats
+        """
+        return scheduler.stats()
 
     @sio.on('stop')
     async def stop(sid):
-        print(sid, 'stopping')
+        """
+        Cancel all fits of the session.
+        """
+        logger.info('stop requested', extra={'sid': sid})
+        session = await sio.get_session(sid)
+        session['jobs'].cancel_all()
+
+    @sio.on('set_profiling')
+    async def set_profiling(sid, enabled=True):
+        """
+        Profile all following fits of the session, see profiling. The response of a profiled fit has the
+        summary of its profile under 'profile'.
+        """
         session = await sio.get_session(sid)
-        fit_manager = session['fit_manager']
-        fit_manager.stop = True
+        session['jobs'].profiling = bool(enabled)
+
+    @sio.on('get_profile')
+    async def get_profile(sid, job_id):
+        """
+        :return: the summary of the profile of a profiled job of the session, also if it ran in another server
+                 process
+        """
+        try:
+            return profile_store.load(job_id, sid)
+        except ValueError as e:
+            return {'error': str(e)}
 
     @sio.on('request_progress')
-    async def get_progress(sid):
+    async def get_progress(sid, job_id=None, options=None):
+        """
+        :return: the progress of a job, of the latest job of the session by default
+        options: {'compact': True for the compact progress of a job of the session (see ProgressEncoder),
+                  'width': bins of the residual envelope, 'resid': 'envelope' or 'float32',
+                  'ack': seq of the last compact progress received}
+        """
+        options = options or {}
+        async with sio.session(sid) as session:
+            try:
+                if options.get('compact'):
+                    encoder = session.get('progress_encoder')
+                    if encoder is None:
+                        encoder = session['progress_encoder'] = ProgressEncoder()
+                    encoder.configure(options.get('width'), options.get('resid'))
+                    if options.get('ack') is not None:
+                        encoder.acknowledge(options['ack'])
+                    return session['jobs'].compact_progress(encoder, job_id)
+                if job_id is None:
+                    return session['jobs'].get().fit_manager.current_progress
+                return await session['jobs'].command(job_id, 'progress')
+            except ValueError:
+                return None
+
+    @sio.on('subscribe_progress')
+    async def subscribe_progress(sid, options=None):
+        """
+        Let the server push 'progress' events instead of polling with 'request_progress'.
+        options: {'max_rate': maximum events per second, 'ack': wait for the client's acknowledgement,
+                  'compact': send the compact progress (see ProgressEncoder), 'width': bins of the residual
+                  envelope, 'resid': 'envelope' or 'float32'}
+        Without 'ack' the compact progress is acknowledged with 'ack_progress'.
+        """
+        options = options or {}
+        async with sio.session(sid) as session:
+            if session.get('progress_publisher') is not None:
+                await session['progress_publisher'].stop()
+            encoder = None
+            if options.get('compact'):
+                try:
+                    encoder = ProgressEncoder(options.get('width', DEFAULT_WIDTH), options.get('resid', 'envelope'))
+                except ValueError as e:
+                    return {'error': str(e)}
+            publisher = ProgressPublisher(sio, sid, session['jobs'],
+                                          max_rate=options.get('max_rate', DEFAULT_MAX_RATE),
+                                          ack=options.get('ack', False), encoder=encoder)
+            publisher.start()
+            session['progress_publisher'] = publisher
+
+    @sio.on('ack_progress')
+    async def ack_progress(sid, seq):
+        """
+        Acknowledge a compact progress event, its parameters become the base of the next deltas.
+        """
         session = await sio.get_session(sid)
-        return session['fit_manager'].current_progress
+        publisher = session.get('progress_publisher')
+        if publisher is not None and publisher.encoder is not None:
+            publisher.encoder.acknowledge(seq)
+
+    @sio.on('unsubscribe_progress')
+    async def unsubscribe_progress(sid):
+        async with sio.session(sid) as session:
+            if session.get('progress_publisher') is not None:
+                await session['progress_publisher'].stop()
+                session['progress_publisher'] = None
 
     @sio.on('disconnect')
     async def disconnect(sid):
         session = await sio.get_session(sid)
-        fit_manager = session['fit_manager']
-        fit_manager.stop = True
-        print(sid, 'disconnected!')
+        session['jobs'].close()
+        if session.get('progress_publisher') is not None:
+            await session['progress_publisher'].stop()
+        logger.info('disconnected', extra={'sid': sid})
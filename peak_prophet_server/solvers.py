@@ -0,0 +1,53 @@
+import numpy as np
+
+# lmfit methods of the fits: 'leastsq' is Levenberg-Marquardt (MINPACK), 'least_squares' is the trust region
+# reflective solver of scipy, which handles the bounds itself instead of transforming the parameters
+METHODS = ('leastsq', 'least_squares')
+DEFAULT_METHOD = 'leastsq'
+TOLERANCES = ('ftol', 'xtol', 'gtol')
+# defaults of scipy's leastsq and least_squares
+DEFAULT_TOLERANCES = {
+    'leastsq': {'ftol': 1.49012e-08, 'xtol': 1.49012e-08, 'gtol': 0.0},
+    'least_squares': {'ftol': 1e-08, 'xtol': 1e-08, 'gtol': 1e-08},
+}
+# scale the parameters by the norms of the Jacobian columns, which leastsq always does by default
+DEFAULT_X_SCALE = 'jac'
+
+
+def solver_options(option):
+    """
+    Read the 'solver' option of a fit request, either the name of the method (see METHODS) or a dictionary with
+    'method', the tolerances 'ftol', 'xtol' and 'gtol', 'max_nfev' (default: the lmfit default, 2000 times the
+    number of varying parameters plus one) and 'x_scale' ('jac' or the characteristic scale of the parameters).
+    The request schema checks the values.
+    :return: all options, with the defaults of the method for the missing ones
+    :rtype: dict
+    """
+    if option is None:
+        option = {}
+    elif isinstance(option, str):
+        option = {'method': option}
+    method = option.get('method', DEFAULT_METHOD)
+    options = {'method': method}
+    for name in TOLERANCES:
+        options[name] = option.get(name, DEFAULT_TOLERANCES[method][name])
+    options['max_nfev'] = option.get('max_nfev')
+    options['x_scale'] = option.get('x_scale', DEFAULT_X_SCALE)
+    return options
+
+
+def fit_arguments(options, params):
+    """
+    Keyword arguments of lmfit.Model.fit and MultiPeakModel.fit for the solver options. leastsq scales by the
+    Jacobian by default, a numeric x_scale is passed to it as the inverse scale factors (diag).
+    :param options: see solver_options
+    :param params: lmfit Parameters of the fit
+    :rtype: dict
+    """
+    fit_kws = {name: options[name] for name in TOLERANCES}
+    if options['method'] == 'least_squares':
+        fit_kws['x_scale'] = options['x_scale']
+    elif options['x_scale'] != 'jac':
+        n_varys = sum(1 for param in params.values() if param.vary and param.expr is None)
+        fit_kws['diag'] = np.full(n_varys, 1 / options['x_scale'])
+    return {'method': options['method'], 'fit_kws': fit_kws, 'max_nfev': options['max_nfev']}
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import os
+import tempfile
+import uuid
+
+# "memory" keeps the job state in the server process, "ipc" shares it with the other server processes on the
+# same machine, needed to run several server workers
+STATE_BACKEND = os.getenv("PEAK_PROPHET_STATE", "memory")
+# directory of the job registry and the sockets of the "ipc" state backend
+STATE_DIR = os.getenv("PEAK_PROPHET_STATE_DIR", os.path.join(tempfile.gettempdir(), "peak_prophet_state"))
+# timeout in seconds of a command sent to another server process
+CALL_TIMEOUT = 5
+
+_state_backend = None
+
+
+def get_state_backend():
+    """
+    Get the state backend of the server process, created on first use as set by PEAK_PROPHET_STATE.
+    :rtype: StateBackend
+    """
+    global _state_backend
+    if _state_backend is None:
+        _state_backend = create_state_backend(STATE_BACKEND)
+    return _state_backend
+
+
+def create_state_backend(kind, directory=STATE_DIR):
+    """
+    :param kind: "memory" or "ipc"
+    :param directory: directory of the "ipc" backend
+    :rtype: StateBackend
+    """
+    match kind:
+        case "memory":
+            return InMemoryStateBackend()
+        case "ipc":
+            return LocalIPCStateBackend(directory)
+        case _:
+            raise ValueError(f"Unknown state backend: {kind}")
+
+
+async def start_state_backend():
+    await get_state_backend().start()
+
+
+async def close_state_backend():
+    await get_state_backend().close()
+
+
+class StateBackend:
+    """
+    Job state shared by the server processes. Every job is owned by the process running it, the backend
+    knows the owner of every job id and routes the job commands ("cancel", "status", "progress") of a client
+    connected to another process to it.
+    """
+
+    def __init__(self):
+        self.process_id = uuid.uuid4().hex
+        # jobs of this process by id
+        self.jobs = {}
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def register_job(self, job):
+        self.jobs[job.id] = job
+
+    def unregister_job(self, job_id):
+        self.jobs.pop(job_id, None)
+
+    def owner(self, job_id):
+        """
+        :return: the process id of the owner of a job, None if the job is unknown
+        :rtype: str | None
+        """
+        raise NotImplementedError
+
+    async def job_command(self, job_id, command):
+        """
+        Run a job command in the process owning the job.
+        :param job_id: id of the job
+        :param command: "cancel", "status" or "progress"
+        :return: the status of the job for "cancel" and "status", the progress for "progress"
+        """
+        owner = self.owner(job_id)
+        if owner is None:
+            raise ValueError(f"Unknown job id: {job_id}")
+        if owner == self.process_id:
+            return self.handle(job_id, command)
+        return await self.remote_call(owner, job_id, command)
+
+    def handle(self, job_id, command):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise ValueError(f"Unknown job id: {job_id}")
+        match command:
+            case "cancel":
+                job.cancel()
+                return job.status()
+            case "status":
+                return job.status()
+            case "progress":
+                return job.fit_manager.current_progress
+            case _:
+                raise ValueError(f"Unknown job command: {command}")
+
+    async def remote_call(self, owner, job_id, command):
+        raise NotImplementedError
+
+
+class InMemoryStateBackend(StateBackend):
+    """
+    State of a single server process.
+    """
+
+    def owner(self, job_id):
+        return self.process_id if job_id in self.jobs else None
+
+    async def remote_call(self, owner, job_id, command):
+        raise ValueError(f"Unknown job id: {job_id}")
+
+
+class LocalIPCStateBackend(StateBackend):
+    """
+    State shared by the server processes on one machine without a broker. The owner of a job is registered
+    as a file named by the job id in the jobs directory, every process serves the commands for its jobs on a
+    Unix socket named by its process id. Commands and replies are JSON messages with a 4 byte length
+    prefix, see send_message and receive_message.
+    """
+
+    def __init__(self, directory=STATE_DIR):
+        super().__init__()
+        self.directory = directory
+        self.server = None
+        os.makedirs(os.path.join(directory, "jobs"), exist_ok=True)
+
+    def socket_path(self, process_id):
+        return os.path.join(self.directory, f"{process_id}.sock")
+
+    def job_path(self, job_id):
+        return os.path.join(self.directory, "jobs", job_id)
+
+    async def start(self):
+        if self.server is None:
+            self.server = await asyncio.start_unix_server(self._serve, path=self.socket_path(self.process_id))
+
+    async def close(self):
+        for job_id in list(self.jobs):
+            self.unregister_job(job_id)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+            try:
+                os.remove(self.socket_path(self.process_id))
+            except FileNotFoundError:
+                pass
+
+    def register_job(self, job):
+        super().register_job(job)
+        path = self.job_path(job.id)
+        with open(f"{path}.{self.process_id}", "w") as f:
+            f.write(self.process_id)
+        os.replace(f"{path}.{self.process_id}", path)
+
+    def unregister_job(self, job_id):
+        if job_id in self.jobs:
+            super().unregister_job(job_id)
+            try:
+                os.remove(self.job_path(job_id))
+            except FileNotFoundError:
+                pass
+
+    def owner(self, job_id):
+        if job_id in self.jobs:
+            return self.process_id
+        if os.path.basename(job_id) != job_id or job_id.startswith("."):
+            return None
+        try:
+            with open(self.job_path(job_id)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    async def remote_call(self, owner, job_id, command):
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.socket_path(owner)), CALL_TIMEOUT
+            )
+        except (FileNotFoundError, ConnectionRefusedError, asyncio.TimeoutError):
+            raise ValueError(f"The server process of job {job_id} is not available")
+        try:
+            await send_message(writer, {"job_id": job_id, "command": command})
+            reply = await asyncio.wait_for(receive_message(reader), CALL_TIMEOUT)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            raise ValueError(f"The server process of job {job_id} closed the connection")
+        except asyncio.TimeoutError:
+            raise ValueError(f"The server process of job {job_id} did not answer within {CALL_TIMEOUT} s")
+        finally:
+            writer.close()
+            await writer.wait_closed()
+        if "error" in reply:
+            raise ValueError(reply["error"])
+        return reply["result"]
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request = await receive_message(reader)
+                try:
+                    reply = {"result": self.handle(request["job_id"], request["command"])}
+                except ValueError as e:
+                    reply = {"error": str(e)}
+                await send_message(writer, reply)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def send_message(writer, message):
+    data = json.dumps(message).encode()
+    writer.write(len(data).to_bytes(4, "little") + data)
+    await writer.drain()
+
+
+async def receive_message(reader):
+    """
+    :raises asyncio.IncompleteReadError: if the connection is closed
+    """
+    size = int.from_bytes(await reader.readexactly(4), "little")
+    return json.loads(await reader.readexactly(size))
@@ -0,0 +1,128 @@
+import numpy as np
+
+# half width of the region around changed peaks, in units of the mean fwhm of two peaks, outside of which
+# unchanged peaks are fixed during the local pass
+DEFAULT_RADIUS = 5
+# relative tolerance for a parameter value sent by the client to count as the previous result value
+RESULT_TOLERANCE = 1e-6
+
+
+def warm_start_options(option):
+    """
+    Read the 'warm_start' option of a fit request, either a bool or a dictionary with 'local_pass' (fix far
+    away peaks in a first local pass, default False) and 'radius' (see DEFAULT_RADIUS).
+    :return: the options or None if warm start is not requested
+    :rtype: dict | None
+    """
+    if not option:
+        return None
+    if option is True:
+        option = {}
+    radius = option.get('radius', DEFAULT_RADIUS)
+    if radius <= 0:
+        raise ValueError('The warm start radius has to be positive')
+    return {'local_pass': option.get('local_pass', False), 'radius': radius}
+
+
+def model_dict(data_dict):
+    """
+    Copy of the input dictionary without the pattern, the background and peaks can be modified without
+    changing the input.
+    :rtype: dict
+    """
+    copied = {key: value for key, value in data_dict.items() if key not in ('pattern', 'background', 'peaks')}
+    background = data_dict['background']
+    copied['background'] = {**background, 'parameters': [dict(p) for p in background['parameters']]}
+    copied['peaks'] = [{**peak, 'parameters': [dict(p) for p in peak['parameters']]} for peak in data_dict['peaks']]
+    return copied
+
+
+def seed_parameters(data_dict, previous_dict, previous_result):
+    """
+    Start the parameters, which did not change since the previous fit, from the previous result. A parameter
+    did not change if it equals the one of the previous request, or if the client sent back the previous
+    result value with the same vary flag and bounds. Peaks are matched by their position in the list.
+    :param data_dict: the input dictionary, see model_dict, its values are replaced
+    :param previous_dict: the input dictionary of the previous fit
+    :param previous_result: the 'result' of the previous fit response
+    :return: number of seeded parameters, indices of the peaks with changed parameters or type
+    :rtype: (int, list[int])
+    """
+    seeded = 0
+    background = data_dict['background']
+    previous_background = previous_dict['background']
+    if background['type'] == previous_background['type'] and background.get('degree') == \
+            previous_background.get('degree'):
+        seeded += _seed(background['parameters'], previous_background['parameters'],
+                        previous_result['background']['parameters'])
+
+    changed_peaks = []
+    for i, peak in enumerate(data_dict['peaks']):
+        if i >= len(previous_dict['peaks']) or peak['type'] != previous_dict['peaks'][i]['type']:
+            changed_peaks.append(i)
+            continue
+        previous_parameters = previous_dict['peaks'][i]['parameters']
+        n_seeded = _seed(peak['parameters'], previous_parameters, previous_result['peaks'][i]['parameters'])
+        seeded += n_seeded
+        if n_seeded < len(peak['parameters']):
+            changed_peaks.append(i)
+    return seeded, changed_peaks
+
+
+def _seed(parameters, previous_parameters, previous_output):
+    previous = {p['name']: p for p in previous_parameters}
+    result_values = {p['name']: p['value'] for p in previous_output}
+    seeded = 0
+    for parameter in parameters:
+        name = parameter['name']
+        if name not in previous or result_values.get(name) is None:
+            continue
+        same_settings = all(parameter.get(key) == previous[name].get(key) for key in ('vary', 'min', 'max'))
+        if parameter == previous[name] or (
+                same_settings and np.isclose(parameter['value'], result_values[name], rtol=RESULT_TOLERANCE)):
+            parameter['value'] = result_values[name]
+            seeded += 1
+    return seeded
+
+
+def fix_distant_peaks(data_dict, changed_peaks, radius=DEFAULT_RADIUS):
+    """
+    Copy of the input dictionary in which the peaks far away from all changed peaks are fixed. A peak is far
+    away from a changed one if their centers are more than radius times their mean fwhm apart.
+    :param data_dict: the input dictionary
+    :param changed_peaks: indices of the changed peaks
+    :param radius: see DEFAULT_RADIUS
+    :return: the input dictionary for the local pass, number of fixed peaks
+    :rtype: (dict, int)
+    """
+    local_dict = model_dict(data_dict)
+    changed = [_center_and_fwhm(data_dict['peaks'][i]) for i in changed_peaks]
+    fixed = 0
+    for i, peak in enumerate(local_dict['peaks']):
+        if i in changed_peaks:
+            continue
+        center, fwhm = _center_and_fwhm(peak)
+        if all(abs(center - other_center) > radius * 0.5 * (fwhm + other_fwhm) for other_center, other_fwhm in
+               changed):
+            for parameter in peak['parameters']:
+                parameter['vary'] = False
+            fixed += 1
+    return local_dict, fixed
+
+
+def _center_and_fwhm(peak_dict):
+    values = {p['name']: p['value'] for p in peak_dict['parameters']}
+    return values['center'], values['fwhm']
+
+
+def update_values(data_dict, result):
+    """
+    Set the values of the input dictionary to the result values of a fit.
+    :param data_dict: the input dictionary, see model_dict, its values are replaced
+    :param result: the 'result' of a fit response
+    """
+    for parameter, output in zip(data_dict['background']['parameters'], result['background']['parameters']):
+        parameter['value'] = output['value']
+    for peak, peak_output in zip(data_dict['peaks'], result['peaks']):
+        for parameter, output in zip(peak['parameters'], peak_output['parameters']):
+            parameter['value'] = output['value']
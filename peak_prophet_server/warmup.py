@@ -0,0 +1,154 @@
+"""
+Warm-up of a new server process. The socket path does not import lmfit, scipy and the fitting modules, so the
+server starts listening right away. The warm-up imports them in the background and runs tiny fits of every peak
+type with both engines, which also initializes the lazily loaded parts of scipy and fills the model cache. With
+the process backend, all worker processes of the pool are started and run the same warm-up. GET /ready reports
+the server as ready once the warm-up is done.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# PEAK_PROPHET_WARM_UP=0 skips the warm-up, the server is ready right away
+WARM_UP = os.getenv("PEAK_PROPHET_WARM_UP", "1") != "0"
+WARM_UP_POINTS = 64
+WARM_UP_PEAK_TYPES = ("gaussian", "lorentzian", "pseudovoigt")
+
+
+class Readiness:
+    """
+    State of the warm-up of the server process.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.duration = None
+        self.error = None
+        self.task = None
+
+    def status(self):
+        return {"ready": self.ready, "warm_up_seconds": self.duration, "error": self.error}
+
+
+readiness = Readiness()
+
+
+def warm_up_request(peak_type):
+    """
+    :return: a tiny fit request with one peak on a linear background
+    :rtype: str
+    """
+    x = np.linspace(-5, 5, WARM_UP_POINTS)
+    y = 1 + 0.1 * x + 10 * np.exp(-(x ** 2) / 2)
+    return json.dumps(
+        {
+            "pattern": {"x": x.tolist(), "y": y.tolist()},
+            "peaks": [
+                {
+                    "type": peak_type,
+                    "parameters": [
+                        {"name": "amplitude", "value": 20},
+                        {"name": "center", "value": 0.2},
+                        {"name": "fwhm", "value": 2},
+                    ],
+                }
+            ],
+            "background": {
+                "type": "linear",
+                "parameters": [{"name": "intercept", "value": 0}, {"name": "slope", "value": 0}],
+            },
+        }
+    )
+
+
+def warm_up():
+    """
+    Import the fitting modules and fit a tiny pattern with every peak type and both engines, without the metrics
+    of real fits.
+    :return: duration in seconds
+    :rtype: float
+    """
+    start = time.perf_counter()
+    from .data_reader import read_data
+    from .fitting import create_response
+    from .peak_detection import detect_peaks
+    from .schema import decode_request
+
+    for peak_type in WARM_UP_PEAK_TYPES:
+        data_dict = decode_request(warm_up_request(peak_type))
+        for flat in (True, False):
+            pattern, model, params = read_data(data_dict, flat)
+            create_response(data_dict, model.fit(pattern.y, params, x=pattern.x))
+    detect_peaks(pattern)
+    return time.perf_counter() - start
+
+
+def warm_up_worker():
+    """
+    Initializer of the fit worker processes, see workers.get_executor. An exception in an initializer breaks the
+    whole pool, a failed warm-up is only logged, the worker imports what it needs with the first fit.
+    """
+    try:
+        warm_up()
+    except Exception:
+        logger.exception("warm-up of the worker process failed")
+
+
+async def run_warm_up(state=readiness):
+    """
+    Warm up the server process and, with the process backend, the worker processes, then mark the server as
+    ready. A failed warm-up leaves the server not ready with the error.
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        await loop.run_in_executor(None, warm_up)
+        from .fitting import FitManager
+
+        if FitManager.backend == "process":
+            from .workers import start_workers
+
+            await loop.run_in_executor(None, start_workers)
+    except Exception as e:
+        state.error = str(e)
+        logger.exception("warm-up failed")
+        return
+    state.duration = time.perf_counter() - start
+    state.ready = True
+    logger.info("warm-up finished", extra={"duration": state.duration})
+
+
+async def start_warm_up(state=readiness):
+    """
+    Start the warm-up in the background, on the start of the server.
+    """
+    if not WARM_UP:
+        state.ready = True
+        return
+    state.task = asyncio.create_task(run_warm_up(state))
+
+
+def with_readiness(app, state=readiness):
+    """
+    ASGI app serving the readiness of the server on GET /ready, 200 once the warm-up is done and 503 before,
+    other requests are passed to app.
+    """
+
+    async def readiness_app(scope, receive, send):
+        if scope["type"] != "http" or scope["path"].rstrip("/") != "/ready":
+            await app(scope, receive, send)
+            return
+        status = 200 if state.ready else 503
+        body = json.dumps(state.status()).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body if scope["method"] != "HEAD" else b""})
+
+    return readiness_app
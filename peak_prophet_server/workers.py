@@ -0,0 +1,241 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from lmfit import minimize
+
+from peak_prophet_server.data_reader import read_model, base_parameter_names
+from peak_prophet_server.solvers import solver_options, fit_arguments
+from peak_prophet_server.warmup import warm_up_worker
+
+# number of attempts to get a consistent progress snapshot while the worker is writing it
+READ_ATTEMPTS = 10
+
+_executor = None
+
+
+def get_executor():
+    """
+    Get the process pool used for fitting, created on first use. The number of worker processes can be set
+    with the PEAK_PROPHET_WORKERS environment variable and defaults to the number of CPUs.
+    :rtype: ProcessPoolExecutor
+    """
+    global _executor
+    if _executor is None:
+        # spawn instead of fork, the server process runs an event loop and threads, every new worker is
+        # warmed up before it takes a fit
+        _executor = ProcessPoolExecutor(
+            max_workers=worker_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_up_worker,
+        )
+    return _executor
+
+
+def worker_count():
+    return int(os.getenv("PEAK_PROPHET_WORKERS", os.cpu_count() or 1))
+
+
+def start_workers():
+    """
+    Start all worker processes of the pool, the pool only starts a worker when no idle one is available, and
+    wait until they are warmed up.
+    :return: process ids of the workers which answered
+    :rtype: set[int]
+    """
+    executor = get_executor()
+    futures = [executor.submit(os.getpid) for _ in range(worker_count())]
+    return {future.result() for future in futures}
+
+
+class SharedArrays:
+    """
+    Several float64 arrays in one shared memory block. The creating process owns the block and has to
+    unlink it, other processes attach to it with the handle.
+    """
+
+    def __init__(self, sizes, name=None):
+        """
+        :param sizes: lengths of the arrays
+        :param name: name of an existing shared memory block to attach to, creates a new one if None
+        """
+        self.sizes = list(sizes)
+        n_bytes = max(1, sum(self.sizes)) * np.dtype(np.float64).itemsize
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=n_bytes)
+
+        self.arrays = []
+        offset = 0
+        for size in self.sizes:
+            self.arrays.append(np.ndarray((size,), dtype=np.float64, buffer=self.memory.buf, offset=offset * 8))
+            offset += size
+
+    @classmethod
+    def from_arrays(cls, *arrays):
+        shared = cls([len(array) for array in arrays])
+        for target, source in zip(shared.arrays, arrays):
+            target[:] = source
+        return shared
+
+    @property
+    def handle(self):
+        """
+        Picklable reference to the shared memory, used to attach to it from another process.
+        """
+        return self.sizes, self.memory.name
+
+    def release(self):
+        """
+        Close the shared memory and unlink it if this process created it. The arrays must not be used anymore.
+        """
+        self.arrays = []
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class SharedProgress:
+    """
+    Progress of a fit running in a worker process and the stop flag for it. The worker writes the iteration,
+    chi2, parameter values and residual after each iteration, the server reads them when a client requests
+    the progress. A sequence counter, which is odd while the worker writes, makes sure no half written
+    snapshot is read.
+    """
+
+    def __init__(self, n_params, n_points, name=None):
+        self.shared = SharedArrays([4, n_params, n_points], name)
+        # header: sequence, stop, iteration, chi2
+        self.header, self.values, self.resid = self.shared.arrays
+
+    @classmethod
+    def attach(cls, handle):
+        (_, n_params, n_points), name = handle
+        return cls(n_params, n_points, name)
+
+    @property
+    def handle(self):
+        return self.shared.handle
+
+    @property
+    def stop(self):
+        return bool(self.header[1])
+
+    @stop.setter
+    def stop(self, value):
+        self.header[1] = float(value)
+
+    @property
+    def version(self):
+        """
+        Number of snapshots written so far.
+        """
+        return int(self.header[0]) // 2
+
+    def write(self, iteration, chi2, values, resid):
+        self.header[0] += 1
+        self.header[2] = iteration
+        self.header[3] = chi2
+        self.values[:] = values
+        self.resid[:] = resid
+        self.header[0] += 1
+
+    def read(self):
+        """
+        :return: iteration, chi2, parameter values and residual of the last iteration or None if no iteration
+                 has finished yet
+        :rtype: (int, float, np.ndarray, np.ndarray) | None
+        """
+        for _ in range(READ_ATTEMPTS):
+            sequence = self.header[0]
+            if sequence % 2:
+                continue
+            snapshot = (int(self.header[2]), float(self.header[3]), self.values.copy(), self.resid.copy())
+            if self.header[0] == sequence:
+                return snapshot if sequence > 0 else None
+        return None
+
+    def release(self):
+        self.header = self.values = self.resid = None
+        self.shared.release()
+
+
+class FitSummary:
+    """
+    The parts of an lmfit fit result needed to create the response, small enough to be sent back from a
+    worker process.
+    """
+
+    def __init__(self, result):
+        self.success = result.success
+        self.message = result.message
+        self.chisqr = result.chisqr
+        self.redchi = result.redchi
+        self.nfev = result.nfev
+        self.params = result.params
+
+
+def fit_worker(data_dict, flat, pattern_handle, progress_handle, calc_covar=True):
+    """
+    Fit in a worker process. The pattern is read from shared memory, and the progress is written to shared
+    memory, where the server process can read it and set the stop flag.
+    :param data_dict: the input dictionary without the pattern
+    :param flat: use the MultiPeakModel instead of the lmfit CompositeModel
+    :param pattern_handle: handle of the SharedArrays with x, y and optional weights
+    :param progress_handle: handle of the SharedProgress
+    :param calc_covar: estimate the uncertainties of the parameters, see fit_arrays
+    :rtype: FitSummary
+    """
+    pattern = SharedArrays(*pattern_handle)
+    progress = SharedProgress.attach(progress_handle)
+    weights = pattern.arrays[2] if len(pattern.arrays) > 2 else None
+    try:
+        return fit_arrays(data_dict, flat, *pattern.arrays[:2], progress, weights, calc_covar)
+    finally:
+        progress.release()
+        pattern.release()
+
+
+def fit_arrays(data_dict, flat, x, y, progress, weights=None, calc_covar=True):
+    """
+    Fit the model of the input dictionary to the pattern arrays, writing the progress to a SharedProgress
+    and stopping when its stop flag is set.
+    :param calc_covar: estimate the uncertainties of the parameters. lmfit estimates them for leastsq and
+                       least_squares regardless of its own calc_covar, without them the parameters calculated
+                       from an expression (fwhm, height, ...) are left out of the fit, propagating the
+                       uncertainties to them is most of the cost of the estimate. The result has no stderr then.
+    :rtype: FitSummary
+    """
+    model, params = read_model(data_dict, flat=flat)
+    names = base_parameter_names(params)
+
+    def iter_cb(params, iter, resid, *args, **kwargs):
+        progress.write(iter, np.dot(resid, resid), [params[name].value for name in names], resid)
+        return progress.stop
+
+    arguments = fit_arguments(solver_options(data_dict.get("solver")), params)
+    if calc_covar:
+        return FitSummary(model.fit(y, params, x=x, weights=weights, iter_cb=iter_cb, **arguments))
+
+    fit_params = params.copy()
+    for name in list(fit_params):
+        if name not in names:
+            del fit_params[name]
+    if flat:
+        result = model.fit(y, fit_params, x=x, weights=weights, iter_cb=iter_cb, **arguments)
+    else:
+        # lmfit.Model.fit insists on all parameters of the model, minimize its residual directly
+        def residual(params):
+            resid = model.eval(params, x=x) - y
+            return resid if weights is None else resid * weights
+
+        result = minimize(residual, fit_params, method=arguments["method"], iter_cb=iter_cb,
+                          max_nfev=arguments["max_nfev"], **arguments["fit_kws"])
+    for name in names:
+        params[name].value = result.params[name].value
+    params.update_constraints()
+    for param in params.values():
+        param.stderr = param.correl = None
+    result.params = params
+    return FitSummary(result)
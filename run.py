@@ -1,7 +1,12 @@
+import logging
 import os
 import uvicorn
 import socketio
+from peak_prophet_server.logs import configure_logging
+from peak_prophet_server.metrics import metrics_app
 from peak_prophet_server.sio_events import connect_events
+from peak_prophet_server.state import start_state_backend, close_state_backend
+from peak_prophet_server.warmup import start_warm_up, with_readiness
 
 ############################################
 # OLD WAY to start server:
@@ -30,12 +35,28 @@ sio = socketio.AsyncServer(
     allowEIO3=True,
 )
 
+configure_logging()
 connect_events(sio)
 
-app = socketio.ASGIApp(sio)
+
+async def startup():
+    await start_state_backend()
+    # the server accepts connections during the warm-up, GET /ready reports when it is done
+    await start_warm_up()
+
+
+# GET /metrics and GET /ready are served next to the socket.io path
+app = socketio.ASGIApp(sio, other_asgi_app=with_readiness(metrics_app), on_startup=startup,
+                       on_shutdown=close_state_backend)
 
 if __name__ == "__main__":
-    print("Starting server...")
     # get the port from the environment variable
-    port = os.getenv("PORT", 8009)
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    port = int(os.getenv("PORT", 8009))
+    workers = int(os.getenv("PEAK_PROPHET_SERVER_WORKERS", 1))
+    logging.getLogger("peak_prophet_server").info("starting server", extra={"port": port, "workers": workers})
+    if workers > 1:
+        # the worker processes import this module and have to share the job state
+        os.environ.setdefault("PEAK_PROPHET_STATE", "ipc")
+        uvicorn.run("run:app", host="0.0.0.0", port=port, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
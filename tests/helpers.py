@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+import numpy as np
+from lmfit.lineshapes import gaussian
+
+from peak_prophet_server.data_reader import convert_gaussian_fwhm_to_sigma
+
+
+def peak_dict(center, fwhm=0.5, amplitude=9):
+    return {'type': 'gaussian',
+            'parameters': [{'name': 'amplitude', 'value': amplitude, 'vary': True, 'min': None, 'max': None},
+                           {'name': 'center', 'value': center, 'vary': True, 'min': None, 'max': None},
+                           {'name': 'fwhm', 'value': fwhm, 'vary': True, 'min': None, 'max': None}]}
+
+
+def create_request(centers, n_points=3001, x_max=30, fwhm=0.4, intercept=2, shift=0.1, start=None):
+    """
+    Fit request with Gaussian peaks of the fwhm and the amplitudes 10, 11, ... at the centers on the background
+    intercept + 0.01 * x. The peaks start shifted by shift with the values of peak_dict and the background
+    starts at intercept 1 and slope 0, start overrides them, e.g. {'fwhm': 0.8, 'amplitude': 8, 'intercept': 0.5}.
+    :rtype: dict
+    """
+    start = {'fwhm': 0.5, 'amplitude': 9, 'intercept': 1, **(start or {})}
+    x = np.linspace(0, x_max, n_points)
+    y = intercept + 0.01 * x
+    for i, center in enumerate(centers):
+        y = y + gaussian(x, 10 + i, center, convert_gaussian_fwhm_to_sigma(fwhm))
+    return {
+        'pattern': {'x': x.tolist(), 'y': y.tolist()},
+        'peaks': [peak_dict(center + shift, start['fwhm'], start['amplitude']) for center in centers],
+        'background': {'type': 'linear',
+                       'parameters': [{'name': 'intercept', 'value': start['intercept']},
+                                      {'name': 'slope', 'value': 0}]},
+    }
+
+
+async def sub_fit_progress(fit_manager, timeout=10):
+    """
+    Progress of the finished sub fits of a request, once its residual has been calculated in the thread pool,
+    see FitManager.sub_fit_snapshot.
+    """
+    version = fit_manager.progress_version
+    fit_manager.current_progress
+    start = time.perf_counter()
+    while fit_manager.progress_version == version:
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError('The progress of the sub fits was not calculated')
+        await asyncio.sleep(0.001)
+    return fit_manager.current_progress
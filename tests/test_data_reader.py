@@ -1,11 +1,13 @@
 import unittest
+import json
 
 import numpy as np
 from lmfit import CompositeModel
 from lmfit.models import LinearModel, QuadraticModel, PolynomialModel, GaussianModel, LorentzianModel, \
     PseudoVoigtModel
 
-from peak_prophet_server.data_reader import read_background, read_pattern, read_peaks, read_peak, read_data
+from peak_prophet_server.data_reader import read_background, read_pattern, read_peaks, read_peak, read_data, \
+    read_request
 
 
 class TestDataReader(unittest.TestCase):
@@ -73,8 +75,63 @@ class TestDataReader(unittest.TestCase):
              'x': [1, 2, 3, 4, 5],
              'y': [1, 2, 3, 4, 5]}
         pattern = read_pattern(input_dict)
-        self.assertEqual(pattern.x, [1, 2, 3, 4, 5])
-        self.assertEqual(pattern.y, [1, 2, 3, 4, 5])
+        np.testing.assert_array_equal(pattern.x, [1, 2, 3, 4, 5])
+        np.testing.assert_array_equal(pattern.y, [1, 2, 3, 4, 5])
+
+    def test_read_pattern_with_different_lengths(self):
+        with self.assertRaises(ValueError):
+            read_pattern({'x': [1, 2, 3], 'y': [1, 2]})
+        with self.assertRaises(ValueError):
+            read_pattern({'x': [1, 2, 3], 'y': [1, 2, 3], 'weights': [1]})
+
+    def test_read_json_request(self):
+        input_dict = {'pattern': {'x': [1, 2], 'y': [3, 4]}, 'peaks': [], 'background': {}}
+        self.assertEqual(read_request(json.dumps(input_dict)), input_dict)
+
+    def test_read_binary_request(self):
+        x = np.linspace(0, 1, 5)
+        y = np.arange(5, dtype=np.float64)
+        x_bytes = x.astype('<f8').tobytes()
+        request = {
+            'request': json.dumps({'pattern': {'name': 'binary'}, 'peaks': [], 'background': {}}),
+            'x': x_bytes,
+            'y': y.astype('<f8').tobytes(),
+        }
+        data_dict = read_request(request)
+        self.assertEqual(data_dict['pattern']['name'], 'binary')
+        np.testing.assert_array_equal(data_dict['pattern']['x'], x)
+        np.testing.assert_array_equal(data_dict['pattern']['y'], y)
+        self.assertNotIn('weights', data_dict['pattern'])
+        # the arrays are views of the attachments
+        self.assertIs(data_dict['pattern']['x'].base, x_bytes)
+
+    def test_read_binary_float32_request_with_weights(self):
+        request = {
+            'request': json.dumps({'peaks': [], 'background': {}}),
+            'x': np.arange(4, dtype='<f4').tobytes(),
+            'y': np.ones(4, dtype='<f4').tobytes(),
+            'weights': np.full(4, 2, dtype='<f4').tobytes(),
+            'dtype': 'float32',
+        }
+        pattern = read_pattern(read_request(request)['pattern'])
+        np.testing.assert_array_equal(pattern.x, [0, 1, 2, 3])
+        np.testing.assert_array_equal(pattern.weights, [2, 2, 2, 2])
+
+    def test_read_binary_series_request(self):
+        request = {
+            'request': json.dumps({'peaks': [], 'background': {}}),
+            'patterns': [{'x': np.arange(3, dtype='<f4').tobytes(), 'y': np.full(3, i, dtype='<f4').tobytes()}
+                         for i in range(2)],
+            'dtype': 'float32',
+        }
+        data_dict = read_request(request)
+        self.assertEqual(len(data_dict['patterns']), 2)
+        np.testing.assert_array_equal(read_pattern(data_dict['patterns'][1]).y, [1, 1, 1])
+
+    def test_read_binary_request_with_unknown_dtype(self):
+        request = {'request': '{}', 'x': b'', 'y': b'', 'dtype': 'int8'}
+        with self.assertRaises(ValueError):
+            read_request(request)
 
     def test_read_peaks(self):
         input_dict = \
@@ -197,8 +254,8 @@ class TestDataReader(unittest.TestCase):
 
         pattern, model, params = read_data(input_dict)
 
-        self.assertEqual(pattern.x, [1, 2, 3, 4, 5])
-        self.assertEqual(pattern.y, [1, 2, 3, 4, 5])
+        np.testing.assert_array_equal(pattern.x, [1, 2, 3, 4, 5])
+        np.testing.assert_array_equal(pattern.y, [1, 2, 3, 4, 5])
         self.assertIsInstance(model, CompositeModel)
         self.assertIsInstance(model.left.left, LinearModel)
         self.assertIsInstance(model.left.right, GaussianModel)
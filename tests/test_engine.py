@@ -0,0 +1,152 @@
+import unittest
+
+import numpy as np
+
+from peak_prophet_server.data_reader import read_data
+from peak_prophet_server.engine import MultiPeakModel
+
+
+def create_input(background, peak_types):
+    peaks = []
+    for i, peak_type in enumerate(peak_types):
+        parameters = [
+            {'name': 'amplitude', 'value': 10 + i, 'vary': True, 'min': None, 'max': None},
+            {'name': 'center', 'value': 1 + i * 0.7, 'vary': True, 'min': None, 'max': None},
+            {'name': 'fwhm', 'value': 0.2 + i * 0.05, 'vary': True, 'min': None, 'max': None},
+        ]
+        if peak_type == 'pseudovoigt':
+            parameters.append({'name': 'fraction', 'value': 0.3, 'vary': True, 'min': None, 'max': None})
+        peaks.append({'type': peak_type, 'parameters': parameters})
+
+    x = np.linspace(0, 10, 1001)
+    return {
+        'pattern': {'name': 'test', 'x': x.tolist(), 'y': np.zeros_like(x).tolist()},
+        'peaks': peaks,
+        'background': background,
+    }
+
+
+LINEAR_BACKGROUND = {'type': 'linear',
+                     'parameters': [{'name': 'intercept', 'value': 1}, {'name': 'slope', 'value': 0.2}]}
+QUADRATIC_BACKGROUND = {'type': 'quadratic',
+                        'parameters': [{'name': 'a', 'value': 0.1}, {'name': 'b', 'value': -0.3},
+                                       {'name': 'c', 'value': 2}]}
+POLYNOMIAL_BACKGROUND = {'type': 'polynomial', 'degree': 3,
+                         'parameters': [{'name': f'c{i}', 'value': 0.5 / (i + 1)} for i in range(4)]}
+
+
+class TestMultiPeakModel(unittest.TestCase):
+    def compare_with_lmfit(self, background, peak_types):
+        input_dict = create_input(background, peak_types)
+        pattern, lmfit_model, params = read_data(input_dict)
+        _, flat_model, _ = read_data(input_dict, flat=True)
+
+        self.assertIsInstance(flat_model, MultiPeakModel)
+        x = np.asarray(pattern.x)
+        np.testing.assert_allclose(flat_model.eval(params, x=x), lmfit_model.eval(params, x=x), rtol=1e-12)
+
+    def test_linear_background_with_all_peak_types(self):
+        self.compare_with_lmfit(LINEAR_BACKGROUND, ['gaussian', 'lorentzian', 'pseudovoigt'])
+
+    def test_quadratic_background_with_mixed_peaks(self):
+        self.compare_with_lmfit(QUADRATIC_BACKGROUND, ['pseudovoigt', 'gaussian', 'pseudovoigt', 'lorentzian'])
+
+    def test_polynomial_background_without_peaks(self):
+        self.compare_with_lmfit(POLYNOMIAL_BACKGROUND, [])
+
+    def test_many_peaks_are_evaluated_in_blocks(self):
+        self.compare_with_lmfit(LINEAR_BACKGROUND, ['gaussian', 'lorentzian'] * 20)
+
+    def test_parameter_names(self):
+        model = MultiPeakModel('linear', ['Gaussian', 'PseudoVoigt'])
+        self.assertEqual(model.param_names,
+                         ['bkg_intercept', 'bkg_slope',
+                          'p0_amplitude', 'p0_center', 'p0_sigma',
+                          'p1_amplitude', 'p1_center', 'p1_sigma', 'p1_fraction'])
+
+    def test_unknown_types(self):
+        with self.assertRaises(ValueError):
+            MultiPeakModel('spline', ['gaussian'])
+        with self.assertRaises(ValueError):
+            MultiPeakModel('linear', ['voigt'])
+
+
+class TestMultiPeakModelJacobian(unittest.TestCase):
+    def compare_with_finite_differences(self, background, peak_types):
+        input_dict = create_input(background, peak_types)
+        pattern, model, params = read_data(input_dict, flat=True)
+        x = np.asarray(pattern.x)
+        values = model.values(params)
+
+        derivatives = model.derivatives(values, x)
+        for i, name in enumerate(model.param_names):
+            step = 1e-6 * max(1, abs(values[i]))
+            upper, lower = values.copy(), values.copy()
+            upper[i] += step
+            lower[i] -= step
+            numeric = (model.evaluate(upper, x) - model.evaluate(lower, x)) / (2 * step)
+            np.testing.assert_allclose(derivatives[i], numeric, rtol=1e-5, atol=1e-5, err_msg=name)
+
+    def test_linear_background_with_all_peak_types(self):
+        self.compare_with_finite_differences(LINEAR_BACKGROUND, ['gaussian', 'lorentzian', 'pseudovoigt'])
+
+    def test_quadratic_background(self):
+        self.compare_with_finite_differences(QUADRATIC_BACKGROUND, ['pseudovoigt', 'gaussian'])
+
+    def test_polynomial_background(self):
+        self.compare_with_finite_differences(POLYNOMIAL_BACKGROUND, ['lorentzian'])
+
+    def test_jacobian_only_contains_varying_parameters(self):
+        input_dict = create_input(LINEAR_BACKGROUND, ['gaussian', 'pseudovoigt'])
+        input_dict['peaks'][1]['parameters'][3]['vary'] = False
+        pattern, model, params = read_data(input_dict, flat=True)
+        params['bkg_slope'].set(vary=False)
+
+        jacobian = model.jacobian(params, np.asarray(pattern.x))
+        derivatives = model.derivatives(model.values(params), np.asarray(pattern.x))
+
+        self.assertEqual(jacobian.shape, (len(model.param_names) - 2, len(pattern.x)))
+        np.testing.assert_array_equal(jacobian[0], derivatives[model.index['bkg_intercept']])
+        np.testing.assert_array_equal(jacobian[-1], derivatives[model.index['p1_sigma']])
+
+    def test_high_order_background_does_not_hide_the_peaks(self):
+        x = np.linspace(10, 120, 2201)
+        coefficients = [5, 0.1, 1e-3, 1e-5, 1e-7, 1e-9]
+        background = {'type': 'polynomial', 'degree': 5,
+                      'parameters': [{'name': f'c{i}', 'value': value} for i, value in enumerate(coefficients)]}
+        input_dict = create_input(background, ['gaussian', 'gaussian'])
+        for peak, center, amplitude in zip(input_dict['peaks'], (40, 80), (15, 25)):
+            peak['parameters'][0]['value'] = amplitude
+            peak['parameters'][1]['value'] = center
+            peak['parameters'][2]['value'] = 2
+        input_dict['pattern'] = {'x': x.tolist(), 'y': np.zeros_like(x).tolist()}
+        pattern, model, params = read_data(input_dict, flat=True)
+        y = model.eval(params, x=x)
+        params['p0_amplitude'].set(value=20)
+        params['p1_amplitude'].set(value=30)
+        params['p1_center'].set(value=80.3)
+
+        flat_result = model.fit(y, params, x=x)
+        _, lmfit_model, lmfit_params = read_data(input_dict)
+        for name, param in params.items():
+            lmfit_params[name].set(value=param.value)
+        lmfit_result = lmfit_model.fit(y, lmfit_params, x=x)
+
+        self.assertLess(flat_result.chisqr, 1e-12)
+        self.assertLess(lmfit_result.chisqr, 1e-12)
+        for name in ('p0_amplitude', 'p1_amplitude', 'p1_center'):
+            self.assertAlmostEqual(flat_result.params[name].value, lmfit_result.params[name].value, delta=1e-6)
+
+    def test_peak_outside_of_the_pattern_has_zero_derivatives(self):
+        input_dict = create_input(LINEAR_BACKGROUND, ['gaussian', 'lorentzian'])
+        input_dict['peaks'][0]['parameters'][1]['value'] = 1000
+        pattern, model, params = read_data(input_dict, flat=True)
+        x = np.asarray(pattern.x)
+
+        jacobian = model.jacobian(params, x)
+        outside = model.outside_parameters(model.values(params), x)
+
+        self.assertEqual([name for name, value in zip(model.param_names, outside) if value],
+                         ['p0_amplitude', 'p0_center', 'p0_sigma'])
+        self.assertFalse(np.any(jacobian[2:5]))
+        self.assertTrue(np.all(np.any(jacobian[5:], axis=1)))
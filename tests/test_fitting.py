@@ -1,11 +1,14 @@
 import unittest
 import json
+from unittest import mock
 
 import numpy as np
 from lmfit.models import LinearModel, GaussianModel, LorentzianModel, PseudoVoigtModel
 
-from peak_prophet_server.data_reader import convert_gaussian_fwhm_to_sigma
+from peak_prophet_server.data_reader import convert_gaussian_fwhm_to_sigma, read_data, base_parameter_names
 from peak_prophet_server.fitting import FitManager
+from peak_prophet_server.pattern import Pattern
+from peak_prophet_server.pattern_store import PatternStore
 
 
 class TestFitting(unittest.IsolatedAsyncioTestCase):
@@ -498,17 +501,201 @@ class TestFitting(unittest.IsolatedAsyncioTestCase):
 
         input_request = json.dumps(input_dict)
         fit_manager = FitManager("TEST-SID")
-        loop = asyncio.get_event_loop()
 
-        def stop_fit():
+        async def stop_fit():
+            # the fit converges in about a second, stop it as soon as it is running
+            while fit_manager.progress_version == 0:
+                await asyncio.sleep(0.01)
             print("Stopping fit")
             fit_manager.stop = True
 
-        loop.call_later(1, stop_fit)
+        stop_task = asyncio.create_task(stop_fit())
         fit_response = await fit_manager.process_request(input_request)
+        await stop_task
 
         self.assertEqual(fit_response['success'], False)
 
+    async def test_flat_engine_matches_lmfit_engine(self):
+        background_model = LinearModel(prefix='bkg_')
+        params = background_model.make_params(intercept=1, slope=0.2)
+
+        peak1_model = GaussianModel(prefix='p0_')
+        params.update(peak1_model.make_params(amplitude=10, center=2, sigma=convert_gaussian_fwhm_to_sigma(0.2)))
+
+        peak2_model = PseudoVoigtModel(prefix='p1_')
+        params.update(peak2_model.make_params(amplitude=10, center=5, sigma=0.3 * 0.5, fraction=0.3))
+
+        model = background_model + peak1_model + peak2_model
+
+        pattern_y = model.eval(params, x=self.pattern_x) + self.error_array
+
+        input_dict = {
+            'pattern': {
+                'name': 'test',
+                'x': self.pattern_x.tolist(),
+                'y': pattern_y.tolist()
+            },
+            'peaks': [
+                {
+                    'type': 'gaussian',
+                    'parameters': [
+                        {'name': 'amplitude', 'value': 10.5, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'center', 'value': 2.2, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'fwhm', 'value': 0.2, 'vary': True, 'min': None, 'max': None}
+                    ]
+                },
+                {
+                    'type': 'pseudovoigt',
+                    'parameters': [
+                        {'name': 'amplitude', 'value': 10.5, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'center', 'value': 5.1, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'fwhm', 'value': 0.3, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'fraction', 'value': 0.4, 'vary': True, 'min': None, 'max': None}
+                    ]
+                },
+            ],
+            'background': self.bkg_dict
+        }
+
+        flat_result = await self.fit(dict(input_dict, engine='flat'))
+        lmfit_result = await self.fit(dict(input_dict, engine='lmfit'))
+
+        self.compare_peak_results(flat_result['peaks'], lmfit_result['peaks'], delta=1e-4)
+        for flat_param, lmfit_param in zip(flat_result['background']['parameters'],
+                                           lmfit_result['background']['parameters']):
+            self.assertAlmostEqual(flat_param['value'], lmfit_param['value'], delta=1e-4)
+
+    async def test_fit_binary_request_with_weights(self):
+        background_model = LinearModel(prefix='bkg_')
+        params = background_model.make_params(intercept=1, slope=0.2)
+
+        peak1_model = GaussianModel(prefix='p0_')
+        params.update(peak1_model.make_params(amplitude=10, center=2, sigma=convert_gaussian_fwhm_to_sigma(0.2)))
+
+        model = background_model + peak1_model
+
+        pattern_y = model.eval(params, x=self.pattern_x) + self.error_array
+        # large uncertainty on a spike, which would otherwise disturb the fit
+        pattern_y[300] += 50
+        weights = np.full(self.num_points, 1 / self.error)
+        weights[300] = 1e-6
+
+        input_dict = {
+            'pattern': {'name': 'test'},
+            'peaks': [
+                {
+                    'type': 'gaussian',
+                    'parameters': [
+                        {'name': 'amplitude', 'value': 10.5, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'center', 'value': 2.2, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'fwhm', 'value': 0.2, 'vary': True, 'min': None, 'max': None}
+                    ]
+                },
+            ],
+            'background': self.bkg_dict
+        }
+        request = {
+            'request': json.dumps(input_dict),
+            'x': self.pattern_x.astype('<f4').tobytes(),
+            'y': pattern_y.astype('<f4').tobytes(),
+            'weights': weights.astype('<f4').tobytes(),
+            'dtype': 'float32',
+        }
+
+        fit_manager = FitManager("TEST-SID")
+        fit_response = await fit_manager.process_request(request)
+        self.assertTrue(fit_response['success'])
+        self.compare_background_results(fit_response['result']['background'])
+        self.compare_peak_results(fit_response['result']['peaks'], [
+            {
+                'type': 'gaussian',
+                'parameters': [
+                    {'name': 'amplitude', 'value': 10},
+                    {'name': 'center', 'value': 2},
+                    {'name': 'fwhm', 'value': 0.2}
+                ]
+            },
+        ])
+        # chi2 is weighted, about one per point
+        self.assertLess(fit_response['red_chi2'], 2)
+
+    async def test_fit_uploaded_pattern(self):
+        background_model = LinearModel(prefix='bkg_')
+        params = background_model.make_params(intercept=1, slope=0.2)
+
+        peak1_model = LorentzianModel(prefix='p0_')
+        params.update(peak1_model.make_params(amplitude=10, center=2, sigma=0.2 * 0.5))
+        model = background_model + peak1_model
+
+        pattern_y = model.eval(params, x=self.pattern_x) + self.error_array
+        pattern_store = PatternStore()
+        pattern_id = pattern_store.add(Pattern(self.pattern_x, pattern_y))
+
+        input_dict = {
+            'pattern': {'id': pattern_id},
+            'peaks': [
+                {
+                    'type': 'lorentzian',
+                    'parameters': [
+                        {'name': 'amplitude', 'value': 10.5, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'center', 'value': 2.2, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'fwhm', 'value': 0.2, 'vary': True, 'min': None, 'max': None}
+                    ]
+                },
+            ],
+            'background': self.bkg_dict
+        }
+
+        fit_manager = FitManager("TEST-SID", pattern_store)
+        for _ in range(2):
+            fit_response = await fit_manager.process_request(json.dumps(input_dict))
+            self.assertTrue(fit_response['success'])
+            self.compare_background_results(fit_response['result']['background'])
+            self.assertAlmostEqual(fit_response['result']['peaks'][0]['parameters'][1]['value'], 2, delta=0.1)
+
+    def test_iter_cb_creates_progress_lazily(self):
+        pattern_x = np.linspace(0, 100, 100000)
+        input_dict = {
+            'pattern': {'name': 'test', 'x': pattern_x.tolist(), 'y': np.zeros_like(pattern_x).tolist()},
+            'peaks': [
+                {
+                    'type': 'pseudovoigt',
+                    'parameters': [
+                        {'name': 'amplitude', 'value': 10, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'center', 'value': i * 2, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'fwhm', 'value': 0.3, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'fraction', 'value': 0.5, 'vary': True, 'min': None, 'max': None}
+                    ]
+                } for i in range(50)],
+            'background': self.bkg_dict
+        }
+
+        fit_manager = FitManager("TEST-SID")
+        fit_manager.data_dict = input_dict
+        fit_manager.pattern, model, params = read_data(input_dict, flat=True)
+        fit_manager.params = params.copy()
+        fit_manager.progress_names = base_parameter_names(params)
+        resid = model.residual(params, pattern_x, np.asarray(fit_manager.pattern.y))
+
+        repetitions = 20
+        with mock.patch.object(fit_manager, 'create_progress', wraps=fit_manager.create_progress) as create_progress:
+            for i in range(repetitions):
+                fit_manager.iter_cb(params, i, resid)
+            create_progress.assert_not_called()
+
+            progress = fit_manager.current_progress
+            self.assertIs(fit_manager.current_progress, progress)
+            create_progress.assert_called_once()
+
+            fit_manager.iter_cb(params, repetitions, resid)
+            self.assertEqual(fit_manager.current_progress['iter'], repetitions)
+            self.assertEqual(create_progress.call_count, 2)
+
+        self.assertEqual(progress['iter'], repetitions - 1)
+        self.assertEqual(len(progress['resid']), len(pattern_x))
+        self.assertAlmostEqual(progress['result']['peaks'][3]['parameters'][1]['value'], 6)
+        self.assertAlmostEqual(progress['result']['peaks'][3]['parameters'][2]['value'], 0.3)
+
     async def fit(self, input_dict):
         input_request = json.dumps(input_dict)
 
@@ -521,13 +708,13 @@ class TestFitting(unittest.IsolatedAsyncioTestCase):
 
         return fit_result
 
-    def compare_peak_results(self, peak_result, expected_peak_data):
+    def compare_peak_results(self, peak_result, expected_peak_data, delta=0.1):
         self.assertEqual(len(peak_result), len(expected_peak_data))
         for i, peak in enumerate(peak_result):
             self.assertEqual(peak['type'], expected_peak_data[i]['type'])
             for j, param in enumerate(peak['parameters']):
                 self.assertEqual(param['name'], expected_peak_data[i]['parameters'][j]['name'])
-                self.assertAlmostEqual(param['value'], expected_peak_data[i]['parameters'][j]['value'], delta=0.1)
+                self.assertAlmostEqual(param['value'], expected_peak_data[i]['parameters'][j]['value'], delta=delta)
 
     def compare_background_results(self, background_result):
         self.assertEqual(background_result['type'], 'linear')
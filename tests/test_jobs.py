@@ -0,0 +1,147 @@
+import unittest
+import asyncio
+import json
+import time
+
+import numpy as np
+from lmfit.lineshapes import gaussian
+
+from peak_prophet_server.data_reader import convert_gaussian_fwhm_to_sigma
+from peak_prophet_server.jobs import JobManager, QUEUED, RUNNING, CANCELLED, DONE, FAILED
+from peak_prophet_server.result_cache import result_cache
+from peak_prophet_server.scheduler import FitScheduler
+
+
+def create_request(n_peaks=1, n_points=1001):
+    x = np.linspace(0, 10 * n_peaks, n_points)
+    y = 1 + 0.1 * x
+    peaks = []
+    for i in range(n_peaks):
+        y += gaussian(x, 10, 5 + 10 * i, convert_gaussian_fwhm_to_sigma(0.3))
+        peaks.append({'type': 'gaussian',
+                      'parameters': [{'name': 'amplitude', 'value': 8, 'vary': True, 'min': None, 'max': None},
+                                     {'name': 'center', 'value': 4.9 + 10 * i, 'vary': True, 'min': None,
+                                      'max': None},
+                                     {'name': 'fwhm', 'value': 0.4, 'vary': True, 'min': None, 'max': None}]})
+    return json.dumps({
+        'pattern': {'x': x.tolist(), 'y': y.tolist()},
+        'peaks': peaks,
+        'background': {'type': 'linear',
+                       'parameters': [{'name': 'intercept', 'value': 0}, {'name': 'slope', 'value': 0}]},
+    })
+
+
+async def wait_for_progress(job, timeout=30):
+    start = time.perf_counter()
+    while not job.fit_manager.progress_version:
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError('The job did not start')
+        await asyncio.sleep(0.001)
+
+
+class TestJobs(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        # the tests need running fits, not cached responses
+        result_cache.clear()
+
+    async def test_job_is_done(self):
+        jobs = JobManager('TEST-SID')
+        job = jobs.submit(create_request())
+        self.assertEqual(job.state, QUEUED)
+
+        response = await jobs.wait(job)
+
+        self.assertEqual(job.state, DONE)
+        self.assertTrue(response['success'])
+        self.assertEqual(response['job_id'], job.id)
+        self.assertEqual(jobs.get().id, job.id)
+        self.assertEqual(jobs.status(), [{'job_id': job.id, 'kind': 'fit', 'state': DONE}])
+
+    async def test_concurrent_jobs(self):
+        jobs = JobManager('TEST-SID')
+        submitted = [jobs.submit(create_request()) for _ in range(3)]
+
+        responses = await asyncio.gather(*(jobs.wait(job) for job in submitted))
+
+        self.assertEqual(len({job.id for job in submitted}), 3)
+        for job, response in zip(submitted, responses):
+            self.assertEqual(job.state, DONE)
+            self.assertEqual(response['job_id'], job.id)
+            amplitude, center, fwhm = response['result']['peaks'][0]['parameters']
+            self.assertAlmostEqual(center['value'], 5, delta=1e-6)
+
+    async def test_cancel_running_job(self):
+        jobs = JobManager('TEST-SID')
+        job = jobs.submit(create_request(30, 30000))
+        await wait_for_progress(job)
+        self.assertEqual(job.state, RUNNING)
+
+        status = jobs.cancel(job.id)
+        start = time.perf_counter()
+        response = await jobs.wait(job)
+
+        self.assertEqual(status['state'], RUNNING)
+        self.assertEqual(job.state, CANCELLED)
+        self.assertFalse(response['success'])
+        self.assertLess(time.perf_counter() - start, 1)
+
+    async def test_cancel_queued_job(self):
+        jobs = JobManager('TEST-SID', fit_scheduler=FitScheduler(session_running=1))
+        running = jobs.submit(create_request(30, 30000))
+        queued = jobs.submit(create_request())
+        await wait_for_progress(running)
+        self.assertEqual(queued.state, QUEUED)
+
+        self.assertEqual(jobs.cancel(queued.id)['state'], CANCELLED)
+        jobs.cancel(running.id)
+
+        self.assertIsNone(await jobs.wait(queued))
+        await jobs.wait(running)
+        self.assertEqual(queued.fit_manager.progress_version, 0)
+
+    async def test_cancellation_does_not_affect_other_jobs(self):
+        jobs = JobManager('TEST-SID')
+        cancelled = jobs.submit(create_request(30, 30000))
+        other = jobs.submit(create_request())
+        await wait_for_progress(cancelled)
+        jobs.cancel(cancelled.id)
+        await jobs.wait(cancelled)
+
+        response = await jobs.wait(other)
+        self.assertEqual(other.state, DONE)
+        self.assertTrue(response['success'])
+
+        response = await jobs.wait(jobs.submit(create_request()))
+        self.assertTrue(response['success'])
+
+    async def test_cancel_all(self):
+        jobs = JobManager('TEST-SID', fit_scheduler=FitScheduler(session_running=1))
+        submitted = [jobs.submit(create_request(30, 30000)) for _ in range(3)]
+        await wait_for_progress(submitted[0])
+
+        jobs.cancel_all()
+        await asyncio.gather(*(jobs.wait(job) for job in submitted))
+
+        self.assertEqual([job.state for job in submitted], [CANCELLED] * 3)
+
+    async def test_failed_job(self):
+        jobs = JobManager('TEST-SID')
+        job = jobs.submit(json.dumps({'pattern': {'x': [0, 1], 'y': [0]}}))
+
+        with self.assertRaises(ValueError):
+            await jobs.wait(job)
+        self.assertEqual(job.state, FAILED)
+        self.assertIn('error', job.status())
+
+    async def test_unknown_job(self):
+        jobs = JobManager('TEST-SID')
+        with self.assertRaises(ValueError):
+            jobs.get()
+        with self.assertRaises(ValueError):
+            jobs.cancel('unknown')
+        with self.assertRaises(ValueError):
+            jobs.submit(create_request(), 'unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
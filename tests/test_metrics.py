@@ -0,0 +1,79 @@
+import unittest
+import json
+import logging
+
+from peak_prophet_server.fitting import FitManager
+from peak_prophet_server.jobs import scheduler
+from peak_prophet_server.logs import JsonFormatter
+from peak_prophet_server.metrics import Metrics, Histogram, metrics, metrics_app
+from tests.test_jobs import create_request
+
+
+async def get(app, path, method='GET'):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await app({'type': 'http', 'path': path, 'method': method}, None, send)
+    return messages[0]['status'], messages[1]['body'].decode()
+
+
+class TestMetrics(unittest.IsolatedAsyncioTestCase):
+    def test_histogram(self):
+        histogram = Histogram((1, 10))
+        for value in (0.5, 1, 5, 50):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.cumulative_counts(), [2, 3, 4])
+        self.assertEqual(histogram.sum, 56.5)
+
+    def test_render(self):
+        registry = Metrics()
+        registry.describe('test_seconds', 'Test time')
+        registry.observe('test_seconds', 0.5, (1,), phase='a')
+        registry.gauge('test_running', lambda: 2)
+
+        lines = registry.render().splitlines()
+
+        self.assertIn('# HELP test_seconds Test time', lines)
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertIn('test_seconds_bucket{phase="a",le="1.0"} 1', lines)
+        self.assertIn('test_seconds_bucket{phase="a",le="+Inf"} 1', lines)
+        self.assertIn('test_seconds_count{phase="a"} 1', lines)
+        self.assertIn('test_running 2.0', lines)
+
+    async def test_fit_phases(self):
+        await FitManager('TEST-SID').process_request(create_request())
+
+        for phase in ('parse', 'read_pattern', 'build_model', 'fit', 'output', 'request'):
+            self.assertGreater(metrics.histogram('peak_prophet_phase_seconds', phase=phase).count, 0)
+        self.assertGreater(metrics.histogram('peak_prophet_iter_cb_seconds').count, 0)
+        self.assertGreater(metrics.histogram('peak_prophet_evaluation_seconds').count, 0)
+
+    async def test_metrics_route(self):
+        status, body = await get(metrics_app, '/metrics')
+        self.assertEqual(status, 200)
+        self.assertIn('# TYPE peak_prophet_running_fits gauge', body)
+        self.assertIn(f'peak_prophet_running_fits {float(scheduler.n_running)!r}', body)
+
+        status, _ = await get(metrics_app, '/unknown')
+        self.assertEqual(status, 404)
+
+
+class TestJsonFormatter(unittest.TestCase):
+    def test_extra_fields(self):
+        record = logging.LogRecord('peak_prophet_server', logging.INFO, __file__, 1, 'fit finished', None, None)
+        record.sid = 'TEST-SID'
+        record.nfev = 12
+
+        entry = json.loads(JsonFormatter().format(record))
+
+        self.assertEqual(entry['message'], 'fit finished')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['sid'], 'TEST-SID')
+        self.assertEqual(entry['nfev'], 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import copy
+
+from lmfit import Parameters
+
+from peak_prophet_server.data_reader import read_model, model_cache
+from peak_prophet_server.model_cache import ModelCache, model_signature
+from tests.test_engine import create_input, LINEAR_BACKGROUND, POLYNOMIAL_BACKGROUND
+
+
+class TestModelCache(unittest.TestCase):
+    def setUp(self):
+        model_cache.clear()
+
+    def test_signature(self):
+        input_dict = create_input(LINEAR_BACKGROUND, ['gaussian', 'Lorentzian'])
+        self.assertEqual(model_signature(input_dict), ('linear', None, ('gaussian', 'lorentzian'), False))
+        self.assertNotEqual(model_signature(input_dict), model_signature(input_dict, flat=True))
+
+        other_degree = copy.deepcopy(POLYNOMIAL_BACKGROUND)
+        other_degree['degree'] = 2
+        self.assertNotEqual(model_signature(create_input(POLYNOMIAL_BACKGROUND, [])),
+                            model_signature(create_input(other_degree, [])))
+
+    def test_hits_and_misses(self):
+        cache = ModelCache(max_size=2)
+        builds = []
+
+        def build():
+            builds.append(1)
+            return object(), Parameters()
+
+        first = cache.get('a', build)
+        self.assertIs(cache.get('a', build), first)
+        cache.get('b', build)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertEqual(len(builds), 2)
+
+    def test_least_recently_used_template_is_evicted(self):
+        cache = ModelCache(max_size=2)
+
+        def build():
+            return object(), Parameters()
+
+        cache.get('a', build)
+        cache.get('b', build)
+        cache.get('a', build)
+        cache.get('c', build)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(list(cache.templates), ['a', 'c'])
+
+    def test_read_model_uses_the_cache(self):
+        first_dict = create_input(LINEAR_BACKGROUND, ['gaussian', 'pseudovoigt'])
+        first_model, first_params = read_model(first_dict, flat=True)
+
+        second_dict = create_input(LINEAR_BACKGROUND, ['gaussian', 'pseudovoigt'])
+        second_dict['peaks'][0]['parameters'][0].update(value=3, vary=False, min=1, max=5)
+        second_model, second_params = read_model(second_dict, flat=True)
+
+        self.assertIs(second_model, first_model)
+        self.assertIsNot(second_params, first_params)
+        self.assertEqual((model_cache.hits, model_cache.misses), (1, 1))
+
+        self.assertEqual(first_params['p0_amplitude'].value, 10)
+        self.assertTrue(first_params['p0_amplitude'].vary)
+        self.assertEqual(second_params['p0_amplitude'].value, 3)
+        self.assertFalse(second_params['p0_amplitude'].vary)
+        self.assertEqual((second_params['p0_amplitude'].min, second_params['p0_amplitude'].max), (1, 5))
+
+    def test_cached_parameters_equal_new_parameters(self):
+        input_dict = create_input(LINEAR_BACKGROUND, ['gaussian', 'lorentzian', 'pseudovoigt'])
+        _, new_params = read_model(input_dict)
+        _, cached_params = read_model(input_dict)
+
+        self.assertEqual(model_cache.hits, 1)
+        self.assertEqual(list(cached_params), list(new_params))
+        for name, param in new_params.items():
+            cached = cached_params[name]
+            self.assertAlmostEqual(cached.value, param.value)
+            self.assertEqual((cached.vary, cached.min, cached.max, cached.expr),
+                             (param.vary, param.min, param.max, param.expr))
@@ -0,0 +1,115 @@
+import unittest
+import json
+
+import numpy as np
+
+from peak_prophet_server.fitting import FitManager
+from peak_prophet_server.multiresolution import multiresolution_options, resolution_strides
+from peak_prophet_server.pattern import Pattern
+from peak_prophet_server.result_cache import result_cache
+from tests.helpers import create_request, peak_dict, sub_fit_progress
+
+
+class TestMultiresolution(unittest.TestCase):
+    def test_options(self):
+        self.assertIsNone(multiresolution_options(False))
+        self.assertEqual(multiresolution_options(True), {'factor': 4, 'points_per_fwhm': 8})
+        self.assertEqual(multiresolution_options({'factor': 2, 'points_per_fwhm': 5}),
+                         {'factor': 2, 'points_per_fwhm': 5})
+        for option in ({'factor': 1}, {'factor': 2.5}, {'points_per_fwhm': 0}):
+            with self.assertRaises(ValueError):
+                multiresolution_options(option)
+
+    def test_strides_keep_the_narrowest_peak_resolved(self):
+        pattern = Pattern(range(100001), range(100001))
+        peaks = [peak_dict(100, fwhm=1000), peak_dict(200, fwhm=-600)]
+
+        self.assertEqual(resolution_strides(pattern, peaks, 8), [64, 16, 4])
+        self.assertEqual(resolution_strides(pattern, peaks, 8, factor=2, points_per_fwhm=40), [8, 4, 2])
+        # at least 10 points per parameter
+        self.assertEqual(resolution_strides(pattern, peaks, 1000), [4])
+        self.assertEqual(resolution_strides(pattern, [peak_dict(100, fwhm=10)], 8), [])
+
+    def test_decimate(self):
+        pattern = Pattern(range(10), range(10), [1] * 10)
+        decimated = pattern.decimate(4)
+
+        self.assertEqual(decimated.x.tolist(), [0, 4, 8])
+        self.assertEqual(decimated.weights.tolist(), [1, 1, 1])
+
+
+class TestMultiresolutionFit(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        result_cache.clear()
+
+    async def fit_multiresolution(self, backend, engine='flat'):
+        request = create_request([4, 5, 15, 16.5, 25], n_points=30001)
+        request['pattern']['y'] = (np.array(request['pattern']['y']) +
+                                   np.random.default_rng(0).normal(0, 0.1, 30001)).tolist()
+        request['engine'] = engine
+        direct_response = await FitManager('TEST-SID').process_request(json.dumps(request))
+
+        request['multiresolution'] = True
+        fit_manager = FitManager('TEST-SID')
+        fit_manager.backend = backend
+        response = await fit_manager.process_request(json.dumps(request))
+
+        self.assertTrue(response['success'])
+        info = response['multiresolution']
+        self.assertEqual([stage['stride'] for stage in info['stages']], [16, 4])
+        self.assertEqual([stage['points'] for stage in info['stages']], [1876, 7501])
+        self.assertGreater(response['nfev'], info['nfev'])
+        self.assertAlmostEqual(response['chi2'], direct_response['chi2'], delta=1e-9 * direct_response['chi2'])
+        for direct_peak, peak in zip(direct_response['result']['peaks'], response['result']['peaks']):
+            for direct, parameter in zip(direct_peak['parameters'], peak['parameters']):
+                self.assertEqual(direct['name'], parameter['name'])
+                self.assertAlmostEqual(direct['value'], parameter['value'], delta=1e-3 * direct['error'])
+                self.assertAlmostEqual(direct['error'], parameter['error'], delta=1e-3 * direct['error'])
+
+    async def test_multiresolution_fit(self):
+        await self.fit_multiresolution('thread')
+
+    async def test_multiresolution_fit_with_lmfit_engine(self):
+        await self.fit_multiresolution('thread', 'lmfit')
+
+    async def test_multiresolution_fit_in_process(self):
+        await self.fit_multiresolution('process')
+
+    async def test_coarse_stages_report_progress(self):
+        request = create_request([4, 15], n_points=30001)
+        request['multiresolution'] = True
+        fit_manager = FitManager('TEST-SID')
+        run_fit = fit_manager.run_fit
+        progress = []
+
+        async def final_fit(*args):
+            # nobody asked for the progress during the coarse stages, nothing is calculated on the event loop
+            progress.append(fit_manager.current_progress)
+            progress.append(await sub_fit_progress(fit_manager))
+            return await run_fit(*args)
+
+        fit_manager.run_fit = final_fit
+        response = await fit_manager.process_request(json.dumps(request))
+
+        self.assertEqual(len(response['multiresolution']['stages']), 2)
+        self.assertIsNone(progress[0])
+        self.assertGreater(progress[1]['iter'], 0)
+        self.assertEqual(len(progress[1]['resid']), 30001)
+        self.assertLess(progress[1]['chi2'], 1e-6)
+        for peak, progress_peak in zip(response['result']['peaks'], progress[1]['result']['peaks']):
+            self.assertAlmostEqual(peak['parameters'][1]['value'], progress_peak['parameters'][1]['value'], delta=1e-6)
+
+    async def test_stopped_coarse_stage(self):
+        request = create_request([4, 15], n_points=30001)
+        request['multiresolution'] = True
+        fit_manager = FitManager('TEST-SID')
+        fit_manager.stop = True
+
+        response = await fit_manager.process_request(json.dumps(request))
+
+        self.assertEqual(len(response['multiresolution']['stages']), 1)
+        self.assertEqual(response['nfev'], response['multiresolution']['nfev'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+
+from peak_prophet_server.pattern import Pattern
+
+
+class TestPattern(unittest.TestCase):
+    def test_arrays_are_contiguous_float64(self):
+        pattern = Pattern([1, 2, 3], [4, 5, 6])
+        for array in (pattern.x, pattern.y):
+            self.assertEqual(array.dtype, np.float64)
+            self.assertTrue(array.flags['C_CONTIGUOUS'])
+        self.assertIsNone(pattern.weights)
+        self.assertEqual(len(pattern), 3)
+
+    def test_float64_arrays_are_not_copied(self):
+        x = np.linspace(0, 1, 11)
+        y = np.ones(11)
+        pattern = Pattern(x, y)
+        self.assertIs(pattern.x, x)
+        self.assertIs(pattern.y, y)
+
+    def test_invalid_patterns(self):
+        with self.assertRaises(ValueError):
+            Pattern([1, 2, 3], [1, 2])
+        with self.assertRaises(ValueError):
+            Pattern([1, 3, 2], [1, 2, 3])
+        with self.assertRaises(ValueError):
+            Pattern([1, 1, 2], [1, 2, 3])
+        with self.assertRaises(ValueError):
+            Pattern([1, 2, 3], [1, np.nan, 3])
+        with self.assertRaises(ValueError):
+            Pattern([1, 2, 3], [1, 2, 3], weights=[1, 2])
+        with self.assertRaises(ValueError):
+            Pattern([1, 2, 3], [1, 2, 3], weights=[1, -1, 1])
+        with self.assertRaises(ValueError):
+            Pattern([[1, 2]], [[1, 2]])
+
+    def test_uniform_grid(self):
+        pattern = Pattern(np.linspace(5, 15, 1001), np.zeros(1001))
+        self.assertTrue(pattern.is_uniform)
+        self.assertAlmostEqual(pattern.step, 0.01)
+
+    def test_non_uniform_grid(self):
+        x = np.linspace(0, 1, 101) ** 2
+        pattern = Pattern(x, np.zeros(101))
+        self.assertFalse(pattern.is_uniform)
+        self.assertAlmostEqual(pattern.step, 0.01)
+
+    def test_x_range_indices(self):
+        for x in (np.linspace(0, 10, 1001), np.linspace(0, np.sqrt(10), 1001) ** 2):
+            pattern = Pattern(x, np.zeros_like(x))
+            for x_min, x_max in ((2, 3), (2.005, 2.995), (-5, 1), (9.5, 20), (20, 30), (x[10], x[20])):
+                start, stop = pattern.x_range_indices(x_min, x_max)
+                expected = np.nonzero((x >= x_min) & (x <= x_max))[0]
+                if len(expected):
+                    self.assertEqual((start, stop), (expected[0], expected[-1] + 1))
+                else:
+                    self.assertEqual(start, stop)
+            self.assertIs(pattern.x_range_indices(2, 3), pattern.x_range_indices(2, 3))
+
+    def test_crop(self):
+        pattern = Pattern(np.arange(10.0), np.arange(10.0) * 2, np.ones(10))
+        cropped = pattern.crop(2.5, 5)
+        np.testing.assert_array_equal(cropped.x, [3, 4, 5])
+        np.testing.assert_array_equal(cropped.y, [6, 8, 10])
+        np.testing.assert_array_equal(cropped.weights, [1, 1, 1])
+        self.assertTrue(np.shares_memory(cropped.x, pattern.x))
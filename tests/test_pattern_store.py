@@ -0,0 +1,160 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from peak_prophet_server.data_reader import read_pattern
+from peak_prophet_server.pattern import Pattern
+from peak_prophet_server import pattern_store
+from peak_prophet_server.pattern_store import PatternStore
+
+
+def create_pattern(n_points, offset=0):
+    x = np.linspace(0, 10, n_points)
+    return Pattern(x, np.sin(x) + offset)
+
+
+class TestPatternStore(unittest.TestCase):
+    def test_add_and_get(self):
+        store = PatternStore()
+        pattern = create_pattern(100)
+        pattern_id = store.add(pattern)
+
+        self.assertEqual(pattern_id, pattern.content_hash)
+        self.assertIn(pattern_id, store)
+        self.assertIs(store.get(pattern_id), pattern)
+        self.assertIs(read_pattern({'id': pattern_id}, store), pattern)
+
+    def test_same_data_is_stored_once(self):
+        store = PatternStore()
+        first_id = store.add(create_pattern(100))
+        second_id = store.add(create_pattern(100))
+        self.assertEqual(first_id, second_id)
+        self.assertEqual(len(store), 1)
+        self.assertNotEqual(store.add(create_pattern(100, offset=1)), first_id)
+
+    def test_unknown_id(self):
+        with self.assertRaises(ValueError):
+            PatternStore().get('unknown')
+        with self.assertRaises(ValueError):
+            read_pattern({'id': 'unknown'})
+
+    def test_least_recently_used_patterns_are_evicted(self):
+        pattern_bytes = create_pattern(100).nbytes
+        store = PatternStore(max_bytes=3 * pattern_bytes)
+        ids = [store.add(create_pattern(100, offset=i)) for i in range(3)]
+        store.get(ids[0])
+        new_id = store.add(create_pattern(100, offset=3))
+
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.nbytes, 3 * pattern_bytes)
+        self.assertNotIn(ids[1], store)
+        for pattern_id in (ids[0], ids[2], new_id):
+            self.assertIn(pattern_id, store)
+
+    def test_too_large_pattern(self):
+        store = PatternStore(max_bytes=100)
+        with self.assertRaises(ValueError):
+            store.add(create_pattern(100))
+        with self.assertRaises(ValueError):
+            store.begin_upload(100)
+
+    def test_shared_store(self):
+        shared = PatternStore()
+        first_session = PatternStore(shared=shared)
+        second_session = PatternStore(shared=shared)
+
+        private_id = first_session.add(create_pattern(100))
+        shared_id = first_session.add(create_pattern(100, offset=1), shared=True)
+
+        self.assertNotIn(private_id, second_session)
+        self.assertIs(second_session.get(shared_id), shared.get(shared_id))
+
+    def test_chunked_upload(self):
+        store = PatternStore()
+        pattern = create_pattern(1000)
+        weights = np.linspace(1, 2, 1000)
+        upload_id = store.begin_upload(1000, dtype='float64', weights=True)
+
+        for offset in (500, 0):
+            chunk = slice(offset, offset + 500)
+            received = store.upload_chunk(upload_id, offset, pattern.x[chunk].tobytes(), pattern.y[chunk].tobytes(),
+                                          weights[chunk].tobytes())
+        self.assertEqual(received, 1000)
+
+        expected = Pattern(pattern.x, pattern.y, weights)
+        pattern_id = store.finish_upload(upload_id, expected_hash=expected.content_hash)
+        self.assertEqual(pattern_id, expected.content_hash)
+        np.testing.assert_array_equal(store.get(pattern_id).weights, weights)
+        self.assertEqual(store.uploads, {})
+
+    def test_invalid_chunked_uploads(self):
+        store = PatternStore()
+        upload_id = store.begin_upload(10, dtype='float32')
+        chunk = np.arange(6, dtype='<f4').tobytes()
+        with self.assertRaises(ValueError):
+            store.upload_chunk(upload_id, 5, chunk, chunk)
+        store.upload_chunk(upload_id, 0, chunk, chunk)
+        with self.assertRaises(ValueError):
+            store.finish_upload(upload_id)
+        with self.assertRaises(ValueError):
+            store.upload_chunk('unknown', 0, chunk, chunk)
+        # the incomplete upload can still be finished
+        rest = np.arange(6, 10, dtype='<f4').tobytes()
+        store.upload_chunk(upload_id, 6, rest, rest)
+        self.assertIn(store.finish_upload(upload_id), store)
+
+        upload_id = store.begin_upload(6, dtype='float32')
+        store.upload_chunk(upload_id, 0, chunk, chunk)
+        with self.assertRaises(ValueError):
+            store.finish_upload(upload_id, expected_hash='wrong')
+
+    def test_pending_uploads_use_memory(self):
+        pattern_bytes = create_pattern(100).nbytes
+        store = PatternStore(max_bytes=3 * pattern_bytes)
+        ids = [store.add(create_pattern(100, offset=i)) for i in range(3)]
+
+        upload_id = store.begin_upload(200)
+        self.assertEqual(store.nbytes, 3 * pattern_bytes)
+        self.assertEqual([pattern_id in store for pattern_id in ids], [False, False, True])
+        with self.assertRaises(ValueError):
+            store.begin_upload(200)
+        with self.assertRaises(ValueError):
+            store.add(create_pattern(200))
+
+        store.cancel_upload(upload_id)
+        self.assertEqual(store.nbytes, pattern_bytes)
+        store.begin_upload(100)
+        store.close()
+        self.assertEqual((store.nbytes, store.uploads, store.pending), (pattern_bytes, {}, set()))
+
+    def test_shared_upload_uses_shared_memory(self):
+        pattern = create_pattern(100)
+        shared = PatternStore(max_bytes=2 * pattern.nbytes)
+        store = PatternStore(max_bytes=pattern.nbytes // 2, shared=shared)
+
+        upload_id = store.begin_upload(100, shared=True)
+        self.assertEqual((store.nbytes, shared.nbytes), (0, pattern.nbytes))
+        with self.assertRaises(ValueError):
+            store.begin_upload(300, shared=True)
+        store.upload_chunk(upload_id, 0, pattern.x.tobytes(), pattern.y.tobytes())
+        pattern_id = store.finish_upload(upload_id)
+
+        self.assertIn(pattern_id, shared)
+        self.assertEqual((store.nbytes, shared.nbytes, shared.pending), (0, pattern.nbytes, set()))
+
+    def test_abandoned_uploads_expire(self):
+        shared = PatternStore()
+        store = PatternStore(shared=shared)
+        upload_id = store.begin_upload(100)
+        shared_upload_id = store.begin_upload(100, shared=True)
+
+        with mock.patch.object(pattern_store, 'UPLOAD_TIMEOUT', -1):
+            with self.assertRaises(ValueError):
+                store.upload_chunk(upload_id, 0, b'', b'')
+            shared.add(create_pattern(100))
+
+        self.assertEqual(store.uploads, {})
+        self.assertEqual((store.nbytes, shared.nbytes), (0, create_pattern(100).nbytes))
+        with self.assertRaises(ValueError):
+            store.finish_upload(shared_upload_id)
@@ -0,0 +1,111 @@
+import unittest
+import json
+
+import numpy as np
+from lmfit.lineshapes import gaussian, lorentzian
+
+from peak_prophet_server.data_reader import read_peaks, read_background, convert_gaussian_fwhm_to_sigma
+from peak_prophet_server.fitting import FitManager
+from peak_prophet_server.pattern import Pattern
+from peak_prophet_server.peak_detection import detect_peaks, estimate_background, estimate_noise, \
+    prominence_candidates, local_maxima, moving_average
+
+from scipy.signal import peak_prominences
+
+CENTERS = [12, 25, 31, 47]
+AMPLITUDES = [10, 20, 5, 15]
+
+
+def create_pattern(noise=0.05, n_points=6001):
+    rng = np.random.default_rng(0)
+    x = np.linspace(5, 55, n_points)
+    y = 3 + 0.05 * x + rng.normal(0, noise, n_points)
+    for center, amplitude in zip(CENTERS, AMPLITUDES):
+        y += gaussian(x, amplitude, center, convert_gaussian_fwhm_to_sigma(0.6))
+    return Pattern(x, y)
+
+
+class TestPeakDetection(unittest.TestCase):
+    def test_detect_gaussian_peaks(self):
+        background, peaks = detect_peaks(create_pattern())
+
+        self.assertEqual(len(peaks), 4)
+        for peak, center, amplitude in zip(peaks, CENTERS, AMPLITUDES):
+            values = {p['name']: p['value'] for p in peak['parameters']}
+            self.assertAlmostEqual(values['center'], center, delta=0.02)
+            self.assertAlmostEqual(values['fwhm'], 0.6, delta=0.05)
+            self.assertAlmostEqual(values['amplitude'], amplitude, delta=0.1 * amplitude)
+            center_parameter = peak['parameters'][1]
+            self.assertLess(center_parameter['min'], center)
+            self.assertGreater(center_parameter['max'], center)
+
+        values = {p['name']: p['value'] for p in background['parameters']}
+        self.assertAlmostEqual(values['intercept'], 3, delta=0.05)
+        self.assertAlmostEqual(values['slope'], 0.05, delta=0.002)
+
+    def test_result_can_be_read(self):
+        for peak_type in ('gaussian', 'lorentzian', 'pseudovoigt'):
+            background, peaks = detect_peaks(create_pattern(), peak_type=peak_type, background_type='quadratic')
+            models, parameters = read_peaks(peaks)
+            self.assertEqual(len(models), 4)
+            read_background(background)
+        background, _ = detect_peaks(create_pattern(), background_type='polynomial', degree=3)
+        self.assertEqual(background['degree'], 3)
+        self.assertEqual(len(read_background(background)[1]), 4)
+
+    def test_lorentzian_amplitude(self):
+        x = np.linspace(0, 20, 4001)
+        pattern = Pattern(x, lorentzian(x, 7, 10, 0.25))
+        _, peaks = detect_peaks(pattern, peak_type='lorentzian')
+        self.assertEqual(len(peaks), 1)
+        self.assertAlmostEqual(peaks[0]['parameters'][0]['value'], 7, delta=0.7)
+        self.assertAlmostEqual(peaks[0]['parameters'][2]['value'], 0.5, delta=0.02)
+
+    def test_max_peaks_and_min_prominence(self):
+        _, peaks = detect_peaks(create_pattern(), max_peaks=2)
+        np.testing.assert_allclose([peak['parameters'][1]['value'] for peak in peaks], [25, 47], atol=0.02)
+
+        # the peak heights are 15.7, 31.3, 7.8 and 23.5
+        _, peaks = detect_peaks(create_pattern(), min_prominence=10)
+        self.assertEqual(len(peaks), 3)
+
+    def test_noise_is_not_detected(self):
+        rng = np.random.default_rng(1)
+        pattern = Pattern(np.arange(100000.0), rng.normal(10, 1, 100000))
+        self.assertEqual(detect_peaks(pattern)[1], [])
+
+    def test_estimate_background_and_noise(self):
+        pattern = create_pattern(noise=0.2)
+        self.assertAlmostEqual(estimate_noise(pattern.y), 0.2, delta=0.02)
+        background = estimate_background(pattern, 'linear')
+        self.assertAlmostEqual(background(30), 3 + 0.05 * 30, delta=0.05)
+
+    def test_prominence_candidates_keep_all_prominent_maxima(self):
+        rng = np.random.default_rng(2)
+        y = moving_average(rng.normal(0, 1, 20000), 3) + np.sin(np.linspace(0, 30, 20000)) * 3
+        maxima = local_maxima(y)
+        prominences = peak_prominences(y, maxima)[0]
+        candidates = prominence_candidates(y, maxima, 1.0)
+        self.assertLess(len(candidates), len(maxima))
+        self.assertTrue(set(maxima[prominences >= 1.0]) <= set(candidates))
+
+    def test_invalid_input(self):
+        with self.assertRaises(ValueError):
+            detect_peaks(create_pattern(), peak_type='voigt')
+        with self.assertRaises(ValueError):
+            detect_peaks(create_pattern(), background_type='polynomial')
+
+
+class TestFitDetectedPeaks(unittest.IsolatedAsyncioTestCase):
+    async def test_fit_from_detected_peaks(self):
+        pattern = create_pattern()
+        background, peaks = detect_peaks(pattern)
+        request = {'pattern': {'x': pattern.x.tolist(), 'y': pattern.y.tolist()}, 'background': background,
+                   'peaks': peaks}
+        response = await FitManager('TEST-SID').process_request(json.dumps(request))
+
+        self.assertTrue(response['success'])
+        self.assertLess(response['nfev'], 20)
+        for peak, center, amplitude in zip(response['result']['peaks'], CENTERS, AMPLITUDES):
+            self.assertAlmostEqual(peak['parameters'][0]['value'], amplitude, delta=0.01 * amplitude)
+            self.assertAlmostEqual(peak['parameters'][1]['value'], center, delta=1e-3)
@@ -0,0 +1,108 @@
+import unittest
+import asyncio
+import json
+import os
+import tempfile
+from unittest import mock
+
+from peak_prophet_server.jobs import JobManager, DONE
+from peak_prophet_server.profiling import ProfileStore, FitProfile, profile_store, replay
+from tests.test_jobs import create_request
+
+
+class TestProfiling(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(profile_store, 'directory', self.directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    async def test_request_profile(self):
+        request = json.loads(create_request(n_peaks=2))
+        request['profile'] = True
+        jobs = JobManager('TEST-SID')
+        job = jobs.submit(json.dumps(request))
+
+        response = await jobs.wait(job)
+
+        self.assertEqual(job.state, DONE)
+        summary = response['profile']
+        self.assertEqual(summary['job_id'], job.id)
+        self.assertEqual(summary['nfev'], response['nfev'])
+        self.assertGreaterEqual(summary['residual_calls'], response['nfev'])
+        self.assertEqual(summary['iter_cb_calls'], summary['residual_calls'])
+        self.assertEqual(summary['peaks'], 2)
+        for phase in ('parse', 'read_pattern', 'build_model', 'fit', 'output', 'request'):
+            self.assertIn(phase, summary['phases'])
+        self.assertTrue(summary['top'])
+        self.assertEqual(profile_store.load(job.id), summary)
+        self.assertEqual(profile_store.load(job.id, 'TEST-SID'), summary)
+        with self.assertRaises(ValueError):
+            profile_store.load(job.id, 'OTHER-SID')
+        for name in ('request.json', 'profile.prof', 'summary.json'):
+            self.assertTrue(os.path.exists(os.path.join(profile_store.path(job.id), name)))
+
+    async def test_unprofiled_request(self):
+        jobs = JobManager('TEST-SID')
+        job = jobs.submit(create_request())
+
+        response = await jobs.wait(job)
+
+        self.assertNotIn('profile', response)
+        with self.assertRaises(ValueError):
+            profile_store.load(job.id)
+
+    async def test_session_profiling(self):
+        jobs = JobManager('TEST-SID')
+        jobs.profiling = True
+        responses = await asyncio.gather(*(jobs.wait(jobs.submit(create_request())) for _ in range(2)))
+
+        self.assertEqual(len({response['profile']['job_id'] for response in responses}), 2)
+
+    async def test_replay(self):
+        jobs = JobManager('TEST-SID')
+        jobs.profiling = True
+        job = jobs.submit(create_request())
+        response = await jobs.wait(job)
+
+        profile, replayed = await replay(profile_store.path(job.id))
+
+        self.assertEqual(replayed['nfev'], response['nfev'])
+        self.assertAlmostEqual(replayed['chi2'], response['chi2'])
+        self.assertEqual(profile.summary(response=replayed)['nfev'], response['nfev'])
+
+    async def test_series_profile(self):
+        request = json.loads(create_request())
+        request['patterns'] = [request.pop('pattern')] * 3
+        jobs = JobManager('TEST-SID')
+        jobs.profiling = True
+        job = jobs.submit(json.dumps(request), kind='series')
+        responses = await jobs.wait(job)
+
+        summary = profile_store.load(job.id)
+        self.assertEqual(summary['kind'], 'series')
+        self.assertEqual(summary['nfev'], sum(response['nfev'] for response in responses))
+        self.assertEqual(summary['points'], 3 * 1001)
+        self.assertIn('sub_fit', summary['phases'])
+
+
+class TestProfileStore(unittest.TestCase):
+    def test_oldest_profiles_are_removed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = ProfileStore(directory, max_profiles=2)
+            for i in range(3):
+                store.save(FitProfile(f'job{i}'))
+                os.utime(store.path(f'job{i}'), (i, i))
+
+            self.assertEqual(sorted(os.listdir(directory)), ['job1', 'job2'])
+
+    def test_invalid_job_id(self):
+        store = ProfileStore(tempfile.gettempdir())
+        for job_id in ('', '../job', '.hidden'):
+            with self.assertRaises(ValueError):
+                store.load(job_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
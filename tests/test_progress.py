@@ -0,0 +1,214 @@
+import unittest
+import asyncio
+
+import numpy as np
+from socketio.exceptions import TimeoutError
+
+from peak_prophet_server.data_reader import read_background
+from peak_prophet_server.fitting import FitManager
+from peak_prophet_server.progress import ProgressPublisher, ProgressEncoder, resid_envelope
+
+
+class FakeFitManager:
+    def __init__(self):
+        self.progress_version = 0
+        self.current_progress = None
+
+    def iterate(self):
+        self.progress_version += 1
+        self.current_progress = {'iter': self.progress_version}
+
+
+class FakeServer:
+    def __init__(self, call_delay=0, timeout=False):
+        self.events = []
+        self.call_delay = call_delay
+        self.timeout = timeout
+
+    async def emit(self, event, data, to=None):
+        self.events.append((event, data, to))
+
+    async def call(self, event, data, to=None, timeout=None):
+        await asyncio.sleep(self.call_delay)
+        if self.timeout:
+            raise TimeoutError()
+        self.events.append((event, data, to))
+
+
+class TestProgressPublisher(unittest.IsolatedAsyncioTestCase):
+    async def test_only_changed_progress_is_published(self):
+        server = FakeServer()
+        fit_manager = FakeFitManager()
+        publisher = ProgressPublisher(server, 'sid', fit_manager)
+
+        self.assertFalse(await publisher.publish())
+        fit_manager.iterate()
+        fit_manager.iterate()
+        self.assertTrue(await publisher.publish())
+        self.assertFalse(await publisher.publish())
+
+        self.assertEqual(server.events, [('progress', {'iter': 2}, 'sid')])
+
+    async def test_rate_is_limited(self):
+        server = FakeServer()
+        fit_manager = FakeFitManager()
+        publisher = ProgressPublisher(server, 'sid', fit_manager, max_rate=10)
+        publisher.start()
+        for _ in range(50):
+            fit_manager.iterate()
+            await asyncio.sleep(0.01)
+        await publisher.stop()
+
+        self.assertGreater(len(server.events), 1)
+        self.assertLessEqual(len(server.events), 6)
+        self.assertIsNone(publisher.task)
+
+    async def test_slow_client_gets_latest_snapshot(self):
+        server = FakeServer(call_delay=0.2)
+        fit_manager = FakeFitManager()
+        publisher = ProgressPublisher(server, 'sid', fit_manager, max_rate=50, ack=True)
+        publisher.start()
+        for _ in range(30):
+            fit_manager.iterate()
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.5)
+        await publisher.stop()
+
+        iterations = [data['iter'] for _, data, _ in server.events]
+        self.assertLessEqual(len(iterations), 3)
+        self.assertEqual(iterations[-1], 30)
+
+    async def test_timed_out_acknowledgement(self):
+        server = FakeServer(timeout=True)
+        fit_manager = FakeFitManager()
+        publisher = ProgressPublisher(server, 'sid', fit_manager, ack=True)
+        fit_manager.iterate()
+        self.assertTrue(await publisher.publish())
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            ProgressPublisher(FakeServer(), 'sid', FakeFitManager(), max_rate=0)
+
+    async def test_compact_progress_is_acknowledged(self):
+        server = FakeServer()
+        fit_manager = CompactFitManager()
+        encoder = ProgressEncoder()
+        publisher = ProgressPublisher(server, 'sid', fit_manager, ack=True, encoder=encoder)
+
+        fit_manager.iterate()
+        self.assertTrue(await publisher.publish())
+        fit_manager.iterate()
+        self.assertTrue(await publisher.publish())
+
+        first, second = [data for _, data, _ in server.events]
+        self.assertTrue(first['full'])
+        self.assertFalse(second['full'])
+
+
+class CompactFitManager(FakeFitManager):
+    def compact_progress(self, encoder):
+        return encoder.encode('job', FakeEncoderFitManager([1.0, 2.0, 3.0], self.progress_version))
+
+
+class FakeEncoderFitManager:
+    def __init__(self, values, iteration=1, n_points=10):
+        self.pattern = np.zeros(n_points)
+        self.progress_snapshot = (iteration, 4.5, np.array(values, dtype=float), np.arange(n_points, dtype=float))
+
+    def create_progress_result(self, values):
+        return {
+            'background': {'type': 'linear', 'parameters': [{'name': 'slope', 'value': values[0]}]},
+            'peaks': [{'type': 'gaussian', 'parameters': [{'name': 'center', 'value': values[1]},
+                                                          {'name': 'fwhm', 'value': values[2]}]}],
+        }
+
+
+class TestProgressEncoder(unittest.TestCase):
+    def test_full_until_acknowledged(self):
+        encoder = ProgressEncoder()
+        first = encoder.encode('job', FakeEncoderFitManager([1, 2, 3]))
+        second = encoder.encode('job', FakeEncoderFitManager([1, 2, 4]))
+
+        for message in (first, second):
+            self.assertTrue(message['full'])
+        self.assertEqual(first['background'], {'slope': 1})
+        self.assertEqual(first['peaks'], {'0': {'center': 2, 'fwhm': 3}})
+        self.assertEqual(second['seq'], first['seq'] + 1)
+        self.assertEqual(first['red_chi2'], 0.5)
+
+    def test_deltas_since_acknowledged(self):
+        encoder = ProgressEncoder()
+        first = encoder.encode('job', FakeEncoderFitManager([1, 2, 3]))
+        encoder.acknowledge(first['seq'])
+
+        message = encoder.encode('job', FakeEncoderFitManager([1, 2, 4]))
+        self.assertFalse(message['full'])
+        self.assertEqual(message['background'], {})
+        self.assertEqual(message['peaks'], {'0': {'fwhm': 4}})
+
+        # the fwhm went back to the acknowledged value, but the client has the one of the last message
+        message = encoder.encode('job', FakeEncoderFitManager([1, 2, 3]))
+        self.assertEqual(message['peaks'], {'0': {'fwhm': 3}})
+
+        encoder.acknowledge(message['seq'])
+        message = encoder.encode('job', FakeEncoderFitManager([1, 2, 3]))
+        self.assertEqual(message['peaks'], {})
+
+    def test_new_job_is_full(self):
+        encoder = ProgressEncoder()
+        encoder.acknowledge(encoder.encode('job', FakeEncoderFitManager([1, 2, 3]))['seq'])
+
+        message = encoder.encode('other job', FakeEncoderFitManager([1, 2, 3]))
+        self.assertTrue(message['full'])
+        self.assertEqual(message['background'], {'slope': 1})
+
+    def test_no_snapshot(self):
+        fit_manager = FakeEncoderFitManager([1, 2, 3])
+        fit_manager.progress_snapshot = None
+        self.assertIsNone(ProgressEncoder().encode('job', fit_manager))
+
+    def test_resid_formats(self):
+        message = ProgressEncoder(width=3).encode('job', FakeEncoderFitManager([1, 2, 3]))
+        self.assertEqual(message['resid'], {'index': [0, 3, 6], 'min': [0, 3, 6], 'max': [2, 5, 9]})
+
+        message = ProgressEncoder(resid='float32').encode('job', FakeEncoderFitManager([1, 2, 3]))
+        np.testing.assert_array_equal(np.frombuffer(message['resid'], '<f4'), np.arange(10))
+
+        with self.assertRaises(ValueError):
+            ProgressEncoder(width=0)
+        with self.assertRaises(ValueError):
+            ProgressEncoder(resid='float16')
+
+    def test_resid_envelope(self):
+        resid = np.sin(np.linspace(0, 20, 200_000))
+        envelope = resid_envelope(resid, 1000)
+
+        self.assertEqual(len(envelope['min']), 1000)
+        self.assertAlmostEqual(min(envelope['min']), resid.min())
+        self.assertAlmostEqual(max(envelope['max']), resid.max())
+        self.assertEqual(resid_envelope(resid[:5], 1000)['min'], resid[:5].tolist())
+
+    def test_fit_manager_progress(self):
+        fit_manager = FitManager('TEST-SID')
+        data_dict, params = create_progress_fit()
+        fit_manager.data_dict = data_dict
+        fit_manager.params = params
+        fit_manager.pattern = np.zeros(100)
+        fit_manager.progress_names = list(params)
+        fit_manager.iter_cb(params, 1, np.ones(100))
+
+        message = ProgressEncoder(width=10).encode('job', fit_manager)
+        full = fit_manager.current_progress
+
+        self.assertEqual(message['chi2'], full['chi2'])
+        self.assertEqual(message['resid'], {'index': list(range(0, 100, 10)), 'min': [1.0] * 10, 'max': [1.0] * 10})
+        self.assertEqual(message['background'], {p['name']: p['value'] for p in
+                                                 full['result']['background']['parameters']})
+
+
+def create_progress_fit():
+    data_dict = {'background': {'type': 'linear', 'parameters': [{'name': 'intercept', 'value': 1},
+                                                                 {'name': 'slope', 'value': 2}]},
+                 'peaks': []}
+    _, params = read_background(data_dict['background'])
+    return data_dict, params
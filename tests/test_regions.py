@@ -0,0 +1,100 @@
+import unittest
+import json
+
+from peak_prophet_server.fitting import FitManager
+from peak_prophet_server.regions import find_regions, coupled_peaks, region_dict, region_options
+from peak_prophet_server.result_cache import result_cache
+from tests.helpers import create_request, peak_dict, sub_fit_progress
+
+
+class TestRegions(unittest.TestCase):
+    def test_options(self):
+        self.assertIsNone(region_options(False))
+        self.assertEqual(region_options(True), {'radius': 5, 'refine': True})
+        self.assertEqual(region_options({'radius': 2, 'refine': False}), {'radius': 2, 'refine': False})
+        with self.assertRaises(ValueError):
+            region_options({'radius': -1})
+
+    def test_find_regions(self):
+        peaks = [peak_dict(center, fwhm=1) for center in [20, 3, 5, 30, 10]]
+        regions = find_regions(peaks, radius=1.5)
+
+        self.assertEqual([region.peaks for region in regions], [[1, 2], [4], [0], [3]])
+        self.assertEqual((regions[0].x_min, regions[0].x_max), (1.5, 6.5))
+        self.assertEqual(find_regions([]), [])
+
+    def test_coupled_peaks(self):
+        peaks = [peak_dict(center, fwhm=1) for center in [3, 5, 10, 20]]
+        regions = find_regions(peaks, radius=1.5)
+        self.assertEqual(len(regions), 3)
+        # the region of peak 2 is 3 fwhm from the first region, within twice the radius
+        self.assertEqual(coupled_peaks(peaks, regions, radius=1.5), [0, 1, 2])
+
+    def test_region_dict_has_local_linear_background(self):
+        data_dict = create_request([5, 6, 20])
+        data_dict['background'] = {'type': 'quadratic',
+                                   'parameters': [{'name': 'a', 'value': 1}, {'name': 'b', 'value': 0},
+                                                  {'name': 'c', 'value': 2}]}
+        region = find_regions(data_dict['peaks'], radius=2)[0]
+        sub_dict = region_dict(data_dict, region)
+
+        self.assertEqual(sub_dict['peaks'], data_dict['peaks'][:2])
+        values = {p['name']: p['value'] for p in sub_dict['background']['parameters']}
+        for x in (region.x_min, region.x_max):
+            self.assertAlmostEqual(values['intercept'] + values['slope'] * x, x ** 2 + 2)
+
+
+class TestRegionFit(unittest.IsolatedAsyncioTestCase):
+    async def fit_regions(self, backend, regions):
+        request = create_request([4, 5, 15, 16.5, 25])
+        direct_response = await FitManager('TEST-SID').process_request(json.dumps(request))
+
+        request['regions'] = regions
+        fit_manager = FitManager('TEST-SID')
+        fit_manager.backend = backend
+        region_response = await fit_manager.process_request(json.dumps(request))
+
+        self.assertTrue(region_response['success'])
+        self.assertEqual(region_response['regions']['count'], 3)
+        self.assertGreater(region_response['nfev'], region_response['regions']['nfev'])
+        for direct_peak, region_peak in zip(direct_response['result']['peaks'], region_response['result']['peaks']):
+            for direct, region in zip(direct_peak['parameters'], region_peak['parameters']):
+                self.assertEqual(direct['name'], region['name'])
+                self.assertAlmostEqual(direct['value'], region['value'], delta=1e-6)
+                self.assertIsNotNone(region['error'])
+        return region_response
+
+    async def test_region_fit(self):
+        response = await self.fit_regions('thread', {'radius': 3})
+        self.assertEqual(response['regions']['refined_peaks'], 0)
+
+    async def test_region_fit_with_joint_refinement(self):
+        response = await self.fit_regions('thread', {'radius': 3, 'refine': True})
+        self.assertEqual(response['regions']['refined_peaks'], 0)
+        response = await self.fit_regions('thread', True)
+        self.assertEqual(response['regions']['refined_peaks'], 5)
+
+    async def test_region_fit_in_process(self):
+        await self.fit_regions('process', {'radius': 3})
+
+    async def test_region_fits_report_progress(self):
+        request = create_request([4, 5, 15, 16.5, 25])
+        request['regions'] = {'radius': 3}
+        fit_manager = FitManager('TEST-SID')
+        run_fit = fit_manager.run_fit
+        progress = []
+
+        async def final_fit(*args):
+            progress.append(await sub_fit_progress(fit_manager))
+            return await run_fit(*args)
+
+        fit_manager.run_fit = final_fit
+        result_cache.clear()
+        response = await fit_manager.process_request(json.dumps(request))
+
+        self.assertGreater(progress[0]['iter'], 0)
+        self.assertEqual(len(progress[0]['resid']), 3001)
+        for peak, progress_peak in zip(response['result']['peaks'], progress[0]['result']['peaks']):
+            self.assertAlmostEqual(peak['parameters'][1]['value'], progress_peak['parameters'][1]['value'], delta=1e-6)
+        # the global background keeps its start values until the joint fit
+        self.assertEqual(progress[0]['result']['background']['parameters'][0]['value'], 1)
@@ -0,0 +1,211 @@
+import unittest
+import asyncio
+import json
+
+import numpy as np
+
+from peak_prophet_server.jobs import JobManager, RUNNING, CANCELLED
+from peak_prophet_server.pattern import Pattern
+from peak_prophet_server.result_cache import ResultCache, request_key, result_cache, response_size
+from peak_prophet_server.scheduler import FitScheduler
+from peak_prophet_server.schema import decode_request
+from tests.test_jobs import create_request, wait_for_progress
+
+
+def create_response(value=1.0):
+    return {'success': True, 'nfev': 5, 'result': {'peaks': [{'parameters': [{'name': 'center', 'value': value}]}]}}
+
+
+class TestRequestKey(unittest.TestCase):
+    def key(self, request):
+        data_dict = decode_request(request)
+        return request_key(data_dict, Pattern(data_dict['pattern']['x'], data_dict['pattern']['y']), 'flat')
+
+    def test_binary_request_has_same_key(self):
+        request_dict = json.loads(create_request())
+        pattern = request_dict.pop('pattern')
+        binary = {'request': json.dumps(request_dict), 'x': np.array(pattern['x']).tobytes(),
+                  'y': np.array(pattern['y']).tobytes()}
+
+        self.assertEqual(self.key(create_request()), self.key(binary))
+
+    def test_key_changes_with_model(self):
+        request_dict = json.loads(create_request())
+        request_dict['profile'] = True
+        self.assertEqual(self.key(create_request()), self.key(json.dumps(request_dict)))
+
+        request_dict['peaks'][0]['parameters'][1]['value'] += 1e-9
+        self.assertNotEqual(self.key(create_request()), self.key(json.dumps(request_dict)))
+
+        data_dict = decode_request(create_request())
+        pattern = Pattern(data_dict['pattern']['x'], data_dict['pattern']['y'])
+        self.assertNotEqual(request_key(data_dict, pattern, 'flat'), request_key(data_dict, pattern, 'lmfit'))
+
+
+class TestResultCache(unittest.IsolatedAsyncioTestCase):
+    async def test_cached_response_is_a_copy(self):
+        cache = ResultCache()
+        fits = []
+
+        async def fit():
+            fits.append(1)
+            return create_response(), True
+
+        response = await cache.get('key', fit)
+        response['result']['peaks'][0]['parameters'][0]['value'] = 2
+        cached = await cache.get('key', fit)
+
+        self.assertEqual(len(fits), 1)
+        self.assertNotIn('cached', response)
+        self.assertTrue(cached['cached'])
+        self.assertEqual(cached['result']['peaks'][0]['parameters'][0]['value'], 1.0)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    async def test_identical_requests_share_one_fit(self):
+        cache = ResultCache()
+        fits = []
+
+        async def fit():
+            fits.append(1)
+            await asyncio.sleep(0.05)
+            return create_response(), True
+
+        responses = await asyncio.gather(*(cache.get('key', fit) for _ in range(3)))
+
+        self.assertEqual(len(fits), 1)
+        self.assertEqual(sum(response.get('cached', False) for response in responses), 2)
+        self.assertEqual(cache.stats()['shared'], 2)
+
+    async def test_stopped_fit_is_not_shared(self):
+        cache = ResultCache()
+        fits = []
+
+        async def fit():
+            fits.append(1)
+            await asyncio.sleep(0.05)
+            return create_response(len(fits)), len(fits) > 1
+
+        first, second = await asyncio.gather(cache.get('key', fit), cache.get('key', fit))
+
+        self.assertEqual(len(fits), 2)
+        self.assertEqual(first['result']['peaks'][0]['parameters'][0]['value'], 1)
+        self.assertEqual(second['result']['peaks'][0]['parameters'][0]['value'], 2)
+        self.assertEqual(len(cache), 1)
+
+    async def test_error_is_shared(self):
+        cache = ResultCache()
+
+        async def fit():
+            await asyncio.sleep(0.05)
+            raise ValueError('fit failed')
+
+        results = await asyncio.gather(cache.get('key', fit), cache.get('key', fit), return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.in_flight, {})
+
+    async def test_cancelled_fit_is_not_shared(self):
+        cache = ResultCache()
+
+        async def fit():
+            await asyncio.sleep(0.05)
+            return create_response(), True
+
+        first = asyncio.create_task(cache.get('key', fit))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get('key', fit))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        self.assertEqual((await second)['success'], True)
+        self.assertTrue(first.cancelled())
+
+    async def test_stopped_request_stops_waiting(self):
+        cache = ResultCache()
+        finished = asyncio.Event()
+
+        async def fit():
+            await finished.wait()
+            return create_response(), True
+
+        leader = asyncio.create_task(cache.get('key', fit))
+        await asyncio.sleep(0)
+        stopped = asyncio.Event()
+        follower = asyncio.create_task(cache.get('key', fit, stopped))
+        await asyncio.sleep(0)
+        stopped.set()
+
+        self.assertIsNone(await asyncio.wait_for(follower, 1))
+        self.assertFalse(leader.done())
+        finished.set()
+        self.assertEqual((await leader)['success'], True)
+        self.assertEqual(cache.stats()['shared'], 0)
+
+    async def test_memory_limit(self):
+        async def fit():
+            return create_response(), True
+
+        size = response_size(create_response())
+        cache = ResultCache(max_bytes=2 * size)
+        for key in ('a', 'b', 'a', 'c'):
+            await cache.get(key, fit)
+
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertEqual(cache.nbytes, 2 * size)
+
+        disabled = ResultCache(max_bytes=0)
+        await disabled.get('a', fit)
+        self.assertEqual(len(disabled), 0)
+
+
+class TestJobResultCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        result_cache.clear()
+
+    async def test_identical_jobs(self):
+        jobs = JobManager('TEST-SID')
+        first, second = [jobs.submit(create_request()) for _ in range(2)]
+        responses = await asyncio.gather(jobs.wait(first), jobs.wait(second))
+        third = await jobs.wait(jobs.submit(create_request()))
+
+        self.assertEqual(result_cache.misses, 1)
+        self.assertEqual(responses[0]['chi2'], responses[1]['chi2'])
+        self.assertTrue(third['cached'])
+        self.assertEqual(third['job_id'], jobs.latest.id)
+        self.assertNotEqual(third['job_id'], responses[0]['job_id'])
+
+    async def test_cancel_waiting_job(self):
+        jobs = JobManager('TEST-SID', fit_scheduler=FitScheduler(max_running=2))
+        leader = jobs.submit(create_request(30, 30000))
+        await wait_for_progress(leader)
+        follower = jobs.submit(create_request(30, 30000))
+        await asyncio.sleep(0.05)
+        self.assertEqual(follower.state, RUNNING)
+        running = jobs.scheduler.n_running
+
+        jobs.cancel(follower.id)
+        response = await asyncio.wait_for(jobs.wait(follower), 1)
+
+        self.assertEqual(follower.state, CANCELLED)
+        self.assertFalse(response['success'])
+        self.assertEqual(response['nfev'], 0)
+        self.assertFalse(leader.finished)
+        self.assertEqual(jobs.scheduler.n_running, running - 1)
+        jobs.cancel(leader.id)
+        await jobs.wait(leader)
+
+    async def test_warm_start_is_not_cached(self):
+        jobs = JobManager('TEST-SID')
+        await jobs.wait(jobs.submit(create_request()))
+        request_dict = json.loads(create_request())
+        request_dict['warm_start'] = True
+
+        for _ in range(2):
+            response = await jobs.wait(jobs.submit(json.dumps(request_dict)))
+            self.assertNotIn('cached', response)
+            self.assertIn('warm_start', response)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import asyncio
+
+from peak_prophet_server.scheduler import FitScheduler, ServerBusy
+
+
+class TestFitScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_start_right_away(self):
+        scheduler = FitScheduler(max_running=2)
+        tickets = [scheduler.reserve('a'), scheduler.reserve('b')]
+
+        for ticket in tickets:
+            await scheduler.acquire(ticket)
+            self.assertTrue(ticket.started)
+            self.assertIsNone(ticket.position)
+        self.assertEqual(scheduler.n_running, 2)
+        self.assertEqual(scheduler.n_queued, 0)
+
+    async def test_round_robin(self):
+        scheduler = FitScheduler(max_running=1)
+        first = scheduler.reserve('a')
+        batch = [scheduler.reserve('a') for _ in range(3)]
+        other = scheduler.reserve('b')
+
+        self.assertTrue(first.started)
+        self.assertEqual([ticket.position for ticket in batch], [0, 2, 3])
+        self.assertEqual(other.position, 1)
+
+        order = []
+        for _ in range(4):
+            running = first if not order else order[-1]
+            scheduler.release(running)
+            order.append(next(ticket for ticket in batch + [other] if ticket.started and not ticket.released))
+        self.assertEqual(order, [batch[0], other, batch[1], batch[2]])
+
+    async def test_session_limit(self):
+        scheduler = FitScheduler(max_running=4, session_running=2)
+        tickets = [scheduler.reserve('a') for _ in range(3)]
+        other = scheduler.reserve('b')
+
+        self.assertEqual([ticket.started for ticket in tickets], [True, True, False])
+        self.assertTrue(other.started)
+        self.assertEqual(scheduler.n_running, 3)
+
+        scheduler.release(tickets[0])
+        self.assertTrue(tickets[2].started)
+
+    async def test_reject_when_queue_is_full(self):
+        scheduler = FitScheduler(max_running=1, max_queued=2, session_queued=1)
+        scheduler.reserve('a')
+        scheduler.reserve('a')
+        with self.assertRaises(ServerBusy):
+            scheduler.reserve('a')
+        scheduler.reserve('b')
+        with self.assertRaises(ServerBusy):
+            scheduler.reserve('c')
+        self.assertEqual(scheduler.n_rejected, 2)
+        self.assertEqual(scheduler.stats()['queued'], 2)
+
+    async def test_cancel(self):
+        scheduler = FitScheduler(max_running=1)
+        running = scheduler.reserve('a')
+        queued = scheduler.reserve('b')
+        waiting = asyncio.create_task(scheduler.acquire(queued))
+        await asyncio.sleep(0)
+
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(scheduler.n_queued, 0)
+        self.assertIsNone(queued.position)
+
+        scheduler.cancel(running)
+        self.assertEqual(scheduler.n_running, 0)
+
+    async def test_estimated_wait(self):
+        scheduler = FitScheduler(max_running=1)
+        running = scheduler.reserve('a')
+        queued = [scheduler.reserve('b') for _ in range(2)]
+        self.assertIsNone(queued[0].estimated_wait)
+
+        await asyncio.sleep(0.01)
+        scheduler.release(running)
+        self.assertGreater(scheduler.average_duration, 0)
+        self.assertEqual(queued[0].estimated_wait, 0.0)
+        self.assertAlmostEqual(queued[1].estimated_wait, scheduler.average_duration)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import unittest
+import json
+
+import numpy as np
+
+from peak_prophet_server.schema import decode_request, SchemaError
+
+
+def create_request_dict():
+    return {
+        'pattern': {'x': [0, 1, 2, 3], 'y': [1, 2, 1, 0.5]},
+        'peaks': [{'type': 'Gaussian',
+                   'parameters': [{'name': 'amplitude', 'value': 1},
+                                  {'name': 'center', 'value': 1, 'vary': False},
+                                  {'name': 'fwhm', 'value': 0.5, 'min': 0.1, 'max': None}]}],
+        'background': {'type': 'linear',
+                       'parameters': [{'name': 'intercept', 'value': 0}, {'name': 'slope', 'value': 0}]},
+    }
+
+
+class TestDecodeRequest(unittest.TestCase):
+    def assert_schema_error(self, request_dict, path, series=False):
+        with self.assertRaises(SchemaError) as context:
+            decode_request(json.dumps(request_dict), series)
+        self.assertEqual(context.exception.path, path)
+
+    def test_decode(self):
+        data_dict = decode_request(json.dumps(create_request_dict()))
+
+        self.assertIsInstance(data_dict['pattern']['x'], np.ndarray)
+        self.assertEqual(data_dict['pattern']['x'].dtype, np.float64)
+        np.testing.assert_array_equal(data_dict['pattern']['y'], [1, 2, 1, 0.5])
+        amplitude, center, fwhm = data_dict['peaks'][0]['parameters']
+        self.assertEqual(amplitude, {'name': 'amplitude', 'value': 1, 'vary': True, 'min': None, 'max': None})
+        self.assertFalse(center['vary'])
+        self.assertEqual(fwhm['min'], 0.1)
+        self.assertEqual(data_dict['peaks'][0]['type'], 'Gaussian')
+
+    def test_decode_binary_request(self):
+        request_dict = create_request_dict()
+        del request_dict['pattern']
+        request = {'request': json.dumps(request_dict), 'x': np.arange(3, dtype='<f4').tobytes(),
+                   'y': np.ones(3, dtype='<f4').tobytes(), 'dtype': 'float32'}
+
+        data_dict = decode_request(request)
+
+        self.assertEqual(data_dict['pattern']['x'].dtype, np.float64)
+        np.testing.assert_array_equal(data_dict['pattern']['x'], [0, 1, 2])
+
+    def test_decode_series(self):
+        request_dict = create_request_dict()
+        request_dict['patterns'] = [request_dict.pop('pattern')] * 2
+        self.assertEqual(len(decode_request(json.dumps(request_dict), series=True)['patterns']), 2)
+
+        request_dict['patterns'] = []
+        self.assert_schema_error(request_dict, 'patterns', series=True)
+
+    def test_pattern_errors(self):
+        request_dict = create_request_dict()
+        del request_dict['pattern']
+        self.assert_schema_error(request_dict, '')
+
+        request_dict = create_request_dict()
+        request_dict['pattern']['y'] = [1, 2, 'a', 4]
+        self.assert_schema_error(request_dict, 'pattern.y')
+
+        request_dict['pattern']['y'] = [1, 2, 3]
+        self.assert_schema_error(request_dict, 'pattern.y')
+
+        request_dict['pattern']['y'] = [[1, 2], [3, 4]]
+        self.assert_schema_error(request_dict, 'pattern.y')
+
+        request_dict['pattern'] = {'x': [1, 2]}
+        self.assert_schema_error(request_dict, 'pattern')
+
+        request_dict['pattern'] = {'id': 5}
+        self.assert_schema_error(request_dict, 'pattern.id')
+
+    def test_peak_errors(self):
+        request_dict = create_request_dict()
+        request_dict['peaks'][0]['type'] = 'voigt'
+        self.assert_schema_error(request_dict, 'peaks[0].type')
+
+        request_dict = create_request_dict()
+        request_dict['peaks'][0]['parameters'][1]['value'] = 'a'
+        self.assert_schema_error(request_dict, 'peaks[0].parameters[1].value')
+
+        request_dict = create_request_dict()
+        request_dict['peaks'][0]['parameters'][1]['vary'] = 'yes'
+        self.assert_schema_error(request_dict, 'peaks[0].parameters[1].vary')
+
+        request_dict = create_request_dict()
+        request_dict['peaks'][0]['parameters'][2]['max'] = 0.05
+        self.assert_schema_error(request_dict, 'peaks[0].parameters[2]')
+
+        request_dict = create_request_dict()
+        del request_dict['peaks'][0]['parameters'][2]
+        self.assert_schema_error(request_dict, 'peaks[0].parameters')
+
+        request_dict = create_request_dict()
+        request_dict['peaks'][0]['parameters'].append({'name': 'height', 'value': 1})
+        self.assert_schema_error(request_dict, 'peaks[0].parameters')
+
+        request_dict = create_request_dict()
+        request_dict['peaks'][0]['parameters'].append({'name': 'center', 'value': 1})
+        self.assert_schema_error(request_dict, 'peaks[0].parameters')
+
+    def test_optional_fraction(self):
+        request_dict = create_request_dict()
+        request_dict['peaks'][0]['type'] = 'pseudovoigt'
+        decode_request(json.dumps(request_dict))
+
+        request_dict['peaks'][0]['parameters'].append({'name': 'fraction', 'value': 0.5})
+        self.assertEqual(len(decode_request(json.dumps(request_dict))['peaks'][0]['parameters']), 4)
+
+    def test_background_errors(self):
+        request_dict = create_request_dict()
+        request_dict['background']['type'] = 'cubic'
+        self.assert_schema_error(request_dict, 'background.type')
+
+        request_dict['background'] = {'type': 'polynomial', 'degree': 1.5, 'parameters': []}
+        self.assert_schema_error(request_dict, 'background.degree')
+
+        request_dict['background'] = {'type': 'polynomial', 'degree': 1, 'parameters': [{'name': 'c0', 'value': 1}]}
+        self.assert_schema_error(request_dict, 'background.parameters')
+
+    def test_option_errors(self):
+        for key, value in (('engine', 'fast'), ('chunks', 0), ('regions', 5), ('multiresolution', 'on'),
+                           ('profile', 'yes')):
+            request_dict = create_request_dict()
+            request_dict[key] = value
+            self.assert_schema_error(request_dict, key)
+
+    def test_regions_with_multiresolution(self):
+        request_dict = create_request_dict()
+        request_dict['regions'] = {'radius': 3}
+        request_dict['multiresolution'] = True
+        self.assert_schema_error(request_dict, 'multiresolution')
+
+        request_dict['multiresolution'] = False
+        self.assertFalse(decode_request(json.dumps(request_dict))['multiresolution'])
+
+    def test_solver(self):
+        for solver in ('least_squares', {'method': 'leastsq', 'ftol': 1e-6, 'max_nfev': 100, 'x_scale': 2},
+                       {'method': 'least_squares', 'ftol': 0, 'xtol': 0}):
+            request_dict = create_request_dict()
+            request_dict['solver'] = solver
+            self.assertEqual(decode_request(json.dumps(request_dict))['solver'], solver)
+
+        for solver, path in (('lm', 'solver'), (1, 'solver'), ({'method': 'bfgs'}, 'solver.method'),
+                             ({'ftol': -1}, 'solver.ftol'), ({'gtol': 'small'}, 'solver.gtol'),
+                             ({'max_nfev': 0}, 'solver.max_nfev'), ({'x_scale': 0}, 'solver.x_scale'),
+                             ({'x_scale': 'auto'}, 'solver.x_scale'),
+                             ({'method': 'least_squares', 'ftol': 0, 'xtol': 0, 'gtol': 0}, 'solver')):
+            request_dict = create_request_dict()
+            request_dict['solver'] = solver
+            self.assert_schema_error(request_dict, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
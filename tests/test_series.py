@@ -0,0 +1,97 @@
+import unittest
+import json
+
+import numpy as np
+from lmfit.lineshapes import gaussian
+
+from peak_prophet_server.data_reader import convert_gaussian_fwhm_to_sigma
+from peak_prophet_server.fitting import FitManager
+
+N_PATTERNS = 6
+
+
+def create_series_request(n_patterns=N_PATTERNS):
+    x = np.linspace(0, 10, 1001)
+    patterns = []
+    for i in range(n_patterns):
+        # a peak moving to higher x and growing
+        y = 1 + 0.1 * x + gaussian(x, 10 + i, 4 + 0.1 * i, convert_gaussian_fwhm_to_sigma(0.3))
+        patterns.append({'x': x.tolist(), 'y': y.tolist()})
+    return {
+        'patterns': patterns,
+        'peaks': [{'type': 'gaussian',
+                   'parameters': [{'name': 'amplitude', 'value': 8, 'vary': True, 'min': None, 'max': None},
+                                  {'name': 'center', 'value': 3.9, 'vary': True, 'min': None, 'max': None},
+                                  {'name': 'fwhm', 'value': 0.4, 'vary': True, 'min': None, 'max': None}]}],
+        'background': {'type': 'linear',
+                       'parameters': [{'name': 'intercept', 'value': 0}, {'name': 'slope', 'value': 0}]},
+    }
+
+
+class TestSeries(unittest.IsolatedAsyncioTestCase):
+    def check_responses(self, responses):
+        self.assertEqual(len(responses), N_PATTERNS)
+        for i, response in enumerate(responses):
+            self.assertTrue(response['success'])
+            self.assertEqual(response['index'], i)
+            amplitude, center, fwhm = response['result']['peaks'][0]['parameters']
+            self.assertAlmostEqual(amplitude['value'], 10 + i, delta=1e-4)
+            self.assertAlmostEqual(center['value'], 4 + 0.1 * i, delta=1e-6)
+            self.assertAlmostEqual(fwhm['value'], 0.3, delta=1e-6)
+
+    async def test_sequential_series(self):
+        streamed = []
+
+        async def on_result(response):
+            streamed.append(response['index'])
+
+        responses = await FitManager('TEST-SID').process_series(json.dumps(create_series_request()), on_result)
+
+        self.check_responses(responses)
+        self.assertEqual(streamed, list(range(N_PATTERNS)))
+
+    async def test_series_starts_from_the_previous_result(self):
+        request = create_series_request()
+        request['patterns'] = [request['patterns'][0]] * 3
+        responses = await FitManager('TEST-SID').process_series(json.dumps(request))
+
+        self.assertGreater(responses[0]['nfev'], responses[1]['nfev'])
+
+    async def test_series_in_chunks(self):
+        request = create_series_request()
+        request['chunks'] = 2
+        streamed = []
+
+        async def on_result(response):
+            streamed.append(response['index'])
+
+        responses = await FitManager('TEST-SID').process_series(json.dumps(request), on_result)
+
+        self.check_responses(responses)
+        self.assertEqual(sorted(streamed), list(range(N_PATTERNS)))
+
+    async def test_series_in_process(self):
+        request = create_series_request()
+        request['chunks'] = 3
+        fit_manager = FitManager('TEST-SID')
+        fit_manager.backend = 'process'
+        self.check_responses(await fit_manager.process_series(json.dumps(request)))
+
+    async def test_binary_series(self):
+        request = create_series_request()
+        patterns = request.pop('patterns')
+        binary_request = {
+            'request': json.dumps(request),
+            'patterns': [{'x': np.array(pattern['x'], dtype='<f8').tobytes(),
+                          'y': np.array(pattern['y'], dtype='<f8').tobytes()} for pattern in patterns],
+        }
+        self.check_responses(await FitManager('TEST-SID').process_series(binary_request))
+
+    async def test_stopped_series(self):
+        fit_manager = FitManager('TEST-SID')
+
+        async def on_result(response):
+            fit_manager.stop = True
+
+        responses = await fit_manager.process_series(json.dumps(create_series_request()), on_result)
+        self.assertEqual(sum(response is not None for response in responses), 1)
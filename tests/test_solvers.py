@@ -0,0 +1,85 @@
+import unittest
+import json
+
+import numpy as np
+
+from peak_prophet_server.data_reader import read_data
+from peak_prophet_server.fitting import FitManager
+from peak_prophet_server.result_cache import result_cache
+from peak_prophet_server.solvers import solver_options, fit_arguments
+from tests.helpers import create_request
+
+
+class TestSolverOptions(unittest.TestCase):
+    def test_defaults(self):
+        self.assertEqual(solver_options(None), {'method': 'leastsq', 'ftol': 1.49012e-08, 'xtol': 1.49012e-08,
+                                                'gtol': 0.0, 'max_nfev': None, 'x_scale': 'jac'})
+        options = solver_options('least_squares')
+        self.assertEqual(options['method'], 'least_squares')
+        self.assertEqual(options['gtol'], 1e-08)
+        options = solver_options({'method': 'least_squares', 'ftol': 1e-4, 'max_nfev': 50, 'x_scale': 2})
+        self.assertEqual((options['ftol'], options['xtol'], options['max_nfev'], options['x_scale']),
+                         (1e-4, 1e-08, 50, 2))
+
+    def test_fit_arguments(self):
+        _, _, params = read_data(create_request([4]), flat=True)
+        params['bkg_slope'].set(vary=False)
+
+        arguments = fit_arguments(solver_options({'method': 'least_squares', 'x_scale': 2}), params)
+        self.assertEqual(arguments['method'], 'least_squares')
+        self.assertEqual(arguments['fit_kws']['x_scale'], 2)
+        self.assertNotIn('diag', fit_arguments(solver_options(None), params)['fit_kws'])
+        arguments = fit_arguments(solver_options({'x_scale': 2}), params)
+        np.testing.assert_array_equal(arguments['fit_kws']['diag'], [0.5] * 4)
+
+
+class TestSolverFit(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        result_cache.clear()
+
+    async def fit(self, solver, engine='flat'):
+        request = create_request([4, 5, 15])
+        request['pattern']['y'] = (np.array(request['pattern']['y']) +
+                                   np.random.default_rng(0).normal(0, 0.1, 3001)).tolist()
+        request['engine'] = engine
+        if solver is not None:
+            request['solver'] = solver
+        return await FitManager('TEST-SID').process_request(json.dumps(request))
+
+    async def test_least_squares_matches_leastsq(self):
+        for engine in ('flat', 'lmfit'):
+            expected = await self.fit(None, engine)
+            response = await self.fit({'method': 'least_squares', 'x_scale': 1.0}, engine)
+
+            self.assertTrue(response['success'])
+            self.assertEqual(expected['solver']['method'], 'leastsq')
+            self.assertEqual(response['solver'], solver_options({'method': 'least_squares', 'x_scale': 1.0}))
+            for expected_peak, peak in zip(expected['result']['peaks'], response['result']['peaks']):
+                for expected_parameter, parameter in zip(expected_peak['parameters'], peak['parameters']):
+                    self.assertAlmostEqual(parameter['value'], expected_parameter['value'],
+                                           delta=1e-3 * expected_parameter['error'])
+                    self.assertAlmostEqual(parameter['error'], expected_parameter['error'],
+                                           delta=1e-2 * expected_parameter['error'])
+
+    async def test_flat_least_squares_uses_the_jacobian(self):
+        response = await self.fit('least_squares')
+        self.assertLess(response['nfev'], 20)
+
+    async def test_max_nfev(self):
+        response = await self.fit({'max_nfev': 2}, 'lmfit')
+
+        self.assertFalse(response['success'])
+        self.assertEqual(response['solver']['max_nfev'], 2)
+        self.assertLessEqual(response['nfev'], 2)
+
+    async def test_loose_tolerances(self):
+        expected = await self.fit(None)
+        response = await self.fit({'ftol': 1e-3, 'xtol': 1e-3})
+
+        self.assertTrue(response['success'])
+        self.assertLessEqual(response['nfev'], expected['nfev'])
+        self.assertAlmostEqual(response['chi2'], expected['chi2'], delta=1e-3 * expected['chi2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+import asyncio
+import tempfile
+from unittest import mock
+
+from peak_prophet_server import state
+from peak_prophet_server.jobs import JobManager, CANCELLED, DONE
+from peak_prophet_server.result_cache import result_cache
+from peak_prophet_server.state import InMemoryStateBackend, LocalIPCStateBackend, create_state_backend
+from tests.test_jobs import create_request, wait_for_progress
+
+
+class TestInMemoryStateBackend(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        # the tests need running fits, not cached responses
+        result_cache.clear()
+
+    async def test_job_commands(self):
+        state = InMemoryStateBackend()
+        jobs = JobManager('TEST-SID', state=state)
+        job = jobs.submit(create_request())
+        await jobs.wait(job)
+
+        self.assertEqual(state.owner(job.id), state.process_id)
+        self.assertEqual((await state.job_command(job.id, 'status'))['state'], DONE)
+        self.assertIn('chi2', await state.job_command(job.id, 'progress'))
+        with self.assertRaises(ValueError):
+            await state.job_command(job.id, 'unknown')
+        with self.assertRaises(ValueError):
+            await state.job_command('unknown', 'status')
+
+    async def test_close_unregisters_jobs(self):
+        state = InMemoryStateBackend()
+        jobs = JobManager('TEST-SID', state=state)
+        job = jobs.submit(create_request())
+        await jobs.wait(job)
+
+        jobs.close()
+        self.assertIsNone(state.owner(job.id))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_state_backend('unknown')
+
+
+class TestLocalIPCStateBackend(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        result_cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        # two server processes sharing the state directory
+        self.owner = LocalIPCStateBackend(self.directory.name)
+        self.other = LocalIPCStateBackend(self.directory.name)
+        await self.owner.start()
+        await self.other.start()
+
+    async def asyncTearDown(self):
+        await self.owner.close()
+        await self.other.close()
+        self.directory.cleanup()
+
+    async def test_route_commands_to_the_owner(self):
+        jobs = JobManager('TEST-SID', state=self.owner)
+        job = jobs.submit(create_request(30, 30000))
+        await wait_for_progress(job)
+
+        self.assertEqual(self.other.owner(job.id), self.owner.process_id)
+        status = await self.other.job_command(job.id, 'status')
+        self.assertEqual(status['job_id'], job.id)
+        progress = await self.other.job_command(job.id, 'progress')
+        self.assertEqual(len(progress['result']['peaks']), 30)
+
+        await self.other.job_command(job.id, 'cancel')
+        await jobs.wait(job)
+        self.assertEqual(job.state, CANCELLED)
+        self.assertEqual((await self.other.job_command(job.id, 'status'))['state'], CANCELLED)
+
+    async def test_unknown_job(self):
+        with self.assertRaises(ValueError):
+            await self.other.job_command('unknown', 'status')
+        with self.assertRaises(ValueError):
+            await self.other.job_command('../unknown', 'status')
+
+    async def test_owner_not_available(self):
+        jobs = JobManager('TEST-SID', state=self.owner)
+        job = jobs.submit(create_request())
+        await jobs.wait(job)
+        await self.owner.close()
+
+        with self.assertRaises(ValueError):
+            await self.other.job_command(job.id, 'status')
+
+    async def test_owner_does_not_answer(self):
+        async def ignore(reader, writer):
+            await reader.read()
+            writer.close()
+
+        # a process which accepts the connection but never replies
+        server = await asyncio.start_unix_server(ignore, path=self.owner.socket_path('silent'))
+        with open(self.owner.job_path('silent-job'), 'w') as f:
+            f.write('silent')
+        try:
+            with mock.patch.object(state, 'CALL_TIMEOUT', 0.1):
+                with self.assertRaises(ValueError):
+                    await self.other.job_command('silent-job', 'status')
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    async def test_errors_of_the_owner_are_returned(self):
+        jobs = JobManager('TEST-SID', state=self.owner)
+        job = jobs.submit(create_request())
+        await jobs.wait(job)
+
+        with self.assertRaises(ValueError):
+            await self.other.job_command(job.id, 'unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+import copy
+import json
+
+from peak_prophet_server.fitting import FitManager
+from peak_prophet_server.warm_start import model_dict, seed_parameters, fix_distant_peaks, update_values, \
+    warm_start_options
+from tests.helpers import create_request, peak_dict
+
+CENTERS = [5 + 6 * i for i in range(6)]
+# the pattern of the requests, with start values which are a bit off
+PATTERN = {'n_points': 2001, 'x_max': 40, 'fwhm': 0.5, 'intercept': 1, 'shift': 0.2,
+           'start': {'fwhm': 0.8, 'amplitude': 8, 'intercept': 0.5}}
+
+
+def result_of(data_dict, value=1.0):
+    return {'background': {'parameters': [{'name': p['name'], 'value': value}
+                                          for p in data_dict['background']['parameters']]},
+            'peaks': [{'parameters': [{'name': p['name'], 'value': value} for p in peak['parameters']]}
+                      for peak in data_dict['peaks']]}
+
+
+class TestWarmStart(unittest.TestCase):
+    def test_options(self):
+        self.assertIsNone(warm_start_options(None))
+        self.assertIsNone(warm_start_options(False))
+        self.assertEqual(warm_start_options(True), {'local_pass': False, 'radius': 5})
+        self.assertEqual(warm_start_options({'local_pass': False, 'radius': 2}), {'local_pass': False, 'radius': 2})
+        with self.assertRaises(ValueError):
+            warm_start_options({'radius': 0})
+
+    def test_model_dict_does_not_change_the_input(self):
+        data_dict = create_request([10], **PATTERN)
+        copied = model_dict(data_dict)
+        copied['peaks'][0]['parameters'][0]['value'] = 100
+        self.assertNotIn('pattern', copied)
+        self.assertEqual(data_dict['peaks'][0]['parameters'][0]['value'], 8)
+
+    def test_unchanged_parameters_are_seeded(self):
+        previous = model_dict(create_request([10, 20], **PATTERN))
+        data_dict = model_dict(create_request([10, 20, 30], **PATTERN))
+        data_dict['peaks'][1]['parameters'][1]['value'] = 21
+
+        seeded, changed_peaks = seed_parameters(data_dict, previous, result_of(previous))
+
+        # 2 background parameters, 3 of the first peak and amplitude and fwhm of the second one
+        self.assertEqual(seeded, 7)
+        self.assertEqual(changed_peaks, [1, 2])
+        self.assertEqual(data_dict['peaks'][0]['parameters'][1]['value'], 1.0)
+        self.assertEqual(data_dict['peaks'][1]['parameters'][1]['value'], 21)
+        self.assertEqual(data_dict['peaks'][2]['parameters'][1]['value'], 30.2)
+
+    def test_previous_result_sent_back_is_seeded(self):
+        previous = model_dict(create_request([10], **PATTERN))
+        data_dict = model_dict(previous)
+        result = result_of(previous, value=2.0)
+        update_values(data_dict, result)
+        data_dict['peaks'][0]['parameters'][0]['value'] = 2.0000001
+        data_dict['peaks'][0]['parameters'][1]['vary'] = False
+
+        seeded, changed_peaks = seed_parameters(data_dict, previous, result)
+
+        self.assertEqual(seeded, 4)
+        self.assertEqual(changed_peaks, [0])
+        self.assertEqual(data_dict['peaks'][0]['parameters'][0]['value'], 2.0)
+
+    def test_changed_peak_type(self):
+        previous = model_dict(create_request([10], **PATTERN))
+        data_dict = copy.deepcopy(previous)
+        data_dict['peaks'][0]['type'] = 'lorentzian'
+        self.assertEqual(seed_parameters(data_dict, previous, result_of(previous)), (2, [0]))
+
+    def test_distant_peaks_are_fixed(self):
+        data_dict = model_dict(create_request([10, 12, 20, 40], **PATTERN))
+        local_dict, fixed = fix_distant_peaks(data_dict, [0], radius=5)
+
+        self.assertEqual(fixed, 2)
+        self.assertEqual([all(p['vary'] for p in peak['parameters']) for peak in local_dict['peaks']],
+                         [True, True, False, False])
+        self.assertTrue(all(p['vary'] for p in data_dict['peaks'][3]['parameters']))
+
+
+class TestWarmStartFit(unittest.IsolatedAsyncioTestCase):
+    async def test_refit_with_an_added_peak(self):
+        request = create_request(CENTERS, **PATTERN)
+        request['peaks'] = request['peaks'][:-1]
+        fit_manager = FitManager('TEST-SID')
+        first_response = await fit_manager.process_request(json.dumps(request))
+        self.assertTrue(first_response['success'])
+
+        request = create_request(CENTERS, **PATTERN)
+        request['warm_start'] = {'local_pass': True}
+        warm_response = await fit_manager.process_request(json.dumps(request))
+        cold_response = await FitManager('TEST-SID').process_request(json.dumps(request))
+
+        self.assertTrue(warm_response['success'])
+        info = warm_response['warm_start']
+        self.assertEqual(info['seeded'], 2 + 3 * (len(CENTERS) - 1))
+        self.assertEqual(info['fixed_peaks'], len(CENTERS) - 1)
+        self.assertGreater(info['local_nfev'], 0)
+        self.assertGreater(warm_response['nfev'], info['local_nfev'])
+        for warm_peak, cold_peak in zip(warm_response['result']['peaks'], cold_response['result']['peaks']):
+            for warm, cold in zip(warm_peak['parameters'], cold_peak['parameters']):
+                self.assertAlmostEqual(warm['value'], cold['value'], delta=1e-4)
+
+    async def test_warm_start_needs_fewer_evaluations(self):
+        request = create_request(CENTERS, **PATTERN)
+        request['peaks'] = request['peaks'][:-1]
+        fit_manager = FitManager('TEST-SID')
+        await fit_manager.process_request(json.dumps(request))
+
+        # the added peak starts close to the pattern, the others from the same rough values as before
+        request = create_request(CENTERS, **PATTERN)
+        request['peaks'][-1] = peak_dict(CENTERS[-1] + 0.02, fwhm=0.52, amplitude=15)
+        request['warm_start'] = True
+        warm_response = await fit_manager.process_request(json.dumps(request))
+        cold_response = await FitManager('TEST-SID').process_request(json.dumps(request))
+
+        self.assertTrue(warm_response['success'])
+        self.assertTrue(cold_response['success'])
+        self.assertLess(warm_response['nfev'], cold_response['nfev'])
+
+    async def test_first_fit_with_warm_start_is_a_cold_start(self):
+        request = create_request(CENTERS[:2], **PATTERN)
+        request['warm_start'] = {'local_pass': False}
+        response = await FitManager('TEST-SID').process_request(json.dumps(request))
+        self.assertTrue(response['success'])
+        self.assertNotIn('warm_start', response)
@@ -0,0 +1,41 @@
+import unittest
+import json
+import subprocess
+import sys
+
+from peak_prophet_server.data_reader import model_cache
+from peak_prophet_server.metrics import metrics_app
+from peak_prophet_server.warmup import Readiness, warm_up, run_warm_up, with_readiness
+from tests.test_metrics import get
+
+
+class TestWarmUp(unittest.IsolatedAsyncioTestCase):
+    def test_socket_path_does_not_import_lmfit(self):
+        code = 'import sys, run; print(any(name in sys.modules for name in ("lmfit", "scipy")))'
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), 'False')
+
+    def test_warm_up_fills_model_cache(self):
+        model_cache.clear()
+        self.assertGreater(warm_up(), 0)
+        self.assertGreater(len(model_cache), 0)
+
+    async def test_ready_after_warm_up(self):
+        state = Readiness()
+        app = with_readiness(metrics_app, state)
+
+        status, body = await get(app, '/ready')
+        self.assertEqual(status, 503)
+        self.assertFalse(json.loads(body)['ready'])
+
+        await run_warm_up(state)
+
+        status, body = await get(app, '/ready')
+        self.assertEqual(status, 200)
+        self.assertGreater(json.loads(body)['warm_up_seconds'], 0)
+        status, _ = await get(app, '/metrics')
+        self.assertEqual(status, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+import asyncio
+import json
+
+import numpy as np
+from lmfit.models import LinearModel, GaussianModel
+
+from peak_prophet_server.data_reader import convert_gaussian_fwhm_to_sigma
+from peak_prophet_server.fitting import FitManager
+from peak_prophet_server.schema import decode_request
+from peak_prophet_server.workers import SharedArrays, SharedProgress, fit_arrays
+from tests.helpers import create_request
+
+
+class TestSharedMemory(unittest.TestCase):
+    def test_shared_arrays(self):
+        x = np.linspace(0, 1, 11)
+        y = np.arange(11.0)
+        shared = SharedArrays.from_arrays(x, y)
+        attached = SharedArrays(*shared.handle)
+
+        np.testing.assert_array_equal(attached.arrays[0], x)
+        np.testing.assert_array_equal(attached.arrays[1], y)
+
+        attached.arrays[1][0] = 100
+        self.assertEqual(shared.arrays[1][0], 100)
+
+        attached.release()
+        shared.release()
+
+    def test_shared_progress(self):
+        progress = SharedProgress(3, 5)
+        attached = SharedProgress.attach(progress.handle)
+
+        self.assertIsNone(progress.read())
+
+        attached.write(4, 2.5, [1, 2, 3], np.ones(5))
+        iteration, chi2, values, resid = progress.read()
+        self.assertEqual(iteration, 4)
+        self.assertEqual(chi2, 2.5)
+        np.testing.assert_array_equal(values, [1, 2, 3])
+        np.testing.assert_array_equal(resid, np.ones(5))
+
+        self.assertFalse(attached.stop)
+        progress.stop = True
+        self.assertTrue(attached.stop)
+
+        attached.release()
+        progress.release()
+
+
+class TestFitArrays(unittest.TestCase):
+    def test_fit_without_uncertainties(self):
+        data_dict = decode_request(json.dumps(create_request([5, 12])))
+        x, y = np.array(data_dict['pattern']['x']), np.array(data_dict['pattern']['y'])
+
+        for flat in (True, False):
+            progress = SharedProgress(8, len(x))
+            result = fit_arrays(data_dict, flat, x, y, progress)
+            fast = fit_arrays(data_dict, flat, x, y, progress, calc_covar=False)
+            progress.release()
+
+            self.assertTrue(fast.success)
+            self.assertEqual(set(fast.params), set(result.params))
+            for name, param in result.params.items():
+                self.assertIsNotNone(param.stderr, msg=name)
+                self.assertIsNone(fast.params[name].stderr, msg=name)
+                self.assertAlmostEqual(fast.params[name].value, param.value, delta=1e-6, msg=name)
+
+
+class TestProcessBackend(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.pattern_x = np.linspace(0, 10, 501)
+        background_model = LinearModel(prefix='bkg_')
+        params = background_model.make_params(intercept=1, slope=0.2)
+        peak_model = GaussianModel(prefix='p0_')
+        params.update(peak_model.make_params(amplitude=10, center=2, sigma=convert_gaussian_fwhm_to_sigma(0.2)))
+        pattern_y = (background_model + peak_model).eval(params, x=self.pattern_x)
+
+        self.input_dict = {
+            'pattern': {
+                'name': 'test',
+                'x': self.pattern_x.tolist(),
+                'y': pattern_y.tolist()
+            },
+            'peaks': [
+                {
+                    'type': 'gaussian',
+                    'parameters': [
+                        {'name': 'amplitude', 'value': 10.5, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'center', 'value': 2.2, 'vary': True, 'min': None, 'max': None},
+                        {'name': 'fwhm', 'value': 0.2, 'vary': True, 'min': None, 'max': None}
+                    ]
+                },
+            ],
+            'background': {
+                'type': 'linear',
+                'parameters': [
+                    {'name': 'intercept', 'value': 1},
+                    {'name': 'slope', 'value': 0.2}
+                ]
+            }
+        }
+
+    async def test_fit_in_process(self):
+        fit_manager = FitManager("TEST-SID")
+        fit_manager.backend = "process"
+        fit_response = await fit_manager.process_request(json.dumps(self.input_dict))
+
+        self.assertTrue(fit_response['success'])
+        peak_parameters = fit_response['result']['peaks'][0]['parameters']
+        self.assertAlmostEqual(peak_parameters[0]['value'], 10, delta=1e-3)
+        self.assertAlmostEqual(peak_parameters[1]['value'], 2, delta=1e-3)
+        self.assertAlmostEqual(peak_parameters[2]['value'], 0.2, delta=1e-3)
+        self.assertIsNotNone(fit_manager.current_progress)
+        self.assertIsNone(fit_manager.shared_progress)
+
+    async def test_stop_fit_in_process(self):
+        self.input_dict['peaks'] = [
+            {
+                'type': 'gaussian',
+                'parameters': [
+                    {'name': 'amplitude', 'value': 10.5, 'vary': True, 'min': None, 'max': None},
+                    {'name': 'center', 'value': i * 0.5, 'vary': True, 'min': None, 'max': None},
+                    {'name': 'fwhm', 'value': 0.2, 'vary': True, 'min': None, 'max': None}
+                ]
+            } for i in range(30)]
+
+        fit_manager = FitManager("TEST-SID")
+        fit_manager.backend = "process"
+
+        async def stop_fit():
+            while fit_manager.current_progress is None:
+                await asyncio.sleep(0.01)
+            fit_manager.stop = True
+
+        stop_task = asyncio.create_task(stop_fit())
+        fit_response = await fit_manager.process_request(json.dumps(self.input_dict))
+        await stop_task
+
+        self.assertEqual(fit_response['success'], False)
+        self.assertEqual(len(fit_manager.current_progress['result']['peaks']), 30)